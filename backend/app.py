@@ -1,48 +1,168 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, stream_with_context
 from flask_cors import CORS
 import sqlite3
 import requests
 import random
 import os
+import time
+import hashlib
+import hmac
+import json
+import threading
+from collections import OrderedDict
+from functools import wraps
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor, wait
 import pandas as pd
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import linear_kernel
-from werkzeug.security import generate_password_hash, check_password_hash
-from database import get_db_connection, init_db
-from ingest_archive import seed_database
+from database import get_db_connection, init_db, init_app as init_db_pool
+import jobs
+import openlibrary
+import http_client
+import recommender
+import collaborative
+import search
+import content_store
+import progress_buffer
+import llm_gateway
+import feed_mirror
+import user_feeds
+import interactions
+import passwords
+import responses
+from responses import rows_response, tuple_cursor
 
 app = Flask(__name__)
-CORS(app)
+CORS_EXPOSE_HEADERS = ['ETag', 'Link', 'X-Next-Cursor', 'X-Catalog-Version', 'Server-Timing',
+                       'Accept-Ranges', 'Content-Range', 'X-Total-Pages']
+CORS_OPTIONS = {'expose_headers': CORS_EXPOSE_HEADERS}  # asgi.py applies the same options to its routes
+CORS(app, **CORS_OPTIONS)
+init_db_pool(app)  # Request-scoped pooled SQLite connections
+responses.init_app(app)  # orjson + gzip/brotli
 
-# Initialize DB on startup
+# Password hashing runs on its own process pool (forkserver-started, so threads are never inherited)
+passwords.start()
+
+# Initialize DB on startup (migrations only; a no-op once applied)
 init_db()
 
+# Anything slow runs on the background job worker, never at import or in a request
+jobs.start_worker()
+
+# Reading progress is batched; apply anything a crashed worker buffered
+progress_buffer.start()
+
 # Auto-Seed Check
 conn = get_db_connection()
-book_count = conn.execute("SELECT COUNT(*) FROM books").fetchone()[0]
+book_count = conn.execute("SELECT 1 FROM books LIMIT 1").fetchone()
 conn.close()
 
-if book_count == 0:
-    print("🌱 Database is empty. Auto-seeding...")
-    seed_database()
+if book_count is None:
+    print("🌱 Database is empty. Queueing auto-seed job...")
+    jobs.submit('seed_catalog', dedupe_key='seed_catalog')
+
+# Feed genre rows are served from a local OpenLibrary mirror; fill or refresh it out of band
+feed_mirror.request_refresh()
 
 @app.route('/health', methods=['GET'])
 def health_check():
     return jsonify({"status": "healthy", "service": "AI eBook Backend"})
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Cache and upstream counters for this worker process."""
+    return jsonify({
+        "search_cache": openlibrary.search_cache.stats(),
+        "http": http_client.stats(),
+        "progress_buffer": progress_buffer.stats(),
+        "llm": librarian.stats(),
+        "feed_mirror": feed_mirror.stats(),
+        "user_feeds": user_feeds.stats(),
+        "passwords": passwords.stats()
+    })
+
+# --- ADMIN ---
+
+ADMIN_TOKEN = os.environ.get("PAPERO_ADMIN_TOKEN")  # Unset: the admin endpoints are disabled
+
+def admin_only(view):
+    """Requires `Authorization: Bearer $PAPERO_ADMIN_TOKEN`."""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        supplied = request.headers.get('Authorization', '').encode()
+        if not ADMIN_TOKEN or not hmac.compare_digest(supplied, f"Bearer {ADMIN_TOKEN}".encode()):
+            return jsonify({"error": "Admin token required"}), 401
+        return view(*args, **kwargs)
+    return wrapped
+
 # Temp Route to Seed DB on Render
 @app.route('/api/seed_db', methods=['POST'])
+@admin_only
 def seed_db_route():
-    try:
-        # Check for simple auth key if needed, skipping for now as per user instruction context
-        print("SEEDING DATABASE...")
-        seed_database()
-        return jsonify({"success": True, "message": "Database seeded successfully"})
-    except Exception as e:
-        return jsonify({"success": False, "error": str(e)}), 500
+    job_id = jobs.submit('seed_catalog', dedupe_key='seed_catalog')
+    return jsonify({"success": True, "job_id": job_id, "status_url": f"/api/jobs/{job_id}",
+                    "message": "Seeding queued"}), 202
+
+# --- BACKGROUND JOBS API ---
+
+@app.route('/api/jobs', methods=['GET', 'POST'])
+@admin_only
+def jobs_collection():
+    if request.method == 'GET':
+        return jsonify(jobs.recent(status=request.args.get('status')))
+    
+    data = request.json or {}
+    kind = data.get('kind')
+    if kind not in jobs.HANDLERS:
+        return jsonify({"error": f"Unknown job kind. Available: {', '.join(jobs.HANDLERS)}"}), 400
+    payload = data.get('payload') or {}
+    if not isinstance(payload, dict):
+        return jsonify({"error": "'payload' must be an object"}), 400
+    unknown = set(payload) - jobs.OPTIONS[kind]
+    if unknown:
+        allowed = ', '.join(sorted(jobs.OPTIONS[kind])) or 'none'
+        return jsonify({"error": f"Unsupported options for {kind}: {', '.join(sorted(unknown))} (allowed: {allowed})"}), 400
+    # One active job per kind: resubmitting returns the job already queued/running
+    job_id = jobs.submit(kind, payload, dedupe_key=kind)
+    return jsonify({"job_id": job_id, "status_url": f"/api/jobs/{job_id}"}), 202
+
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+@admin_only
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+@app.route('/api/jobs/<int:job_id>/cancel', methods=['POST'])
+@admin_only
+def cancel_job(job_id):
+    if not jobs.cancel(job_id):
+        return jsonify({"success": False, "error": "Job is not queued or running"}), 409
+    return jsonify({"success": True, "job": jobs.get(job_id)})
 
 # --- AUTHENTICATION API ---
 
+TRUSTED_PROXIES = int(os.environ.get("PAPERO_TRUSTED_PROXIES", 0))  # Proxies that append to X-Forwarded-For
+
+def client_ip():
+    """The address the nearest trusted proxy saw. Entries left of it are client-supplied and ignored."""
+    if TRUSTED_PROXIES:
+        hops = [hop.strip() for hop in request.headers.get('X-Forwarded-For', '').split(',') if hop.strip()]
+        if len(hops) >= TRUSTED_PROXIES:
+            return hops[-TRUSTED_PROXIES]
+    return request.remote_addr
+
+def retry_later(error, retry_after, status):
+    response = jsonify({"error": error})
+    response.headers['Retry-After'] = str(max(1, int(retry_after + 0.999)))
+    return response, status
+
+@app.errorhandler(passwords.HashingBusy)
+def hashing_busy(e):
+    return retry_later("Server is busy, please try again", 1, 503)
+
 @app.route('/api/signup', methods=['POST'])
 def signup():
     data = request.json
@@ -52,12 +172,16 @@ def signup():
     
     if not email or not password:
         return jsonify({"error": "Email and password required"}), 400
-        
+
+    wait = passwords.check_rate(ip=client_ip())
+    if wait:
+        return retry_later("Too many attempts, please try again later", wait, 429)
+
+    # Hash before taking a connection; the request waits on the hashing pool, not the database
+    pwd_hash = passwords.hash_password(password)
+
     conn = get_db_connection()
     try:
-        # Create Hash
-        pwd_hash = generate_password_hash(password)
-        
         # Insert User
         cur = conn.execute('INSERT INTO users (name, email, password_hash) VALUES (?, ?, ?)', 
                            (name or split_email(email), email, pwd_hash))
@@ -78,12 +202,23 @@ def login():
     data = request.json
     email = data.get('email')
     password = data.get('password')
-    
+
+    if not email or not password:
+        return jsonify({"error": "Invalid credentials"}), 401
+
+    # Charged before the lookup and the hash, so a flood costs neither
+    wait = passwords.check_rate(email, client_ip())
+    if wait:
+        return retry_later("Too many login attempts, please try again later", wait, 429)
+
     conn = get_db_connection()
     user = conn.execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone()
     conn.close()
     
-    if user and check_password_hash(user['password_hash'], password):
+    if user and passwords.verify(user['password_hash'], password):
+        passwords.login_succeeded(email)
+        if passwords.needs_rehash(user['password_hash']):
+            passwords.rehash_later(user['id'], user['password_hash'], password)
         # Successful Login
         return jsonify({
             "success": True, 
@@ -96,8 +231,6 @@ def login():
     
     return jsonify({"error": "Invalid credentials"}), 401
 
-    return jsonify({"error": "Invalid credentials"}), 401
-
 @app.route('/api/reset_password', methods=['POST'])
 def reset_password():
     data = request.json
@@ -106,15 +239,20 @@ def reset_password():
     
     if not email or not new_password:
         return jsonify({"error": "Email and new password required"}), 400
-        
+
+    wait = passwords.check_rate(email, client_ip())
+    if wait:
+        return retry_later("Too many attempts, please try again later", wait, 429)
+
     conn = get_db_connection()
-    user = conn.execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone()
+    user = conn.execute('SELECT id FROM users WHERE email = ?', (email,)).fetchone()
+    conn.close()
     
     if not user:
-        conn.close()
         return jsonify({"error": "User not found"}), 404
         
-    pwd_hash = generate_password_hash(new_password)
+    pwd_hash = passwords.hash_password(new_password)
+    conn = get_db_connection()
     conn.execute('UPDATE users SET password_hash = ? WHERE email = ?', (pwd_hash, email))
     conn.commit()
     conn.close()
@@ -149,14 +287,82 @@ def user_stats(user_id):
 
 # --- REAL STORE API ---
 
+BOOK_FIELDS = ('id', 'ia_id', 'title', 'author', 'cover_url', 'category', 'description', 'price', 'rating', 'year')
+BOOKS_PAGE_DEFAULT = 50
+BOOKS_PAGE_MAX = 200
+
+def catalog_version(conn):
+    row = conn.execute("SELECT value FROM catalog_meta WHERE key = 'books_version'").fetchone()
+    return row['value'] if row else 0
+
 @app.route('/api/books', methods=['GET'])
 def get_books():
-    """Returns the full catalog from the database."""
+    """Returns the catalog from the database.
+    
+    Without query params this is the full catalog (as before). With any of
+    limit / cursor / fields / category / year it returns one keyset page; the
+    cursor for the next page is in the X-Next-Cursor and Link headers.
+    Responses carry a strong ETag derived from the catalog version, so an
+    unchanged page is answered with 304 without touching the books table.
+    """
+    args = request.args
+    paged = any(k in args for k in ('limit', 'cursor', 'fields', 'category', 'year'))
+    
+    fields = BOOK_FIELDS
+    if 'fields' in args:
+        wanted = [f.strip() for f in args['fields'].split(',') if f.strip()]
+        unknown = [f for f in wanted if f not in BOOK_FIELDS]
+        if unknown:
+            return jsonify({"error": f"Unknown fields: {', '.join(unknown)}"}), 400
+        fields = tuple(dict.fromkeys(['id'] + wanted)) # id is always needed for the cursor
+    
+    try:
+        limit = min(max(int(args.get('limit', BOOKS_PAGE_DEFAULT)), 1), BOOKS_PAGE_MAX) if paged else None
+        cursor = int(args.get('cursor', 0))
+        year = int(args['year']) if 'year' in args else None
+    except ValueError:
+        return jsonify({"error": "limit, cursor and year must be integers"}), 400
+    category = args.get('category')
+    
     conn = get_db_connection()
-    books = conn.execute('SELECT * FROM books').fetchall()
+    version = catalog_version(conn)
+    canonical = f"{','.join(fields)}|{limit}|{cursor}|{category}|{year}"
+    etag = f"v{version}-{hashlib.sha1(canonical.encode()).hexdigest()[:12]}"
+    
+    if responses.etag_matches(etag):
+        conn.close()
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    
+    where, params = ['id > ?'], [cursor]
+    if category:
+        where.append('category = ?')
+        params.append(category)
+    if year is not None:
+        where.append('year = ?')
+        params.append(year)
+    sql = f"SELECT {', '.join(fields)} FROM books WHERE {' AND '.join(where)} ORDER BY id"
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit + 1) # One extra row tells us whether there is a next page
+    books = tuple_cursor(conn).execute(sql, params).fetchall()
     conn.close()
-    books_list = [dict(row) for row in books]
-    return jsonify(books_list)
+    
+    has_more = limit is not None and len(books) > limit
+    books_list = [dict(zip(fields, row)) for row in books[:limit]]
+    response = app.json.response(books_list)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache' # Always revalidate; 304s are cheap
+    response.headers['X-Catalog-Version'] = str(version)
+    if has_more:
+        next_cursor = books_list[-1]['id']
+        next_args = args.to_dict()
+        next_args['cursor'] = next_cursor
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+        response.headers['Link'] = f'<{request.base_url}?{urlencode(next_args)}>; rel="next"'
+    return response
 
 @app.route('/api/read/<int:book_id>', methods=['GET'])
 def get_book_content(book_id):
@@ -175,6 +381,78 @@ def get_book_content(book_id):
         "url": f"https://archive.org/embed/{book['ia_id']}?ui=embed&wrapper=false"
     })
 
+TEXT_CACHE_CONTROL = 'no-cache'  # The URL is per book, not per text digest: revalidate with the ETag (a cheap 304)
+
+def open_book_text(book_id):
+    """ContentFile for a book's stored text, or None. Packs legacy raw .txt files on first read."""
+    conn = get_db_connection()
+    try:
+        row = conn.execute('SELECT content_path FROM books WHERE id = ?', (book_id,)).fetchone()
+        if not row or not row['content_path']:
+            return None
+        content_path = row['content_path']
+        if not os.path.exists(content_store.resolve(content_path)):
+            return None
+        if not content_store.is_store_file(content_path):
+            content_path = content_store.convert_legacy(conn, book_id, content_path)
+    finally:
+        conn.close()
+    return content_store.open_content(content_path)
+
+@app.route('/api/read/<int:book_id>/text', methods=['GET'])
+def get_book_text(book_id):
+    """Stored full text: ?page=N as JSON, or raw UTF-8 bytes honouring HTTP Range."""
+    book_text = open_book_text(book_id)
+    if book_text is None:
+        return jsonify({"error": "No text available for this book"}), 404
+
+    page = request.args.get('page', type=int)
+    if page is not None:
+        if not 1 <= page <= book_text.pages:
+            return jsonify({"error": "Page out of range", "pages": book_text.pages}), 404
+        etag = f"{book_text.etag}-p{page}"
+        if responses.etag_matches(etag):
+            response = app.response_class(status=304)
+        else:
+            start, end = book_text.page_span(page)
+            response = jsonify({
+                "book_id": book_id,
+                "page": page,
+                "pages": book_text.pages,
+                "text": book_text.read_page(page),
+                "start": start,
+                "end": end,
+            })
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = TEXT_CACHE_CONTROL
+        response.headers['X-Total-Pages'] = str(book_text.pages)
+        return response
+
+    etag = book_text.etag
+    if responses.etag_matches(etag):
+        response = app.response_class(status=304)
+    else:
+        byte_range = request.range
+        if_range = request.headers.get('If-Range')
+        # Multipart ranges are not worth supporting for reader clients; RFC 9110 allows a 200 instead
+        if byte_range is not None and len(byte_range.ranges) == 1 and (if_range is None or if_range.strip('"') == etag):
+            span = byte_range.range_for_length(book_text.size)
+            if span is None:
+                response = app.response_class(status=416)
+                response.headers['Content-Range'] = f"bytes */{book_text.size}"
+                return response
+            start, stop = span
+            response = app.response_class(book_text.read_bytes(start, stop), status=206,
+                                          mimetype='text/plain')
+            response.headers['Content-Range'] = f"bytes {start}-{stop - 1}/{book_text.size}"
+        else:
+            response = app.response_class(book_text.read_bytes(0, book_text.size), mimetype='text/plain')
+    response.set_etag(etag)
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Cache-Control'] = TEXT_CACHE_CONTROL
+    response.headers['X-Total-Pages'] = str(book_text.pages)
+    return response
+
 @app.route('/api/library', methods=['GET'])
 def get_library():
     """Returns books purchased by a specific user."""
@@ -182,6 +460,9 @@ def get_library():
     if not user_id:
         return jsonify([])
         
+    if user_id.isdigit():
+        progress_buffer.flush_for_user(int(user_id))  # Show this worker's buffered progress
+
     conn = get_db_connection()
     # Join books and purchases
     query = '''
@@ -191,63 +472,38 @@ def get_library():
         WHERE p.user_id = ?
         ORDER BY p.last_read_at DESC, p.purchase_date DESC
     '''
-    library = conn.execute(query, (user_id,)).fetchall()
+    library = tuple_cursor(conn).execute(query, (user_id,))
+    response = rows_response(library)
     conn.close()
-    return jsonify([dict(row) for row in library])
+    return response
 
 @app.route('/api/purchase', methods=['POST'])
 def purchase_book():
     data = request.json
-    user_id = data.get('user_id')
     raw_book_id = data.get('book_id')
+    try:
+        user_id = int(data.get('user_id'))  # Checked before any write; the CF model keys users by int
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "error": "user_id must be an integer"}), 400
     
     conn = get_db_connection()
-    c = conn.cursor()
-    
-    # 1. Check if this is a GLOBAL book (string ID) or LOCAL (int ID)
-    final_book_id = raw_book_id
     
-    if isinstance(raw_book_id, str) and raw_book_id.startswith('ext_'):
-        # It's a Global Book. We must importing it into our 'books' table first.
-        # We need the metadata (passed from frontend preferably, or we fetch again)
-        # For simplicity, let's assume the frontend passes the basic book details in 'book_data'
-        book_data = data.get('book_data')
-        
-        if book_data:
-            # Check if we already imported it
-            existing = c.execute("SELECT id FROM books WHERE ia_id = ?", (book_data.get('ia_id'),)).fetchone()
-            if existing:
-                final_book_id = existing['id']
-            else:
-                # Import new book
-                try:
-                    c.execute('''
-                        INSERT INTO books (ia_id, title, author, category, description, price, rating, cover_url, year)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (
-                        book_data.get('ia_id'),
-                        book_data.get('title'),
-                        book_data.get('author'),
-                        'Imported', 
-                        'Imported from Global Library',
-                        book_data.get('price'),
-                        round(random.uniform(3.8, 4.9), 1),
-                        book_data.get('cover_url'),
-                        book_data.get('year')
-                    ))
-                    final_book_id = c.lastrowid
-                except Exception as e:
-                    print(f"Import Error: {e}")
-                    conn.close()
-                    return jsonify({"success": False, "error": "Import failed"})
-        else:
-             # If frontend didn't send data, we can't save it effectively
-             conn.close()
-             return jsonify({"success": False, "error": "Missing book data for import"})
+    # 1. Global books (ext_ ids) are imported into our 'books' table first, in the same transaction.
+    # The frontend passes the basic book details in 'book_data'.
+    try:
+        final_book_id, imported = import_external_book(conn, raw_book_id, data.get('book_data'))
+    except sqlite3.Error as e:
+        print(f"Import Error: {e}")
+        conn.close()
+        return jsonify({"success": False, "error": "Import failed"})
+    if final_book_id is None:
+        # If frontend didn't send data, we can't save it effectively
+        conn.close()
+        return jsonify({"success": False, "error": "Missing book data for import"})
 
     # 2. Record Purchase
     try:
-        c.execute('INSERT INTO purchases (user_id, book_id) VALUES (?, ?)', (user_id, final_book_id))
+        conn.execute('INSERT INTO purchases (user_id, book_id) VALUES (?, ?)', (user_id, final_book_id))
         conn.commit()
         success = True
     except sqlite3.IntegrityError:
@@ -255,8 +511,11 @@ def purchase_book():
     finally:
         conn.close()
     
-    return jsonify({"success": success})
-
+    if success:
+        collaborative.record_purchase(user_id, final_book_id)
+        user_feeds.rebuild_materialized([user_id])
+        if imported:
+            on_book_imported(final_book_id)
     
     return jsonify({"success": success})
 
@@ -270,82 +529,155 @@ import os
 HF_TOKEN = "hf_" + "tHdlROpGzeTJaiAXAoqDnCpchjlWuWxZzc"
 HF_API_URL = "https://router.huggingface.co/v1/chat/completions"
 
+# Llama 3 System Prompt. search_query comes first so the book search can start while the text streams.
+LIBRARIAN_PROMPT = """
+        You are The Librarian. 
+        1. Answer the user's question naturally (briefly).
+        2. If the user asks for a book recommendation, author, or specific topic, extract a search query.
+        3. OUTPUT JSON: {"search_query": "extracted keywords or null", "text": "Your reply..."}
+        """
+CHAT_MODEL_LABEL = "llama-3.1-8b-cerebras"
+CHAT_BOOKS = 3
+
+librarian = llm_gateway.LLMGateway(url=os.environ.get('PAPERO_LLM_URL', HF_API_URL),
+                                   token=os.environ.get('HF_TOKEN', HF_TOKEN))
+CHAT_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="chat")
+
+class LibrarianTurn:
+    """One chat turn's state, shared by librarian_events() and its ASGI twin (which only do the I/O).
+    
+    Feed it the gateway's stream events; search_query is set as soon as the
+    model's search_query is parsed, so the book search can overlap with the
+    rest of the reply.
+    """
+
+    def __init__(self, user_message):
+        self.messages = librarian_messages(user_message)
+        self.deadline = time.monotonic() + librarian.timeout
+        self.search_query = None
+        self.result = None
+
+    def on_event(self, kind, value):
+        """The (event, data) to send the client for a gateway event, or None."""
+        if kind == 'query':
+            if value and self.search_query is None:
+                print(f"🤖 Smart-Search for: {value}")
+                self.search_query = value
+        elif kind == 'text':
+            return 'token', {"text": value}
+        else:
+            self.result = value
+        return None
+
+    def search_timeout(self):
+        return max(0.5, self.deadline - time.monotonic())
+
+    def search_failed(self, error):
+        print(f"Chat search failed: {error}") # The reply is still useful without books
+        return []
+
+    def closing_events(self, book_results):
+        book_results = book_results[:CHAT_BOOKS]
+        return [('books', book_results), ('done', chat_reply(self.result, book_results))]
+
+def librarian_events(user_message):
+    """Runs one chat turn. Yields (event, data): 'token' deltas, then 'books', then 'done'."""
+    turn = LibrarianTurn(user_message)
+    search_future = None
+    for kind, value in librarian.stream_chat(turn.messages, deadline=turn.deadline):
+        event = turn.on_event(kind, value)
+        if turn.search_query and search_future is None:
+            search_future = CHAT_EXECUTOR.submit(run_searches, chat_books(turn.search_query))
+        if event:
+            yield event
+
+    book_results = []
+    if search_future is not None:
+        try:
+            book_results = search_future.result(timeout=turn.search_timeout())
+        except Exception as e:
+            book_results = turn.search_failed(e)
+    yield from turn.closing_events(book_results)
+
+def librarian_messages(user_message):
+    return [
+        {"role": "system", "content": LIBRARIAN_PROMPT},
+        {"role": "user", "content": user_message},
+    ]
+
+def chat_reply(result, book_results):
+    return {
+        "text": result['text'],
+        "books": book_results,
+        "model_used": CHAT_MODEL_LABEL,
+        "cached": result['cached'],
+    }
+
+def chat_error_text(error):
+    return f"I'm having trouble connecting to the new AI brain. Error: {str(error)}"
+
+def chat_error_status(error):
+    if isinstance(error, llm_gateway.GatewayBusy):
+        return 503
+    if isinstance(error, llm_gateway.LLMTimeout):
+        return 504
+    return 500
+
+def chat_error(error):
+    """(body, status) for a chat turn that failed upstream."""
+    print(f"Chat Error: {error}")
+    return {"text": chat_error_text(error)}, chat_error_status(error)
+
+def chat_request_message(data):
+    """The user's message from a chat request body, or None if there isn't one."""
+    return (data or {}).get('message') or None
+
+CHAT_NO_MESSAGE = {"error": "No message provided"}
+
 @app.route('/api/chat', methods=['POST'])
 def chat_librarian():
-    data = request.json
-    user_message = data.get('message', '')
-    history = data.get('history', []) 
-
+    user_message = chat_request_message(request.json)
     if not user_message:
-        return jsonify({"error": "No message provided"}), 400
+        return jsonify(CHAT_NO_MESSAGE), 400
 
     try:
-        # Llama 3 System Prompt
-        sys_prompt = """
-        You are The Librarian. 
-        1. Answer the user's question naturally (briefly).
-        2. If the user asks for a book recommendation, author, or specific topic, extract a search query.
-        3. OUTPUT JSON: {"text": "Your reply...", "search_query": "extracted keywords or null"}
-        """
-        
-        # Prepare Messages
-        messages = [{"role": "system", "content": sys_prompt}]
-        messages.append({"role": "user", "content": user_message})
-
-        # Direct HTTP Request (Per User Snippet)
-        payload = {
-            "model": "meta-llama/Llama-3.1-8B-Instruct:cerebras",
-            "messages": messages,
-            "max_tokens": 500,
-            "response_format": { "type": "json_object" }
-        }
-        
-        headers = {
-            "Authorization": f"Bearer {HF_TOKEN}",
-            "Content-Type": "application/json"
-        }
-        
-        response = requests.post(HF_API_URL, headers=headers, json=payload)
-        print(f"hf_response_status: {response.status_code}") # DEPLOYMENT TRIGGER
-        response_data = response.json()
-        
-        if 'error' in response_data:
-             print(f"HF Error: {response_data}")
-             return jsonify({"text": f"AI Error: {response_data['error']['message']}"}), 500
-             
-        content = response_data['choices'][0]['message']['content']
-        
-        import json
+        reply = None
+        for kind, value in librarian_events(user_message):
+            if kind == 'done':
+                reply = value
+        return jsonify(reply)
+    except llm_gateway.LLMError as e:
+        body, status = chat_error(e)
+        return jsonify(body), status
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_librarian_stream():
+    """Same as /api/chat, as Server-Sent Events: token* -> books -> done (or error)."""
+    user_message = chat_request_message(request.json)
+    if not user_message:
+        return jsonify(CHAT_NO_MESSAGE), 400
+
+    def generate():
         try:
-            ai_data = json.loads(content)
-            final_text = ai_data.get('text', "I found some books for you.")
-            search_query = ai_data.get('search_query')
-        except:
-             # Fallback if JSON fails
-            final_text = content
-            search_query = None
-
-        book_results = []
-        if search_query and search_query != "null":
-             print(f"🤖 Smart-Search for: {search_query}")
-             book_results = search_external_logic(search_query)[:3]
-                 
-        return jsonify({
-            "text": final_text,
-            "books": book_results,
-            "model_used": "llama-3.1-8b-cerebras"
-        })
+            for kind, value in librarian_events(user_message):
+                yield sse(kind, value)
+        except llm_gateway.LLMError as e:
+            body, status = chat_error(e)
+            yield sse('error', dict(body, status=status))
 
-    except Exception as e:
-        print(f"Chat Error: {e}")
-        return jsonify({"text": f"I'm having trouble connecting to the new AI brain. Error: {str(e)}"}), 500
+    response = app.response_class(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no' # Don't let a proxy buffer the token stream
+    return response
 
-def search_external_logic(query):
-    """Refactored logic from /api/external_search to be usable by Python"""
-    url = f"https://openlibrary.org/search.json?q={query}&limit=10"
-    resp = requests.get(url)
-    data = resp.json()
-    
+def chat_books(query):
+    """Search core: the books the librarian suggests for its search_query."""
+    return chat_book_results((yield {'q': query, 'limit': 10}))
+
+def chat_book_results(data):
     books = []
     for item in data.get('docs', []):
         if 'cover_i' in item and 'title' in item:
@@ -377,13 +709,11 @@ def save_onboarding():
         # Save Genres into user_profiles
         c.execute('UPDATE user_profiles SET fav_genres = ? WHERE user_id = ?', (str(genres), user_id))
         
-        # Also seed the 'interactions' table so the AI picks it up immediately
-        for g in genres:
-            # We treat Onboarding selection as a 'onboard_interest'
-            c.execute('INSERT INTO interactions (user_id, book_id, interaction_type) VALUES (?, ?, ?)',
-                      (user_id, g, 'onboard_interest'))
-                      
-        conn.commit()
+        # Also seed the 'interactions' table so the AI picks it up immediately.
+        # We treat Onboarding selection as a 'onboard_interest'; 'on' is idempotent if they onboard twice.
+        # apply() commits the profile update in the same transaction.
+        interactions.apply(conn, [(user_id, g, 'onboard_interest', 'on') for g in genres])
+        user_feeds.rebuild_materialized([user_id])
         return jsonify({"success": True})
     except Exception as e:
         print(f"Onboarding Error: {e}")
@@ -429,73 +759,217 @@ def get_user_interests(user_id):
             
     return "bestsellers" # Fallback if nothing found
 
-def fetch_openlibrary(query, limit=20, offset=0):
+# --- SEARCH CORES ---
+# Handler logic that waits on OpenLibrary is written once, as a generator that
+# yields search params and is sent the decoded response (or has the error
+# thrown in). run_searches() drives one on the calling thread; asgi.py drives
+# the same cores on the event loop with the non-blocking client.
+
+def step_search(core, response=None, error=None):
+    """Resumes a search core: ('search', params) for its next search, or ('done', result)."""
     try:
-        # Proper encoding with params
-        params = {
-            'q': query,
-            'language': 'eng',
-            'type': 'edition',
-            'limit': limit,
-            'offset': offset,
-            'has_fulltext': 'true'
-        }
-        res = requests.get("https://openlibrary.org/search.json", params=params).json()
-        results = []
-        for doc in res.get('docs', []):
-            if 'ia' in doc and 'cover_i' in doc:
-                # Strict Language Check
-                if 'eng' not in doc.get('language', []):
-                    continue
-                    
-                # Deterministic Price
-                price_seed = sum(ord(char) for char in doc['title'])
-                price = (price_seed % 500) + 99
-                
-                results.append({
-                    'id': f"ext_{doc.get('ia')[0]}",
-                    'ia_id': doc.get('ia')[0],
-                    'title': doc.get('title'),
-                    'author': doc.get('author_name', ['Unknown'])[0],
-                    'cover_url': f"https://covers.openlibrary.org/b/id/{doc.get('cover_i')}-L.jpg",
-                    'price': price,
-                    'year': doc.get('first_publish_year', 2000),
-                    'category': query.replace('subject:', '').capitalize(), # Use query as category label
-                    'description': "Imported from Global Library"
-                })
-        return results
+        params = core.throw(error) if error is not None else core.send(response)
+    except StopIteration as done:
+        return 'done', done.value
+    return 'search', params
+
+def run_searches(core):
+    """Runs a search core to completion with the blocking client. Returns its result."""
+    response, error = None, None
+    while True:
+        state, value = step_search(core, response, error)
+        if state == 'done':
+            return value
+        try:
+            response, error = openlibrary.search(value), None
+        except Exception as e:
+            response, error = None, e
+
+def openlibrary_row(query, limit=20, offset=0):
+    """Search core: one feed row of editions for `query`, [] if upstream fails."""
+    try:
+        res = yield openlibrary.edition_params(query, limit, offset)
+        return openlibrary.edition_books(res, query)
     except Exception as e:
         print(f"Error fetching {query}: {e}")
         return []
 
+# Feed rows are fetched in parallel; a row that misses the deadline is dropped
+# from this response instead of holding up the whole page.
+FEED_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="feed")
+FEED_ROW_TIMEOUT = float(os.environ.get("PAPERO_FEED_ROW_TIMEOUT", 4.0))  # seconds
+
+def timed(fn, *args, **kwargs):
+    """Runs fn and returns (result, elapsed_ms) so each row can report its own latency."""
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+CF_MIN_RESULTS = 5 # Below this, the local model knows too little about the user
+
+def local_recommendations(user_id, limit=30):
+    """Item-item CF picks from our own purchases/likes; no external search needed."""
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return []
+    model = collaborative.live_model()  # Never fitted on the request thread; None until the job has run
+    ranked = model.recommend(user_id, n=limit) if model is not None else []
+    if not ranked:
+        return []
+    ids = [book_id for book_id, _ in ranked]
+    conn = get_db_connection()
+    rows = conn.execute(f"SELECT * FROM books WHERE id IN ({','.join('?' * len(ids))})", ids).fetchall()
+    conn.close()
+    by_id = {row['id']: dict(row) for row in rows}
+    return [by_id[book_id] for book_id in ids if book_id in by_id]
+
+def recommended_row(user_id):
+    """Search core: (row label, books). Local collaborative picks first, OpenLibrary interest search as fallback."""
+    local = local_recommendations(user_id)
+    if len(local) >= CF_MIN_RESULTS:
+        return CF_ROW_LABEL, local
+    
+    interest_query = get_user_interests(user_id)
+    return interest_row_label(interest_query), (yield from openlibrary_row(interest_query, limit=30))
+
+def fetch_recommended_row(user_id):
+    return run_searches(recommended_row(user_id))
+
+def materialized_recommended_row(user_id):
+    """(label, books) from user_feeds, or None on a first visit. Stale rows are served and rebuilt in the background."""
+    cached = user_feeds.load(user_id)
+    if cached is None:
+        return None
+    label, books, stale = cached
+    if stale:
+        user_feeds.request_rebuild(user_id)
+    return label, books
+
+def feed_recommended_row(user_id):
+    """Search core for /api/global_feed's recommended row: one indexed read once the user's row is built."""
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return (yield from recommended_row(user_id))
+    cached = materialized_recommended_row(user_id)
+    if cached is not None:
+        return cached
+    # user_feeds.build(), with the search left to the driver
+    epoch = user_feeds.begin_build(user_id)
+    start = time.perf_counter()
+    label, books = yield from recommended_row(user_id)
+    user_feeds.store(user_id, epoch, label, books, (time.perf_counter() - start) * 1000)
+    return label, books
+
+user_feeds.builder = fetch_recommended_row  # Used by the rebuild_user_feed job
+
+CF_ROW_LABEL = "Recommended (Readers like you also read)"
+
+def interest_row_label(interest_query):
+    return f"Recommended (Because you read {interest_query.replace('author:', '')})"
+
+FEED_GENRES = feed_mirror.GENRES
+
+def plan_genre_rows():
+    """[(genre, query, limit, offset)] for this response's 4 random discovery rows."""
+    rows = []
+    for genre in random.sample(FEED_GENRES, 4):
+        offset = random.randint(0, 50) # Live fallback: skip first 0-50 books to show fresh content
+        rows.append((genre, f"subject:{genre}", 15, offset))
+    return rows
+
+def mirror_genre_rows(plan):
+    """{genre: (books, elapsed_ms)} for the planned rows the local mirror can serve."""
+    rows = {}
+    conn = get_db_connection()
+    try:
+        for genre, query, limit, offset in plan:
+            start = time.perf_counter()
+            books = feed_mirror.sample(conn, genre, limit)
+            if books is not None:
+                rows[genre] = (books, (time.perf_counter() - start) * 1000)
+    finally:
+        conn.close()
+    if len(rows) < len(plan):
+        feed_mirror.request_refresh()  # Throttled; the job dedupes across workers
+    return rows
+
+def assemble_feed(row_outcomes, started):
+    """Builds the feed dict and Server-Timing header from [(name, status, result, elapsed_ms)].
+    
+    status is 'ok', 'timeout' or 'error'; the recommended row's result is (label, books).
+    """
+    feed = {}
+    timings = []
+    for name, status, result, elapsed_ms in row_outcomes:
+        metric = name.replace(' ', '-')
+        if status != 'ok':
+            timings.append(f'{metric};desc="{status}"')
+            continue
+        timings.append(f'{metric};dur={elapsed_ms:.1f}')
+        
+        if name == 'recommended':
+            label, books = result
+            # Add Recommended
+            if books:
+                feed[label] = books
+        elif result:
+            feed[name.title()] = result
+    
+    timings.append(f'total;dur={(time.perf_counter() - started) * 1000:.1f}')
+    return feed, ', '.join(timings)
+
+def plan_live_rows():
+    """(plan, local rows, {genre: search core}) for this response's genre rows; only unmirrored genres go live."""
+    plan = plan_genre_rows()
+    local = mirror_genre_rows(plan)
+    live = {genre: openlibrary_row(query, limit=limit, offset=offset)
+            for genre, query, limit, offset in plan if genre not in local}
+    return plan, local, live
+
+def finish_feed(plan, local, running, started):
+    """(feed, Server-Timing) once `running` ({row name: future or asyncio task}) has settled or timed out."""
+    outcomes = [future_outcome('recommended', running['recommended'])]
+    for genre, *_ in plan:
+        if genre in local:
+            outcomes.append((genre, 'ok') + local[genre])
+        else:
+            outcomes.append(future_outcome(genre, running[genre]))
+    return assemble_feed(outcomes, started)
+
+def future_outcome(name, future):
+    """(name, status, result, elapsed_ms) for a feed row future (or asyncio task) yielding (result, elapsed_ms)."""
+    if not future.done():
+        future.cancel()
+        return (name, 'timeout', None, 0)
+    try:
+        result, elapsed_ms = future.result()
+    except Exception as e:
+        print(f"Feed row {name} failed: {e}")
+        return (name, 'error', None, 0)
+    return (name, 'ok', result, elapsed_ms)
+
 @app.route('/api/global_feed', methods=['GET'])
 def get_global_feed():
     """Returns a rich feed of 100+ books: 1 Recommended row + 4 Random Genre rows."""
     user_id = request.args.get('user_id', 1)
+    started = time.perf_counter()
     
     # 1. AI Recommendation Row
-    interest_query = get_user_interests(user_id)
-    recommended = fetch_openlibrary(interest_query, limit=30)
+    running = {'recommended': FEED_EXECUTOR.submit(timed, run_searches, feed_recommended_row(user_id))}
     
-    # 2. Random Discovery Rows
-    all_genres = ['thriller', 'romance', 'history', 'science fiction', 'fantasy', 'biography', 'horror', 'business', 'cooking', 'art']
-    selected_genres = random.sample(all_genres, 4)
+    # 2. Random Discovery Rows: a random window of the local mirror, live only for genres not mirrored yet
+    plan, local, live = plan_live_rows()
+    for genre, core in live.items():
+        running[genre] = FEED_EXECUTOR.submit(timed, run_searches, core)
     
-    feed = {}
+    wait(running.values(), timeout=FEED_ROW_TIMEOUT)
     
-    # Add Recommended
-    if recommended:
-        label = f"Recommended (Because you read {interest_query.replace('author:', '')})"
-        feed[label] = recommended
-        
-    # Add Genres with Random Offsets (Always New)
-    for genre in selected_genres:
-        offset = random.randint(0, 50) # Skip first 0-50 books to show fresh content
-        books = fetch_openlibrary(f"subject:{genre}", limit=15, offset=offset)
-        if books:
-            feed[genre.title()] = books
-            
-    return jsonify(feed)
+    feed, server_timing = finish_feed(plan, local, running, started)
+    response = jsonify(feed)
+    response.headers['Server-Timing'] = server_timing
+    return response
 
 @app.route('/api/progress', methods=['POST'])
 def update_progress():
@@ -503,12 +977,13 @@ def update_progress():
     user_id = data.get('user_id')
     book_id = data.get('book_id')
     progress = data.get('progress')
+    try:
+        user_id, book_id = int(user_id), int(book_id)
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "error": "user_id and book_id are required"}), 400
 
-    conn = get_db_connection()
-    conn.execute('UPDATE purchases SET progress = ? WHERE user_id = ? AND book_id = ?', (progress, user_id, book_id))
-    conn.commit()
-    conn.close()
-    
+    # Coalesced with other updates for this book and written in the next batch
+    progress_buffer.record(user_id, book_id, progress=progress, touch=True)
     return jsonify({"success": True})
 
 # --- INTERACTION API (Likes & Comments) ---
@@ -523,77 +998,135 @@ def interact():
     
     conn = get_db_connection()
     try:
-        # Check if already interacted
-        existing = conn.execute('SELECT id FROM interactions WHERE user_id = ? AND book_id = ? AND interaction_type = ?', 
-                                (user_id, book_id, action)).fetchone()
-        
-        if existing:
-            # Toggle OFF (Remove interaction)
-            conn.execute('DELETE FROM interactions WHERE id = ?', (existing['id'],))
-            active = False
-        else:
-            # Toggle ON
-            conn.execute('INSERT INTO interactions (user_id, book_id, interaction_type) VALUES (?, ?, ?)',
-                         (user_id, book_id, action))
-            active = True
-            
-        conn.commit()
-        return jsonify({"success": True, "active": active})
+        # One upsert flips the row; no SELECT first
+        events = [(user_id, book_id, action, 'toggle')]
+        results = interactions.apply(conn, events)
+        after_interactions(conn, events, results)
+        return jsonify({"success": True, "active": results[0][0]})
     except Exception as e:
         print(f"Interaction Error: {e}")
         return jsonify({"success": False, "error": str(e)})
     finally:
         conn.close()
 
-# Helper to handle "ext_" books (lazy import)
-def get_or_create_book(raw_book_id, book_data=None):
+@app.route('/api/interactions/batch', methods=['POST'])
+def interact_batch():
+    """Applies many like/dislike/onboarding events in one transaction.
+    
+    Body: {"user_id": 1, "events": [{"book_id": "ext_x", "action": "like", "op": "toggle"|"on"|"off"}, ...]}
+    (an event may carry its own user_id). Returns each event's resulting state.
+    """
+    try:
+        events = interactions.parse_events(request.get_json(silent=True))
+    except interactions.InvalidEvent as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
     conn = get_db_connection()
-    c = conn.cursor()
+    try:
+        results = interactions.apply(conn, events)
+        after_interactions(conn, events, results)
+    except sqlite3.Error as e:
+        print(f"Interaction Batch Error: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+    finally:
+        conn.close()
+    return jsonify({
+        "success": True,
+        "applied": sum(changed for _, changed in results),
+        "results": [{"book_id": book_id, "action": action, "active": active, "changed": changed}
+                    for (_, book_id, action, _), (active, changed) in zip(events, results)]
+    })
+
+def after_interactions(conn, events, results):
+    """Mirrors applied events into the live CF model and queues feed rebuilds for the affected users."""
+    changed = [event for event, (_, did_change) in zip(events, results) if did_change]
+    if collaborative.live_model_loaded():
+        for (user_id, book_id, action, _), (active, did_change) in zip(events, results):
+            if did_change:
+                collaborative.record_interaction(user_id, collaborative.resolve_item(conn, book_id), action, active)
+    user_feeds.rebuild_materialized({event[0] for event in changed})
+
+# Helper to handle "ext_" books (lazy import)
+IMPORT_SQL = '''
+    INSERT INTO books (ia_id, title, author, category, description, price, rating, cover_url, year)
+    VALUES (?, ?, ?, 'Imported', 'Imported from Global Library', ?, ?, ?, ?)
+    ON CONFLICT (ia_id) DO NOTHING
+    RETURNING id
+'''
+IMPORT_CACHE_SIZE = 4096
+_imported_ids = OrderedDict()  # ia_id -> books.id, only for rows known to be committed
+_imported_lock = threading.Lock()
+
+def import_external_book(conn, raw_book_id, book_data=None):
+    """Resolves a local id or an 'ext_' id to books.id, importing the external book if needed.
     
+    The insert runs in the caller's transaction (the caller commits). Returns
+    (book_id, imported); book_id is None for an unknown external book without
+    book_data. Concurrent imports of the same book are safe: the loser's
+    INSERT hits the ia_id conflict and reads the winner's row.
+    """
     # If it's already a local integer ID, we are good
     if isinstance(raw_book_id, int) or (isinstance(raw_book_id, str) and not raw_book_id.startswith('ext_')):
-        conn.close()
-        return raw_book_id
-        
-    # It's an external book. Check if we already have it by IA ID.
+        return raw_book_id, False
+    if not isinstance(raw_book_id, str):
+        return None, False
+    
     ia_id = raw_book_id.replace('ext_', '').replace('/works/', '') # normalize
-    # Try fetching IA ID from book_data if available
-    if book_data and 'ia_id' in book_data:
+    if book_data and book_data.get('ia_id'):
         ia_id = book_data['ia_id']
-        
-    existing = c.execute("SELECT id FROM books WHERE ia_id = ?", (ia_id,)).fetchone()
-    if existing:
-        conn.close()
-        return existing['id']
-        
-    # Not found, and we have data? Import it.
+    
+    with _imported_lock:
+        book_id = _imported_ids.get(ia_id)
+        if book_id is not None:
+            _imported_ids.move_to_end(ia_id)
+            return book_id, False
+    
     if book_data:
-        try:
-            c.execute('''
-                INSERT INTO books (ia_id, title, author, category, description, price, rating, cover_url, year)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                ia_id,
-                book_data.get('title'),
-                book_data.get('author'),
-                'Imported', 
-                'Imported from Global Library',
-                book_data.get('price', 199),
-                round(random.uniform(3.8, 4.9), 1),
-                book_data.get('cover_url'),
-                book_data.get('year', 2000)
-            ))
-            new_id = c.lastrowid
-            conn.commit()
-            conn.close()
-            return new_id
-        except Exception as e:
-            print(f"Import Error: {e}")
-            conn.close()
-            return None
+        row = conn.execute(IMPORT_SQL, (
+            ia_id,
+            book_data.get('title'),
+            book_data.get('author'),
+            199 if book_data.get('price') is None else book_data['price'],  # A free book stays free
+            round(random.uniform(3.8, 4.9), 1),
+            book_data.get('cover_url'),
+            book_data.get('year') or 2000
+        )).fetchall()
+        if row:
+            # Not cached until a later lookup sees it committed: the caller may still roll back
+            return row[0]['id'], True
     
+    existing = conn.execute("SELECT id FROM books WHERE ia_id = ?", (ia_id,)).fetchone()
+    if not existing:
+        return None, False
+    with _imported_lock:
+        _imported_ids[ia_id] = existing['id']
+        while len(_imported_ids) > IMPORT_CACHE_SIZE:
+            _imported_ids.popitem(last=False)
+    return existing['id'], False
+
+def on_book_imported(book_id):
+    """Makes a freshly imported book recommendable in this worker now; the others sync from the table."""
+    if not recommender.live_model_loaded():
+        return
+    conn = get_db_connection()
+    book = conn.execute(f'SELECT {recommender.BOOK_COLUMNS} FROM books WHERE id = ?', (book_id,)).fetchone()
     conn.close()
-    return None
+    if book:
+        recommender.notify_book_changed(dict(book))
+
+@app.route('/api/similar/<int:book_id>', methods=['GET'])
+def similar_books(book_id):
+    """'More like this': content-based neighbours from the live catalog model."""
+    limit = max(1, min(request.args.get('limit', 5, type=int), 50))
+    model = recommender.load_in_background()  # Never fitted on the request thread
+    if model is None:
+        conn = get_db_connection()
+        empty = conn.execute("SELECT 1 FROM books LIMIT 1").fetchone() is None
+        conn.close()
+        if empty:
+            return jsonify([])  # Nothing to fit yet
+        return retry_later("Recommendations are warming up, please try again shortly", 5, 503)
+    return jsonify(model.get_recommendations_for_id(book_id, k=limit))
 
 @app.route('/api/user_stats/<int:user_id>', methods=['GET'])
 def get_user_stats(user_id):
@@ -617,50 +1150,105 @@ def get_user_stats(user_id):
         "pages_read": books_count * 320 # approx
     })
 
-@app.route('/api/search_external', methods=['GET'])
-def search_external():
-    """Proxies search to OpenLibrary for 'Infinite' content."""
-    query = request.args.get('q')
-    if not query or query == "subject:":
-        return jsonify([])
-        
+def external_search_params(query):
     # Enforce English language and Edition type using proper params
-    base_url = "https://openlibrary.org/search.json"
-    params = {
+    return {
         'q': query,
         'language': 'eng',
         'type': 'edition', # Strict edition mode
         'limit': 20,
         'has_fulltext': 'true'
     }
-    
-    try:
-        res = requests.get(base_url, params=params).json()
-        results = []
-        for doc in res.get('docs', []):
-            if 'ia' in doc and 'cover_i' in doc:
-                # Strict Language Check
-                if 'eng' not in doc.get('language', []):
-                    continue
-                    
-                # Deterministic Price Logic (same as ingest)
-                price_seed = sum(ord(char) for char in doc['title'])
-                price = (price_seed % 500) + 99
+
+def external_search_results(res):
+    results = []
+    for doc in res.get('docs', []):
+        if 'ia' in doc and 'cover_i' in doc:
+            # Strict Language Check
+            if 'eng' not in doc.get('language', []):
+                continue
                 
-                results.append({
-                    'id': f"ext_{doc.get('ia')[0]}", # distinctive ID using IA ID for stability
-                    'ia_id': doc.get('ia')[0],
-                    'title': doc.get('title'),
-                    'author': doc.get('author_name', ['Unknown'])[0],
-                    'cover_url': f"https://covers.openlibrary.org/b/id/{doc.get('cover_i')}-L.jpg",
-                    'price': price,
-                    'year': doc.get('first_publish_year', 2000),
-                    'description': "Imported from Global Library" # Simplified
-                })
-        return results
+            # Deterministic Price Logic (same as ingest)
+            price_seed = sum(ord(char) for char in doc['title'])
+            price = (price_seed % 500) + 99
+            
+            results.append({
+                'id': f"ext_{doc.get('ia')[0]}", # distinctive ID using IA ID for stability
+                'ia_id': doc.get('ia')[0],
+                'title': doc.get('title'),
+                'author': doc.get('author_name', ['Unknown'])[0],
+                'cover_url': f"https://covers.openlibrary.org/b/id/{doc.get('cover_i')}-L.jpg",
+                'price': price,
+                'year': doc.get('first_publish_year', 2000),
+                'description': "Imported from Global Library" # Simplified
+            })
+    return results
+
+def external_search(query):
+    """Search core for /api/search_external: [] for an empty query or on any upstream error."""
+    if not query or query == "subject:":
+        return []
+    try:
+        res = yield external_search_params(query)
+        return external_search_results(res)
     except Exception as e:
         print(f"External Search Error: {e}")
-        return jsonify([])
+        return []
+
+@app.route('/api/search_external', methods=['GET'])
+def search_external():
+    """Proxies search to OpenLibrary for 'Infinite' content."""
+    return jsonify(run_searches(external_search(request.args.get('q'))))
+
+@app.route('/api/search', methods=['GET'])
+def search_catalog():
+    """Ranked local full-text search, topped up with already-cached OpenLibrary results.
+    
+    Local hits never wait on the network. If page 1 has room and the external
+    results for this query aren't cached yet, they are fetched in the background
+    and show up on the next request.
+    """
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)  # type=int: a bad value falls back to the default
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
+    
+    conn = get_db_connection()
+    rows, total = search.search_books(conn, query, limit=per_page, offset=(page - 1) * per_page)
+    conn.close()
+    
+    results = []
+    for row in rows:
+        book = dict(row)
+        book['source'] = 'local'
+        results.append(book)
+    
+    external_pending = False
+    if page == 1 and len(results) < per_page and search.query_terms(query):
+        params = external_search_params(query)
+        cached = openlibrary.peek(params)
+        if cached is None:
+            FEED_EXECUTOR.submit(openlibrary.search, params)  # Warm the cache for the next request
+            external_pending = True
+        else:
+            local_ia = {book['ia_id'] for book in results}
+            for book in external_search_results(cached):
+                if len(results) >= per_page:
+                    break
+                if book['ia_id'] not in local_ia:
+                    book['source'] = 'openlibrary'
+                    results.append(book)
+    
+    return jsonify({
+        "query": query,
+        "page": page,
+        "per_page": per_page,
+        "total_local": total,
+        "results": results,
+        "external_pending": external_pending
+    })
+
+COMMENTS_PAGE_SIZE = 50
+MAX_COMMENTS_PAGE_SIZE = 100
 
 @app.route('/api/comments', methods=['GET', 'POST'])
 def comments():
@@ -681,42 +1269,57 @@ def comments():
              else:
                  # If no one imported it yet, there are no comments.
                  conn.close()
-                 return jsonify({"comments": [], "community_rating": 0, "total_reviews": 0})
+                 return jsonify({"comments": [], "community_rating": 0, "total_reviews": 0, "next_cursor": None})
+
+        limit = min(max(request.args.get('limit', COMMENTS_PAGE_SIZE, type=int), 1), MAX_COMMENTS_PAGE_SIZE)
+        cursor = request.args.get('cursor')
+        before = ('9999-12-31', 0) # Newest first
+        if cursor:
+            created_at, _, comment_id = cursor.rpartition('|')
+            if not created_at or not comment_id.isdigit():
+                conn.close()
+                return jsonify({"error": "Invalid cursor"}), 400
+            before = (created_at, int(comment_id))
 
-        # Get comments with user names
+        # One page of comments with user names, keyset-paginated on (created_at, id)
         query = '''
             SELECT c.*, u.name as user_name, u.email 
             FROM comments c
             JOIN users u ON c.user_id = u.id
-            WHERE c.book_id = ?
-            ORDER BY c.created_at DESC
+            WHERE c.book_id = ? AND (c.created_at, c.id) < (?, ?)
+            ORDER BY c.created_at DESC, c.id DESC
+            LIMIT ?
         '''
-        comments = conn.execute(query, (book_id,)).fetchall()
-        
-        # Calculate Average Rating
-        avg_query = 'SELECT AVG(rating) as avg_rating FROM comments WHERE book_id = ? AND rating > 0'
-        avg_result = conn.execute(avg_query, (book_id,)).fetchone()
-        avg_rating = round(avg_result['avg_rating'], 1) if avg_result['avg_rating'] else 0
+        comments = conn.execute(query, (book_id, *before, limit + 1)).fetchall()
+        has_more = len(comments) > limit
+        comments = comments[:limit]
         
+        # Rating aggregates are kept up to date by triggers on comments
+        stats = conn.execute('SELECT * FROM book_stats WHERE book_id = ?', (book_id,)).fetchone()
         conn.close()
         
-        return jsonify({
+        next_cursor = f"{comments[-1]['created_at']}|{comments[-1]['id']}" if has_more else None
+        response = jsonify({
             "comments": [dict(row) for row in comments],
-            "community_rating": avg_rating,
-            "total_reviews": len(comments)
+            "community_rating": round(stats['rating_sum'] / stats['rating_count'], 1) if stats and stats['rating_count'] else 0,
+            "total_reviews": stats['review_count'] if stats else 0,
+            "rating_histogram": {str(n): stats[f'r{n}'] if stats else 0 for n in range(1, 6)},
+            "next_cursor": next_cursor
         })
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
         
     if request.method == 'POST':
         data = request.json
         
-        # Ensure we have a valid local book ID
-        final_book_id = get_or_create_book(data.get('book_id'), data.get('book_data'))
-        
-        if not final_book_id:
-             conn.close()
-             return jsonify({"success": False, "error": "Could not verify book identity"})
-
         try:
+            # Ensure we have a valid local book ID (importing it in this same transaction)
+            final_book_id, imported = import_external_book(conn, data.get('book_id'), data.get('book_data'))
+            if not final_book_id:
+                conn.close()
+                return jsonify({"success": False, "error": "Could not verify book identity"})
+
             conn.execute('INSERT INTO comments (user_id, book_id, text, rating) VALUES (?, ?, ?, ?)',
                          (data['user_id'], final_book_id, data['text'], data.get('rating', 0)))
             conn.commit()
@@ -724,6 +1327,8 @@ def comments():
             # Return the new comment with user info (for optimistic UI)
             user = conn.execute('SELECT name FROM users WHERE id = ?', (data['user_id'],)).fetchone()
             conn.close()
+            if imported:
+                on_book_imported(final_book_id)
             
             return jsonify({
                 "success": True, 
@@ -763,14 +1368,8 @@ def read_book(book_id):
     # Let's add user_id param support.
     
     user_id = request.args.get('user_id')
-    if user_id:
-        try:
-            conn.execute('UPDATE purchases SET last_read_at = CURRENT_TIMESTAMP WHERE user_id = ? AND book_id = ?', (user_id, book_id))
-            conn.commit()
-        except Exception as e:
-            print(f"Failed to update timestamp: {e}")
-
-    conn.close()
+    if user_id and user_id.isdigit():
+        progress_buffer.record(int(user_id), book_id, touch=True)
 
     # Return the Embed URL for the Iframe (BookReader)
     return jsonify({
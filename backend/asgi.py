@@ -0,0 +1,248 @@
+"""
+ASGI serving mode for the I/O-bound endpoints.
+
+With gunicorn sync workers every request pins a worker while it waits on
+openlibrary.org or the LLM router, so throughput tops out at the worker count.
+Here those endpoints run as coroutines on the non-blocking HTTP client and
+thousands of them can wait at once:
+
+    GET  /api/search_external    GET  /api/global_feed
+    POST /api/chat               POST /api/chat/stream
+
+The handlers themselves are app.py's: their logic is written once as search
+cores (see app.run_searches) and LibrarianTurn, and this module only drives
+them. A core's own SQLite work (CF recommendations, user interests) steps on
+asyncio.to_thread(), so the event loop never blocks on the database. CORS
+headers come from flask-cors with app.py's options. Every other route is the
+unchanged Flask app, run on a thread pool.
+
+    uvicorn --app-dir backend asgi:app --workers 2
+    gunicorn --chdir backend -k uvicorn.workers.UvicornWorker asgi:app
+
+`python bench_asgi.py` compares this with sync gunicorn against stubbed upstreams.
+"""
+import asyncio
+import inspect
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+import asgiref
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from flask_cors.core import get_cors_headers, get_cors_options
+from werkzeug.datastructures import Headers
+
+import app as papero
+import http_client
+import openlibrary
+import responses
+
+# Threads for Flask routes and to_thread() database calls
+THREADS = int(os.environ.get("PAPERO_ASGI_THREADS", 32))
+
+
+class ThreadedWsgiInstance(WsgiToAsgiInstance):
+    # asgiref runs every WSGI call on one shared thread (sync_to_async with thread_sensitive=True);
+    # Flask and the pooled SQLite connections are thread-safe, so use the whole executor instead.
+    # sync_to_async keeps the plain method as __wrapped__ (functools.update_wrapper); requirements.txt
+    # pins the asgiref versions this was checked against, and a changed shape fails here, not per request.
+    _run_wsgi_app = inspect.unwrap(WsgiToAsgiInstance.run_wsgi_app)
+    if inspect.iscoroutinefunction(_run_wsgi_app):
+        raise ImportError(f"Unsupported asgiref {asgiref.__version__}: run_wsgi_app is no longer a sync method")
+
+    async def run_wsgi_app(self, body):
+        await asyncio.to_thread(self._run_wsgi_app, body)
+
+
+class ThreadedWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await ThreadedWsgiInstance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+
+flask_app = ThreadedWsgiToAsgi(papero.app)
+CORS_OPTIONS = get_cors_options(papero.app, papero.CORS_OPTIONS)
+
+
+class Request:
+    def __init__(self, scope, receive):
+        self.scope = scope
+        self.receive = receive
+        self.method = scope["method"]
+        self.args = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+        self.headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+
+    async def json(self):
+        body = b""
+        while True:
+            message = await self.receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        try:
+            return json.loads(body) if body else {}
+        except ValueError:
+            return {}
+
+
+def cors_headers(request):
+    """flask-cors' headers for a route handled here, computed from the options app.py passes to CORS()."""
+    headers = get_cors_headers(CORS_OPTIONS, Headers(list(request.headers.items())), request.method)
+    return [(k.lower().encode("latin-1"), str(v).encode("latin-1")) for k, v in headers.items(multi=True)]
+
+
+async def send_json(send, request, data, status=200, headers=()):
+    body, encoding = responses.encode_body(papero.app.json.dumps(data).encode(),
+                                           request.headers.get("accept-encoding", ""))
+    out = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+           (b"vary", b"Accept-Encoding")]
+    if encoding:
+        out.append((b"content-encoding", encoding.encode()))
+    out += cors_headers(request) + [(k.lower().encode(), v.encode()) for k, v in headers]
+    await send({"type": "http.response.start", "status": status, "headers": out})
+    await send({"type": "http.response.body", "body": body})
+
+
+# --- ASYNC DRIVERS ---
+# The handler logic lives in app.py as search cores (generators that yield
+# OpenLibrary params) and LibrarianTurn; these only do the waiting.
+
+async def run_searches(core):
+    """app.run_searches() on the event loop: the core's own (SQLite) work steps on a thread, searches are awaited."""
+    response, error = None, None
+    while True:
+        state, value = await asyncio.to_thread(papero.step_search, core, response, error)
+        if state == "done":
+            return value
+        try:
+            response, error = await openlibrary.search_async(value), None
+        except Exception as e:
+            response, error = None, e
+
+
+async def search_external(request, send):
+    await send_json(send, request, await run_searches(papero.external_search(request.args.get("q"))))
+
+
+async def timed(coro):
+    start = time.perf_counter()
+    result = await coro
+    return result, (time.perf_counter() - start) * 1000
+
+
+async def global_feed(request, send):
+    user_id = request.args.get("user_id", 1)
+    started = time.perf_counter()
+    running = {"recommended": asyncio.ensure_future(timed(run_searches(papero.feed_recommended_row(user_id))))}
+    plan, local, live = await asyncio.to_thread(papero.plan_live_rows)
+    for genre, core in live.items():
+        running[genre] = asyncio.ensure_future(timed(run_searches(core)))
+
+    await asyncio.wait(running.values(), timeout=papero.FEED_ROW_TIMEOUT)
+
+    feed, server_timing = papero.finish_feed(plan, local, running, started)
+    await send_json(send, request, feed, headers=[("Server-Timing", server_timing)])
+
+
+async def librarian_events(user_message):
+    """Async twin of app.librarian_events(): the book search is a task started mid-stream."""
+    turn = papero.LibrarianTurn(user_message)
+    search_task = None
+    try:
+        async for kind, value in papero.librarian.astream_chat(turn.messages, deadline=turn.deadline):
+            event = turn.on_event(kind, value)
+            if turn.search_query and search_task is None:
+                search_task = asyncio.ensure_future(run_searches(papero.chat_books(turn.search_query)))
+            if event:
+                yield event
+
+        book_results = []
+        if search_task is not None:
+            try:
+                book_results = await asyncio.wait_for(search_task, turn.search_timeout())
+            except Exception as e:
+                book_results = turn.search_failed(e)
+        for event in turn.closing_events(book_results):
+            yield event
+    finally:
+        if search_task is not None and not search_task.done():
+            search_task.cancel()
+
+
+async def chat(request, send):
+    user_message = papero.chat_request_message(await request.json())
+    if not user_message:
+        return await send_json(send, request, papero.CHAT_NO_MESSAGE, status=400)
+    try:
+        reply = None
+        async for kind, value in librarian_events(user_message):
+            if kind == "done":
+                reply = value
+        await send_json(send, request, reply)
+    except papero.llm_gateway.LLMError as e:
+        body, status = papero.chat_error(e)
+        await send_json(send, request, body, status=status)
+
+
+async def chat_stream(request, send):
+    user_message = papero.chat_request_message(await request.json())
+    if not user_message:
+        return await send_json(send, request, papero.CHAT_NO_MESSAGE, status=400)
+
+    disconnected = asyncio.Event()
+
+    async def watch_disconnect():
+        while (await request.receive())["type"] != "http.disconnect":
+            pass
+        disconnected.set()
+
+    watcher = asyncio.ensure_future(watch_disconnect())
+    headers = [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache"),
+               (b"x-accel-buffering", b"no")] + cors_headers(request)
+    await send({"type": "http.response.start", "status": 200, "headers": headers})
+    events = librarian_events(user_message)
+    try:
+        async for kind, value in events:
+            if disconnected.is_set():
+                break  # Closing the generator frees the gateway slot for someone else
+            await send({"type": "http.response.body", "body": papero.sse(kind, value).encode(), "more_body": True})
+    except papero.llm_gateway.LLMError as e:
+        body, status = papero.chat_error(e)
+        await send({"type": "http.response.body", "body": papero.sse("error", dict(body, status=status)).encode(),
+                    "more_body": True})
+    finally:
+        await events.aclose()
+        watcher.cancel()
+    await send({"type": "http.response.body", "body": b""})
+
+
+ROUTES = {
+    ("GET", "/api/search_external"): search_external,
+    ("GET", "/api/global_feed"): global_feed,
+    ("POST", "/api/chat"): chat,
+    ("POST", "/api/chat/stream"): chat_stream,
+}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            asyncio.get_running_loop().set_default_executor(
+                ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix="asgi"))
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await http_client.async_client.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] == "http":
+        handler = ROUTES.get((scope["method"], scope["path"].rstrip("/")))
+        if handler is not None:
+            return await handler(Request(scope, receive), send)
+    await flask_app(scope, receive, send)
@@ -0,0 +1,138 @@
+"""
+Benchmark: concurrent-user capacity of sync gunicorn vs the ASGI mode (asgi.py).
+
+Both servers run against stub upstreams (stub_upstreams.py) with a fixed
+OpenLibrary latency and LLM token rate, and a throwaway database. Every request
+uses a unique query so the response caches never answer for the upstream.
+
+    python bench_asgi.py [--users 50 100 200] [--workers 2] [--search-delay-ms 200]
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+import stub_upstreams
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SCENARIOS = {
+    "search_external": lambda i: ("GET", f"/api/search_external?q=bench+topic+{i}", None),
+    "chat": lambda i: ("POST", "/api/chat", {"message": f"books about topic {i}"}),
+}
+
+
+def seed(db_path):
+    import database
+    database.DB_NAME = db_path
+    database.init_db()
+    conn = database.get_db_connection()
+    conn.execute("INSERT OR IGNORE INTO users (id, name, email, password_hash) VALUES (1, 'Bench', 'bench@test.com', 'x')")
+    conn.execute("INSERT INTO books (ia_id, title, author, category, price, year) VALUES ('bench1', 'Book', 'Author', 'Fiction', 199, 2000)")
+    conn.commit()
+    conn.close()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(mode, port, workers, env):
+    if mode == "sync":
+        cmd = [sys.executable, "-m", "gunicorn", "--chdir", BASE_DIR, "-w", str(workers),
+               "-b", f"127.0.0.1:{port}", "--timeout", "120", "app:app"]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "--app-dir", BASE_DIR, "--workers", str(workers),
+               "--port", str(port), "--log-level", "warning", "--no-access-log", "asgi:app"]
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                return proc
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+async def load(base_url, scenario, users, per_user, offset):
+    make = SCENARIOS[scenario]
+    latencies, errors = [], 0
+
+    async def user(u, client):
+        nonlocal errors
+        for n in range(per_user):
+            method, path, body = make(offset + u * per_user + n)
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, base_url + path, json=body)
+                if response.status_code != 200:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    limits = httpx.Limits(max_connections=users, max_keepalive_connections=users)
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(user(u, client) for u in range(users)))
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    pct = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+    return {"rps": len(latencies) / elapsed, "p50": pct(0.50), "p95": pct(0.95), "errors": errors}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[25, 100, 200])
+    parser.add_argument("--requests", type=int, default=4, help="requests per user")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--search-delay-ms", type=float, default=200)
+    parser.add_argument("--token-delay-ms", type=float, default=5)
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    args = parser.parse_args()
+
+    stub, stub_url = stub_upstreams.serve(0, args.token_delay_ms, args.search_delay_ms)
+    tmp = tempfile.mkdtemp(prefix="papero-bench-")
+    db_path = os.path.join(tmp, "bench.db")
+    seed(db_path)
+    env = dict(os.environ,
+               PAPERO_DB_PATH=db_path,
+               PAPERO_JOBS_INPROCESS="0",
+               PAPERO_PROGRESS_LOG_DIR=os.path.join(tmp, "progress_log"),
+               PAPERO_OPENLIBRARY_URL=f"{stub_url}/search.json",
+               PAPERO_LLM_URL=f"{stub_url}/v1/chat/completions",
+               PAPERO_LLM_CONCURRENCY="1000")
+
+    print(f"Stub upstreams: search {args.search_delay_ms:.0f}ms, {args.token_delay_ms:.0f}ms/token; "
+          f"{args.workers} workers per server, {args.requests} requests per user\n")
+    print(f"{'server':<8} {'scenario':<16} {'users':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}")
+    offset = 0
+    for mode in ("sync", "asgi"):
+        port = free_port()
+        proc = start_server(mode, port, args.workers, env)
+        try:
+            for scenario in args.scenarios:
+                for users in args.users:
+                    offset += 100000  # Fresh queries: no cache hits across runs
+                    r = asyncio.run(load(f"http://127.0.0.1:{port}", scenario, users, args.requests, offset))
+                    print(f"{mode:<8} {scenario:<16} {users:>6} {r['rps']:>8.1f} {r['p50']:>8.0f} "
+                          f"{r['p95']:>8.0f} {r['errors']:>7}")
+        finally:
+            proc.terminate()
+            proc.wait(timeout=30)
+    stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark: requests/sec for /api/library and /api/comments with and without
+the connection pool.
+
+Runs against a throwaway SQLite file so the real ebook_market.db is untouched.
+
+    python bench_db.py [--requests 2000] [--threads 4]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROUTES = {
+    "/api/library": "/api/library?user_id=1",
+    "/api/comments": "/api/comments?book_id=1",
+}
+
+
+def seed(db_path):
+    import database
+    database.DB_NAME = db_path
+    database.init_db()
+    conn = database.get_db_connection()
+    conn.execute("INSERT OR IGNORE INTO users (id, name, email, password_hash) VALUES (1, 'Bench', 'bench@test.com', 'x')")
+    for i in range(1, 201):
+        conn.execute(
+            "INSERT INTO books (ia_id, title, author, category, description, price, year) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (f"bench{i}", f"Book {i}", "Author", "Fiction", "Lorem ipsum " * 20, 199, 2000),
+        )
+        if i <= 40:
+            conn.execute("INSERT INTO purchases (user_id, book_id) VALUES (1, ?)", (i,))
+    for i in range(50):
+        conn.execute("INSERT INTO comments (user_id, book_id, text, rating) VALUES (1, 1, ?, ?)", (f"Comment {i}", i % 5 + 1))
+    conn.commit()
+    conn.close()
+
+
+def run(db_path, total, threads):
+    """Runs in a child process so POOL_SIZE is read fresh at import time."""
+    import database
+    database.DB_NAME = db_path
+    from app import app
+
+    client = app.test_client()
+    results = {}
+    for name, url in ROUTES.items():
+        client.get(url)  # warm up
+        per_thread = total // threads
+
+        def worker(_):
+            c = app.test_client()
+            for _ in range(per_thread):
+                c.get(url)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(worker, range(threads)))
+        elapsed = time.perf_counter() - start
+        results[name] = (per_thread * threads) / elapsed
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        for name, rps in run(args.child, args.requests, args.threads).items():
+            print(f"{name}\t{rps:.0f}")
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        seed(db_path)
+
+        report = {}
+        for label, pool_size in (("per-request connect", "0"), ("pooled + WAL", "8")):
+            env = dict(os.environ, PAPERO_DB_POOL_SIZE=pool_size)
+            out = subprocess.run(
+                [sys.executable, __file__, "--child", db_path,
+                 "--requests", str(args.requests), "--threads", str(args.threads)],
+                env=env, capture_output=True, text=True, check=True,
+            ).stdout
+            for line in out.strip().splitlines():
+                if "\t" in line:
+                    route, rps = line.split("\t")
+                    report.setdefault(route, {})[label] = float(rps)
+
+    print(f"{'route':<16}{'before req/s':>16}{'after req/s':>16}{'speedup':>10}")
+    for route, r in report.items():
+        before, after = r["per-request connect"], r["pooled + WAL"]
+        print(f"{route:<16}{before:>16.0f}{after:>16.0f}{after / before:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Benchmark: FTS5 ingestion cost per tokenizer, plus query latency.
+
+Inserts synthetic books into a throwaway database through the same
+trigger-maintained books_fts index the app uses, once per tokenizer
+configuration, and reports rows/sec, index size and prefix-query latency.
+
+    python bench_fts.py [--books 20000]
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import migrations
+import search
+
+TOKENIZERS = {
+    "unicode61 (app default)": "unicode61 remove_diacritics 2",
+    "porter stemming": "porter unicode61 remove_diacritics 2",
+    "ascii": "ascii",
+    "trigram": "trigram",
+}
+WORDS = ("vampire detective romance empire dragon ocean war love murder history science galaxy kingdom "
+         "secret garden mystery island letters journey shadow winter summer night city river").split()
+
+
+def synthetic_books(n, seed=3):
+    rng = random.Random(seed)
+    for i in range(n):
+        yield (f"ia_bench_{i}",
+               " ".join(rng.choices(WORDS, k=3)).title(),
+               f"Author {rng.randint(1, n // 10 + 1)}",
+               rng.choice(["Horror", "Romance", "History", "Science Fiction", "Fantasy"]),
+               " ".join(rng.choices(WORDS, k=60)))
+
+
+def bench_tokenizer(path, tokenize, n):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    with contextlib.redirect_stdout(io.StringIO()):
+        migrations.migrate(conn)
+    if tokenize != TOKENIZERS["unicode61 (app default)"]:
+        # Swap the tokenizer on the freshly migrated (empty) index
+        conn.execute("DROP TABLE books_fts")
+        conn.execute(f'''
+            CREATE VIRTUAL TABLE books_fts USING fts5(
+                title, author, category, description,
+                content='books', content_rowid='id', tokenize='{tokenize}', prefix='2 3')
+        ''')
+        conn.commit()
+
+    start = time.perf_counter()
+    rows = list(synthetic_books(n))
+    for chunk in range(0, n, 1000):
+        conn.executemany("INSERT INTO books (ia_id, title, author, category, description) VALUES (?, ?, ?, ?, ?)",
+                         rows[chunk:chunk + 1000])
+        conn.commit()
+    ingest_s = time.perf_counter() - start
+
+    # Index size = FTS shadow tables
+    pages = conn.execute("SELECT SUM(pgsize) FROM dbstat WHERE name LIKE 'books_fts%'").fetchone()[0] \
+        if conn.execute("SELECT 1 FROM pragma_module_list WHERE name = 'dbstat'").fetchone() else None
+
+    queries = ["vamp", "dragon kingdom", "myst isl", "winter night city", "gal"]
+    start = time.perf_counter()
+    for _ in range(20):
+        for q in queries:
+            search.search_books(conn, q, limit=20)
+    query_ms = (time.perf_counter() - start) * 1000 / (20 * len(queries))
+    conn.close()
+    return n / ingest_s, pages, query_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'tokenizer':<26}{'rows/s':>10}{'index MB':>10}{'query ms':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n, (label, tokenize) in enumerate(TOKENIZERS.items()):
+            rps, size, query_ms = bench_tokenizer(os.path.join(tmp, f"fts{n}.db"), tokenize, args.books)
+            size_mb = f"{size / 1e6:.1f}" if size else "n/a"
+            print(f"{label:<26}{rps:>10.0f}{size_mb:>10}{query_ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
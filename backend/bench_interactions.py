@@ -0,0 +1,105 @@
+"""
+Benchmark: interaction events/sec for the old read-then-write toggle vs
+single-statement upserts, per event and batched.
+
+Runs against a throwaway SQLite file so the real ebook_market.db is untouched.
+
+    python bench_interactions.py [--events 20000] [--batch 100 500]
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+
+import database
+import interactions
+
+
+def synthetic_events(n, users=200, books=2000, seed=7):
+    rng = random.Random(seed)
+    return [(rng.randint(1, users), str(rng.randint(1, books)), rng.choice(('like', 'dislike')), 'toggle')
+            for _ in range(n)]
+
+
+def legacy_toggle(conn, events):
+    """The pre-upsert interact(): SELECT, then DELETE or INSERT, then COMMIT, per event."""
+    for user_id, book_id, action, _ in events:
+        existing = conn.execute('SELECT id FROM interactions WHERE user_id = ? AND book_id = ? AND interaction_type = ?',
+                                (user_id, book_id, action)).fetchone()
+        if existing:
+            conn.execute('DELETE FROM interactions WHERE id = ?', (existing['id'],))
+        else:
+            conn.execute('INSERT INTO interactions (user_id, book_id, interaction_type) VALUES (?, ?, ?)',
+                         (user_id, book_id, action))
+        conn.commit()
+
+
+def upsert_each(conn, events):
+    for event in events:
+        interactions.apply(conn, [event])
+
+
+def upsert_batched(size):
+    def run(conn, events):
+        for i in range(0, len(events), size):
+            interactions.apply(conn, events[i:i + size])
+    return run
+
+
+def via_endpoint(size):
+    from app import app
+    client = app.test_client()
+
+    def run(conn, events):
+        for i in range(0, len(events), size):
+            body = {"events": [{"user_id": u, "book_id": b, "action": a} for u, b, a, _ in events[i:i + size]]}
+            assert client.post('/api/interactions/batch', json=body).status_code == 200
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Interaction ingestion throughput.")
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--batch", type=int, nargs="+", default=[100, 500])
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="papero-bench-")
+    database.DB_NAME = os.path.join(tmp, "bench.db")
+    os.environ["PAPERO_JOBS_INPROCESS"] = "0"
+    with contextlib.redirect_stdout(io.StringIO()):
+        database.init_db()
+    events = synthetic_events(args.events)
+
+    modes = [("legacy SELECT + DELETE/INSERT", legacy_toggle, min(args.events, 5000)),
+             ("upsert, commit per event", upsert_each, min(args.events, 5000))]
+    modes += [(f"upsert, {size}/transaction", upsert_batched(size), args.events) for size in args.batch]
+    modes += [(f"POST /api/interactions/batch ({size})", via_endpoint(size), args.events) for size in args.batch]
+
+    print(f"{'mode':<38} {'events':>7} {'events/s':>10}")
+    for name, run, n in modes:
+        conn = database.get_db_connection()
+        conn.execute("DELETE FROM interactions")
+        conn.commit()
+        if name.startswith("legacy"):
+            # The old code ran without the unique index (duplicates were possible)
+            conn.execute("DROP INDEX idx_interactions_user_book_type_unique")
+            conn.execute("CREATE INDEX idx_legacy ON interactions (user_id, book_id, interaction_type)")
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            run(conn, events[:n])
+            elapsed = time.perf_counter() - start
+        if name.startswith("legacy"):
+            conn.execute("DELETE FROM interactions")
+            conn.execute("DROP INDEX idx_legacy")
+            conn.execute("CREATE UNIQUE INDEX idx_interactions_user_book_type_unique "
+                         "ON interactions (user_id, book_id, interaction_type)")
+            conn.commit()
+        conn.close()
+        print(f"{name:<38} {n:>7} {n / elapsed:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
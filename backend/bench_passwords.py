@@ -0,0 +1,95 @@
+"""
+Benchmark: latency of a cheap endpoint (/health) while a burst of logins is
+being hashed, with hashing inline on the request thread vs on the hashing pool.
+
+Runs the app on a threaded local server against a throwaway SQLite file.
+
+    python bench_passwords.py [--logins 8] [--seconds 10]
+"""
+import argparse
+import contextlib
+import io
+import logging
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+import requests
+from werkzeug.serving import make_server
+
+tmp = tempfile.mkdtemp(prefix="papero-bench-")
+os.environ["PAPERO_DB_PATH"] = os.path.join(tmp, "bench.db")
+os.environ["PAPERO_JOBS_INPROCESS"] = "0"
+os.environ.setdefault("PAPERO_LOGIN_ACCOUNT_BURST", "1000000")
+os.environ.setdefault("PAPERO_LOGIN_IP_BURST", "1000000")
+os.environ.setdefault("PAPERO_HASH_MAX_PENDING", "1000")
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import app as backend
+import passwords
+
+
+def inline(fn, *args):
+    """What signup/login did before: the hash runs on the request thread."""
+    return fn(*args)
+
+
+def run(base, logins, seconds):
+    stop = threading.Event()
+    login_ms, health_ms = [], []
+
+    def login_loop():
+        with requests.Session() as s:
+            while not stop.is_set():
+                start = time.perf_counter()
+                s.post(f"{base}/api/login", json={"email": "bench@papero.io", "password": "hunter22"})
+                login_ms.append((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=login_loop) for _ in range(logins)]
+    for t in threads:
+        t.start()
+    deadline = time.time() + seconds
+    with requests.Session() as s:
+        while time.time() < deadline:
+            start = time.perf_counter()
+            s.get(f"{base}/health")
+            health_ms.append((time.perf_counter() - start) * 1000)
+            time.sleep(0.02)
+    stop.set()
+    for t in threads:
+        t.join()
+    return health_ms, login_ms
+
+
+def pct(values, p):
+    return sorted(values)[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/health latency under a login burst.")
+    parser.add_argument("--logins", type=int, default=8, help="concurrent login clients")
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, backend.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    requests.post(f"{base}/api/signup", json={"email": "bench@papero.io", "password": "hunter22"})
+
+    print(f"method {passwords.METHOD}, {args.logins} login clients, {passwords.WORKERS} hashing worker(s)")
+    print(f"{'mode':<10} {'health p50':>11} {'health p95':>11} {'logins/s':>9} {'login p50':>10}")
+    pooled = passwords._run
+    for name, runner in (("inline", inline), ("pool", pooled)):
+        passwords._run = runner
+        health, logins = run(base, args.logins, args.seconds)
+        print(f"{name:<10} {statistics.median(health):>9.1f}ms {pct(health, 0.95):>9.1f}ms "
+              f"{len(logins) / args.seconds:>9.1f} {statistics.median(logins):>8.0f}ms")
+    passwords._run = pooled
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Benchmark: recommender memory and latency across catalog sizes.
+
+Compares the old dense linear_kernel(N x N) model with the sparse on-demand
+top-k model on synthetic catalogs. The dense model is skipped above
+--dense-max books because it simply does not fit in memory.
+
+    python bench_recommender.py [--sizes 1000,10000,50000,100000] [--queries 200]
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+from sklearn.metrics.pairwise import linear_kernel
+
+from recommender import Recommender
+
+CATEGORIES = ["Thriller", "Romance", "History", "Science Fiction", "Fantasy", "Biography", "Horror", "Business"]
+
+
+def synthetic_catalog(n, vocab_size=20000, words_per_book=40, seed=7):
+    rng = random.Random(seed)
+    vocab = [f"w{i}" for i in range(vocab_size)]
+    # Zipf-ish word distribution so the TF-IDF matrix looks like real text
+    weights = [1 / (i + 1) for i in range(vocab_size)]
+    return [
+        {
+            "id": i,
+            "title": f"Book {i}",
+            "author": f"Author {i % 997}",
+            "category": rng.choice(CATEGORIES),
+            "description": " ".join(rng.choices(vocab, weights=weights, k=words_per_book)),
+        }
+        for i in range(n)
+    ]
+
+
+def sparse_bytes(m):
+    return m.data.nbytes + m.indices.nbytes + m.indptr.nbytes
+
+
+def bench_size(n, queries, dense_max):
+    catalog = synthetic_catalog(n)
+    titles = [b["title"] for b in random.Random(1).sample(catalog, min(queries, n))]
+
+    start = time.perf_counter()
+    rec = Recommender(catalog=catalog, artifact_root=None)  # Measure the cold fit, not a cached load
+    fit_s = time.perf_counter() - start
+    row = {"n": n, "fit_s": fit_s, "sparse_mb": sparse_bytes(rec.tfidf_matrix) / 1e6}
+
+    start = time.perf_counter()
+    for t in titles:
+        rec.get_recommendations(t)
+    row["sparse_ms"] = (time.perf_counter() - start) * 1000 / len(titles)
+
+    start = time.perf_counter()
+    rec.get_recommendations_batch(titles)
+    row["batch_ms"] = (time.perf_counter() - start) * 1000 / len(titles)
+
+    if n <= dense_max:
+        start = time.perf_counter()
+        cosine_sim = linear_kernel(rec.tfidf_matrix, rec.tfidf_matrix)
+        row["dense_build_s"] = time.perf_counter() - start
+        row["dense_mb"] = cosine_sim.nbytes / 1e6
+        start = time.perf_counter()
+        for t in titles:
+            idx = rec.title_index[t]
+            sim_scores = sorted(enumerate(cosine_sim[idx]), key=lambda x: x[1], reverse=True)[1:6]
+            rec.df.iloc[[i[0] for i in sim_scores]].to_dict('records')
+        row["dense_ms"] = (time.perf_counter() - start) * 1000 / len(titles)
+        del cosine_sim
+    else:
+        row["dense_mb"] = n * n * np.dtype(np.float64).itemsize / 1e6  # What it would need
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,50000,100000")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dense-max", type=int, default=10000)
+    args = parser.parse_args()
+
+    print(f"{'books':>8}{'fit s':>8}{'sparse MB':>11}{'dense MB':>11}{'dense ms/q':>12}{'sparse ms/q':>13}{'batch ms/q':>12}")
+    for n in (int(s) for s in args.sizes.split(",")):
+        r = bench_size(n, args.queries, args.dense_max)
+        dense_ms = f"{r['dense_ms']:.2f}" if "dense_ms" in r else "n/a"
+        dense_mb = f"{r['dense_mb']:.0f}" + ("" if "dense_ms" in r else "*")
+        print(f"{n:>8}{r['fit_s']:>8.2f}{r['sparse_mb']:>11.1f}{dense_mb:>11}{dense_ms:>12}{r['sparse_ms']:>13.2f}{r['batch_ms']:>12.2f}")
+    print("* dense model not built; size shown is what N x N float64 would require")
+
+
+if __name__ == "__main__":
+    main()
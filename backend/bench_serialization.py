@@ -0,0 +1,107 @@
+"""
+Micro-benchmark: per-route serialization time and bytes on the wire.
+
+Builds payloads shaped like /api/books, /api/library and /api/global_feed and
+compares the old path (sqlite3.Row -> dict(row) -> stdlib json) against the
+new one (tuple rows -> orjson), then reports raw, gzip and brotli sizes.
+
+    python bench_serialization.py [--books 2000] [--repeat 50]
+"""
+import argparse
+import gzip
+import json
+import sqlite3
+import time
+
+import responses
+
+BOOK_SQL = "SELECT * FROM books"
+LIBRARY_SQL = '''
+    SELECT b.*, p.purchase_date, p.progress, p.last_read_at, p.user_id
+    FROM books b JOIN purchases p ON b.id = p.book_id WHERE p.user_id = 1
+'''
+
+
+def build_db(n):
+    conn = sqlite3.connect(":memory:")
+    conn.execute('''CREATE TABLE books (id INTEGER PRIMARY KEY, ia_id TEXT, title TEXT, author TEXT, cover_url TEXT,
+                    category TEXT, description TEXT, price INTEGER, rating REAL, year INTEGER)''')
+    conn.execute('''CREATE TABLE purchases (user_id INTEGER, book_id INTEGER, purchase_date TEXT,
+                    progress INTEGER, last_read_at TEXT)''')
+    conn.executemany("INSERT INTO books VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", [
+        (i, f"ia{i}", f"Book Title {i}", f"Author {i % 300}", f"https://covers.openlibrary.org/b/id/{i}-L.jpg",
+         "Fiction", f"A classic Fiction title: Book Title {i}. " * 4, 99 + i % 500, 4.2, 1900 + i % 120)
+        for i in range(n)])
+    conn.executemany("INSERT INTO purchases VALUES (1, ?, '2024-01-01 10:00:00', ?, NULL)",
+                     [(i, i % 100) for i in range(0, n, 20)])
+    return conn
+
+
+def feed_payload(n_rows=5, per_row=25):
+    return {f"Row {r}": [{
+        "id": f"ext_book{r}_{i}", "ia_id": f"book{r}_{i}", "title": f"Some Book {i}", "author": "Somebody",
+        "cover_url": f"https://covers.openlibrary.org/b/id/{i}-L.jpg", "price": 199, "year": 1999,
+        "category": "Thriller", "description": "Imported from Global Library"} for i in range(per_row)]
+        for r in range(n_rows)}
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        out = fn()
+    return (time.perf_counter() - start) * 1000 / repeat, out
+
+
+def old_rows(conn, sql):
+    conn.row_factory = sqlite3.Row
+    body = json.dumps([dict(row) for row in conn.execute(sql).fetchall()], sort_keys=True).encode()
+    conn.row_factory = None
+    return body
+
+
+def new_rows(conn, sql):
+    cur = conn.execute(sql)
+    names = [c[0] for c in cur.description]
+    data = [dict(zip(names, row)) for row in cur]
+    if responses.orjson is not None:
+        return responses.orjson.dumps(data, option=responses.orjson.OPT_SORT_KEYS)
+    return json.dumps(data, sort_keys=True, separators=(",", ":")).encode()
+
+
+def new_obj(obj):
+    if responses.orjson is not None:
+        return responses.orjson.dumps(obj, option=responses.orjson.OPT_SORT_KEYS)
+    return json.dumps(obj, sort_keys=True, separators=(",", ":")).encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    conn = build_db(args.books)
+    feed = feed_payload()
+    cases = {
+        "/api/books": (lambda: old_rows(conn, BOOK_SQL), lambda: new_rows(conn, BOOK_SQL)),
+        "/api/library": (lambda: old_rows(conn, LIBRARY_SQL), lambda: new_rows(conn, LIBRARY_SQL)),
+        "/api/global_feed": (lambda: json.dumps(feed, sort_keys=True).encode(), lambda: new_obj(feed)),
+    }
+
+    encoder = "orjson" if responses.orjson is not None else "stdlib (orjson not installed)"
+    print(f"encoder: {encoder}")
+    print(f"{'route':<18}{'old ms':>9}{'new ms':>9}{'raw KB':>9}{'gzip KB':>9}{'gzip ms':>9}{'br KB':>8}{'br ms':>8}")
+    for route, (old, new) in cases.items():
+        old_ms, _ = timed(old, args.repeat)
+        new_ms, body = timed(new, args.repeat)
+        gz_ms, gz = timed(lambda: gzip.compress(body, compresslevel=responses.GZIP_LEVEL), args.repeat)
+        if responses.brotli is not None:
+            br_ms, br = timed(lambda: responses.brotli.compress(body, quality=responses.BROTLI_QUALITY), args.repeat)
+            br_cols = f"{len(br) / 1024:>8.1f}{br_ms:>8.2f}"
+        else:
+            br_cols = f"{'n/a':>8}{'n/a':>8}"
+        print(f"{route:<18}{old_ms:>9.2f}{new_ms:>9.2f}{len(body) / 1024:>9.1f}{len(gz) / 1024:>9.1f}{gz_ms:>9.2f}{br_cols}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+"""
+Shared response cache: TTL + LRU, stale-while-revalidate and request coalescing.
+
+    cache = ResponseCache(MemoryBackend(max_entries=1000), ttl=600, stale_ttl=3600)
+    data = cache.get_or_fetch(url, params, lambda: fetch_json(url, params))
+
+Entries younger than `ttl` are served as hits. Entries between `ttl` and
+`ttl + stale_ttl` are served immediately while one background refresh runs
+on a small executor shared by every cache (at most REFRESH_MAX_PENDING
+queued per cache; past that the stale copy is served without one).
+Concurrent misses for the same key share a single upstream call.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+REFRESH_WORKERS = int(os.environ.get("PAPERO_CACHE_REFRESH_WORKERS", 4))
+REFRESH_MAX_PENDING = 64  # Per cache; stale hits past this skip the refresh
+
+_refresh_pool = None
+_refresh_pool_pid = None
+_refresh_pool_lock = threading.Lock()
+
+
+def _refresh_executor():
+    """The shared stale-while-revalidate executor, recreated after a fork (its threads don't survive one)."""
+    global _refresh_pool, _refresh_pool_pid
+    with _refresh_pool_lock:
+        if _refresh_pool is None or _refresh_pool_pid != os.getpid():
+            _refresh_pool = ThreadPoolExecutor(max_workers=REFRESH_WORKERS, thread_name_prefix="cache-refresh")
+            _refresh_pool_pid = os.getpid()
+        return _refresh_pool
+
+
+def make_key(url, params=None):
+    """Normalizes query params so equivalent requests share a cache entry."""
+    parts = []
+    for name, value in sorted((params or {}).items()):
+        if value is None:
+            continue
+        value = " ".join(str(value).split()).lower()
+        parts.append(f"{name}={value}")
+    return url + "?" + "&".join(parts)
+
+
+class MemoryBackend:
+    """In-process LRU. Fast, but each gunicorn worker has its own copy."""
+
+    blocking = False  # Safe to call on the event loop
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, stored_at):
+        with self._lock:
+            self._entries[key] = (value, stored_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteBackend:
+    """LRU stored in a SQLite file, shared by every worker on the host.
+
+    Access times are only rewritten when older than `touch_interval` seconds,
+    so hot keys don't turn every cache hit into a write.
+    """
+
+    blocking = True  # Disk I/O and lock waits: the async path calls it via asyncio.to_thread()
+
+    def __init__(self, path, max_entries=5000, touch_interval=60):
+        self.path = path
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        self.evictions = 0
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                stored_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_access ON response_cache (last_access)")
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key):
+        conn = self._conn()
+        row = conn.execute("SELECT value, stored_at, last_access FROM response_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[2] > self.touch_interval:
+            conn.execute("UPDATE response_cache SET last_access = ? WHERE key = ?", (now, key))
+            conn.commit()
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, stored_at):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO response_cache (key, value, stored_at, last_access) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value), stored_at, time.time()),
+        )
+        overflow = conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0] - self.max_entries
+        if overflow > 0:
+            conn.execute('''
+                DELETE FROM response_cache WHERE key IN (
+                    SELECT key FROM response_cache ORDER BY last_access LIMIT ?
+                )
+            ''', (overflow,))
+            self.evictions += overflow
+        conn.commit()
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+
+def _log_refresh_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Cache refresh failed: {task.exception()}")  # Keep serving the stale copy
+
+
+class ResponseCache:
+    def __init__(self, backend, ttl=600, stale_ttl=3600, name="cache"):
+        self.backend = backend
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.name = name
+        self.counters = {"hits": 0, "stale_hits": 0, "misses": 0, "coalesced": 0, "refreshes": 0, "errors": 0}
+        self._inflight = {}
+        self._inflight_async = {}
+        self._refreshing = set()  # Keys with a background refresh queued or running
+        self._lock = threading.Lock()
+
+    def _count(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def _fetch_once(self, key, fetch):
+        """Runs `fetch` for `key` unless a call is already in flight, in which case waits for it."""
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+            else:
+                self.counters["coalesced"] += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            value = fetch()
+            self.backend.set(key, value, time.time())
+            future.set_result(value)
+            return value
+        except Exception as e:
+            self._count("errors")
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _refresh_in_background(self, key, fetch):
+        with self._lock:
+            if key in self._inflight or key in self._refreshing:
+                return  # A refresh (or miss) for this key is already queued or running
+            if len(self._refreshing) >= REFRESH_MAX_PENDING:
+                return  # Refreshes are backed up; a later stale hit will try again
+            self._refreshing.add(key)
+            self.counters["refreshes"] += 1
+
+        def refresh():
+            try:
+                self._fetch_once(key, fetch)
+            except Exception as e:
+                print(f"Cache refresh failed for {key}: {e}")  # Keep serving the stale copy
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        _refresh_executor().submit(refresh)
+
+    def peek(self, url, params=None):
+        """Returns a cached value (fresh or stale) without ever calling upstream."""
+        entry = self.backend.get(make_key(url, params))
+        if entry is None:
+            return None
+        value, stored_at = entry
+        return value if time.time() - stored_at < self.ttl + self.stale_ttl else None
+
+    def store(self, url, params, value):
+        """Caches a value produced outside get_or_fetch (e.g. assembled from a stream)."""
+        self.backend.set(make_key(url, params), value, time.time())
+
+    def get_or_fetch(self, url, params, fetch):
+        key = make_key(url, params)
+        entry = self.backend.get(key)
+        if entry is not None:
+            value, stored_at = entry
+            age = time.time() - stored_at
+            if age < self.ttl:
+                self._count("hits")
+                return value
+            if age < self.ttl + self.stale_ttl:
+                self._count("stale_hits")
+                self._refresh_in_background(key, fetch)
+                return value
+
+        self._count("misses")
+        return self._fetch_once(key, fetch)
+
+    async def get_or_fetch_async(self, url, params, fetch):
+        """get_or_fetch() for the ASGI mode: `fetch` is a coroutine function.
+
+        Misses are coalesced per event loop; a stale hit schedules one refresh task.
+        """
+        key = make_key(url, params)
+        entry = await self._backend_call(self.backend.get, key)
+        if entry is not None:
+            value, stored_at = entry
+            age = time.time() - stored_at
+            if age < self.ttl:
+                self._count("hits")
+                return value
+            if age < self.ttl + self.stale_ttl:
+                self._count("stale_hits")
+                if key not in self._inflight_async:
+                    self._count("refreshes")
+                    self._fetch_once_async(key, fetch).add_done_callback(_log_refresh_failure)
+                return value
+
+        self._count("misses")
+        task = self._inflight_async.get(key)
+        if task is not None:
+            self._count("coalesced")
+        else:
+            task = self._fetch_once_async(key, fetch)
+        # shield(): one caller giving up must not cancel the fetch the others are waiting on
+        return await asyncio.shield(task)
+
+    async def _backend_call(self, method, *args):
+        if self.backend.blocking:
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
+
+    def _fetch_once_async(self, key, fetch):
+        async def run():
+            try:
+                value = await fetch()
+            except Exception:
+                self._count("errors")
+                raise
+            await self._backend_call(self.backend.set, key, value, time.time())
+            return value
+
+        task = asyncio.ensure_future(run())
+        self._inflight_async[key] = task
+        task.add_done_callback(lambda _: self._inflight_async.pop(key, None))
+        return task
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        lookups = stats["hits"] + stats["stale_hits"] + stats["misses"]
+        stats.update({
+            "name": self.name,
+            "backend": type(self.backend).__name__,
+            "entries": len(self.backend),
+            "evictions": self.backend.evictions,
+            "hit_ratio": round((stats["hits"] + stats["stale_hits"]) / lookups, 3) if lookups else 0.0,
+        })
+        return stats
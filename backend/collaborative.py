@@ -0,0 +1,355 @@
+"""
+Item-item collaborative filtering over purchases and likes.
+
+Users x items is a sparse matrix of implicit feedback (purchase = 3, like = 2).
+Item similarity is the cosine between item columns; each item keeps its top
+NEIGHBORS most similar items, precomputed at fit time so serving a user is a
+handful of dict lookups:
+
+    score(u, j) = sum over items i the user has of  weight(u, i) * sim(i, j)
+
+New purchases/likes update the co-occurrence counts and re-rank neighbours of
+just the affected items, so recommendations react immediately without a refit.
+
+Fitting is a job (fit_collaborative): it saves the model as a shared artifact
+that every process, web or job worker, warm-loads. Incremental updates only
+reach the process that handled the request; the job refits from the database
+once the artifact is REFIT_SECONDS old, so every process converges.
+"""
+import heapq
+import math
+import os
+import pickle
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+from scipy.sparse import coo_matrix
+
+import jobs
+from database import get_db_connection
+
+PURCHASE_WEIGHT = 3.0
+LIKE_WEIGHT = 2.0
+NEIGHBORS = 30
+
+ARTIFACT_PATH = os.environ.get("PAPERO_CF_ARTIFACT",
+                               os.path.join(os.path.dirname(__file__), 'models', 'collaborative', 'item_item.pkl'))
+ARTIFACT_FORMAT = 1  # Bump when ItemItemCF's attributes change
+REFIT_SECONDS = int(os.environ.get("PAPERO_CF_REFIT_SECONDS", 900))  # Artifact age that queues a refit
+CHECK_INTERVAL = 30  # Seconds between checks for a newer artifact, per process
+
+
+def resolve_item(conn, raw_book_id):
+    """Maps a local id or an 'ext_<ia_id>' id to books.id, or None if not imported."""
+    if raw_book_id is None:
+        return None
+    raw = str(raw_book_id)
+    if raw.isdigit():
+        return int(raw)
+    if raw.startswith('ext_'):
+        row = conn.execute("SELECT id FROM books WHERE ia_id = ?", (raw.replace('ext_', '', 1),)).fetchone()
+        return row['id'] if row else None
+    return None  # e.g. onboarding genres, which are not items
+
+
+def load_feedback(conn, user_id=None):
+    """({(user, item): weight}, {user: {disliked items}}) from purchases and active likes, for one user or all."""
+    where, params = ("AND user_id = ?", (user_id,)) if user_id is not None else ("", ())
+    events = defaultdict(float)
+    disliked = defaultdict(set)
+    for row in conn.execute(f"SELECT user_id, book_id FROM purchases WHERE user_id IS NOT NULL {where}", params):
+        events[(row['user_id'], row['book_id'])] += PURCHASE_WEIGHT
+
+    ia_to_id = None
+    for row in conn.execute("SELECT user_id, book_id, interaction_type FROM interactions "
+                            f"WHERE interaction_type IN ('like', 'dislike') AND active = 1 {where}", params):
+        raw = str(row['book_id'])
+        if raw.startswith('ext_'):
+            if ia_to_id is None:
+                ia_to_id = {r['ia_id']: r['id'] for r in conn.execute("SELECT id, ia_id FROM books WHERE ia_id IS NOT NULL")}
+            item = ia_to_id.get(raw.replace('ext_', '', 1))
+        else:
+            item = int(raw) if raw.isdigit() else None
+        if item is None:
+            continue
+        if row['interaction_type'] == 'like':
+            events[(row['user_id'], item)] += LIKE_WEIGHT
+        else:
+            disliked[row['user_id']].add(item)
+    return events, disliked
+
+
+class ItemItemCF:
+    def __init__(self, neighbors=NEIGHBORS):
+        self.n_neighbors = neighbors
+        self.user_items = defaultdict(dict)   # user -> {item: weight}
+        self.disliked = defaultdict(set)      # user -> {item}
+        self.co = defaultdict(dict)           # item -> {item: sum of weight products}
+        self.norm_sq = defaultdict(float)     # item -> sum of squared weights
+        self.neighbors = {}                   # item -> [(item, similarity)], best first
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    # --- ARTIFACT ---
+
+    def save(self, path=ARTIFACT_PATH):
+        """Writes the model to a temp file and renames it into place, so a loading worker never sees half of it."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.building-')
+        try:
+            with os.fdopen(fd, 'wb') as f, self._lock:
+                pickle.dump({'format': ARTIFACT_FORMAT, 'model': self}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    @staticmethod
+    def load(path=ARTIFACT_PATH):
+        """The saved model, or None if there is none in the current format."""
+        try:
+            with open(path, 'rb') as f:
+                saved = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        return saved['model'] if saved.get('format') == ARTIFACT_FORMAT else None
+
+    # --- OFFLINE BUILD ---
+
+    def fit(self, conn):
+        """Loads all feedback, builds the co-occurrence matrix and every neighbour list."""
+        events, disliked = load_feedback(conn)
+        for user, items in disliked.items():
+            self.disliked[user] |= items
+
+        for (user, item), weight in events.items():
+            self.user_items[user][item] = weight
+        if not events:
+            return self
+
+        users = {u: n for n, u in enumerate(self.user_items)}
+        items = sorted({item for _, item in events})
+        item_pos = {item: n for n, item in enumerate(items)}
+        rows = [users[u] for u, _ in events]
+        cols = [item_pos[i] for _, i in events]
+        X = coo_matrix((list(events.values()), (rows, cols)), shape=(len(users), len(items))).tocsc()
+
+        co = (X.T @ X).tocsr()  # items x items; only pairs sharing a user are stored
+        norm_sq = np.asarray(X.multiply(X).sum(axis=0)).ravel()
+        for a in range(co.shape[0]):
+            start, end = co.indptr[a], co.indptr[a + 1]
+            self.co[items[a]] = {items[b]: float(v) for b, v in zip(co.indices[start:end], co.data[start:end]) if b != a}
+            self.norm_sq[items[a]] = float(norm_sq[a])
+        for item in items:
+            self._rank_neighbors(item)
+        return self
+
+    def _rank_neighbors(self, item):
+        norm = self.norm_sq.get(item, 0.0)
+        if not norm:
+            self.neighbors.pop(item, None)
+            return
+        scored = ((other, c / math.sqrt(norm * self.norm_sq[other]))
+                  for other, c in self.co[item].items() if c > 0 and self.norm_sq.get(other))
+        self.neighbors[item] = heapq.nlargest(self.n_neighbors, scored, key=lambda x: x[1])
+
+    # --- INCREMENTAL REFRESH ---
+
+    def add_feedback(self, user_id, item, delta):
+        """Adds `delta` to the user's weight for `item` (negative to undo a like)."""
+        with self._lock:
+            items = self.user_items[user_id]
+            old = items.get(item, 0.0)
+            new = max(0.0, old + delta)
+            change = new - old
+            if not change:
+                return
+            if new:
+                items[item] = new
+            else:
+                items.pop(item, None)
+
+            self.norm_sq[item] += new * new - old * old
+            touched = [item]
+            for other, w in items.items():
+                if other == item:
+                    continue
+                self.co[item][other] = self.co[item].get(other, 0.0) + change * w
+                self.co[other][item] = self.co[other].get(item, 0.0) + change * w
+                touched.append(other)
+            for t in touched:
+                self._rank_neighbors(t)
+
+    def sync_user(self, conn, user_id):
+        """Re-reads one user's purchases and likes from the database and applies the difference.
+
+        A process only sees its own requests' incremental updates; this brings
+        the user's row up to date whichever worker recorded the feedback.
+        """
+        events, disliked = load_feedback(conn, user_id)
+        wanted = {item: weight for (_, item), weight in events.items()}
+        with self._lock:
+            current = dict(self.user_items.get(user_id, {}))
+        for item in set(current) | set(wanted):
+            delta = wanted.get(item, 0.0) - current.get(item, 0.0)
+            if delta:
+                self.add_feedback(user_id, item, delta)
+        with self._lock:
+            self.disliked[user_id] = disliked.get(user_id, set())
+
+    def set_disliked(self, user_id, item, active):
+        with self._lock:
+            if active:
+                self.disliked[user_id].add(item)
+            else:
+                self.disliked[user_id].discard(item)
+
+    # --- SERVING ---
+
+    def recommend(self, user_id, n=30):
+        """Top-n [(book_id, score)] for a user, excluding owned, liked and disliked books."""
+        scores = defaultdict(float)
+        # Under the lock: request threads mutate these dicts through add_feedback()
+        with self._lock:
+            items = self.user_items.get(user_id)
+            if not items:
+                return []
+            seen = set(items) | self.disliked.get(user_id, set())
+            for item, weight in items.items():
+                for other, sim in self.neighbors.get(item, ()):
+                    if other not in seen:
+                        scores[other] += weight * sim
+        return heapq.nlargest(n, scores.items(), key=lambda x: x[1])
+
+
+# --- LIVE MODEL (one per worker process) ---
+
+_live = None
+_live_mtime = None  # mtime of the artifact _live was loaded from
+_live_lock = threading.Lock()
+_last_check = float('-inf')
+_load_thread = None
+
+
+def artifact_mtime():
+    try:
+        return os.path.getmtime(ARTIFACT_PATH)
+    except OSError:
+        return None
+
+
+def _swap(model, mtime):
+    global _live, _live_mtime
+    with _live_lock:
+        if _live_mtime is None or mtime is None or mtime >= _live_mtime:
+            _live, _live_mtime = model, mtime
+
+
+def refit():
+    """Fits on every purchase and like, saves the shared artifact and swaps it in here. Jobs only."""
+    conn = get_db_connection()
+    try:
+        model = ItemItemCF().fit(conn)
+    finally:
+        conn.close()
+    model.save(ARTIFACT_PATH)
+    _swap(model, artifact_mtime())
+    return model
+
+
+def get_live_model():
+    """This process's model for job code: warm-loaded inline, or fitted if no artifact exists yet."""
+    mtime = artifact_mtime()
+    if _live is not None and (mtime is None or mtime == _live_mtime):
+        return _live
+    model = ItemItemCF.load(ARTIFACT_PATH) if mtime is not None else None
+    if model is None:
+        return refit()
+    _swap(model, mtime)
+    return _live
+
+
+def live_model_loaded():
+    return _live is not None
+
+
+def live_model():
+    """The model if this process has one loaded, else None. Never fits or loads on the caller's thread.
+
+    At most every CHECK_INTERVAL seconds it looks at the artifact: a newer one
+    is warm-loaded on a background thread, and a missing or REFIT_SECONDS-old
+    one queues a fit_collaborative job.
+    """
+    global _last_check, _load_thread
+    if time.monotonic() - _last_check < CHECK_INTERVAL:
+        return _live
+    with _live_lock:
+        if time.monotonic() - _last_check < CHECK_INTERVAL:
+            return _live
+        _last_check = time.monotonic()
+        mtime = artifact_mtime()
+        loading = _load_thread is not None and _load_thread.is_alive()
+        if mtime is not None and mtime != _live_mtime and not loading:
+            _load_thread = threading.Thread(target=_warm_load, args=(mtime,), daemon=True, name="cf-load")
+            _load_thread.start()
+    if mtime is None or time.time() - mtime > REFIT_SECONDS:
+        request_fit()
+    return _live
+
+
+def _warm_load(mtime):
+    try:
+        model = ItemItemCF.load(ARTIFACT_PATH)
+    except Exception as e:
+        print(f"⚠️ Collaborative model load failed: {e}")
+        return
+    if model is None:
+        request_fit()  # Saved in an older format
+        return
+    _swap(model, mtime)
+
+
+def request_fit():
+    """Queues a fit on the job worker (deduplicated across processes)."""
+    return jobs.submit('fit_collaborative', dedupe_key='fit_collaborative')
+
+
+def record_purchase(user_id, book_id):
+    """Mirrors a purchase into this process's model (other processes see it after the next refit)."""
+    if _live is not None:
+        _live.add_feedback(int(user_id), int(book_id), PURCHASE_WEIGHT)
+
+
+def record_interaction(user_id, item, action, active):
+    """Mirrors an interactions-table toggle into the live model (no-op until loaded)."""
+    if _live is None or item is None:
+        return
+    if action == 'like':
+        _live.add_feedback(int(user_id), item, LIKE_WEIGHT if active else -LIKE_WEIGHT)
+    elif action == 'dislike':
+        _live.set_disliked(int(user_id), item, active)
+
+
+if __name__ == "__main__":
+    # Offline build + serving latency report: python collaborative.py [user_id ...]
+    conn = get_db_connection()
+    started = time.perf_counter()
+    model = ItemItemCF().fit(conn)
+    conn.close()
+    print(f"Fitted {len(model.user_items)} users x {len(model.neighbors)} items in {time.perf_counter() - started:.3f}s")
+    for user in (int(u) for u in sys.argv[1:]):
+        started = time.perf_counter()
+        recs = model.recommend(user)
+        print(f"user {user}: {len(recs)} recs in {(time.perf_counter() - started) * 1000:.3f}ms -> {recs[:5]}")
@@ -0,0 +1,334 @@
+"""
+Compressed, chunked on-disk store for full book texts.
+
+Each book is one file: a fixed header, a chunk offset index, a page offset
+index and the UTF-8 text compressed in CHUNK_SIZE pieces (zstd when the
+`zstandard` package is installed, zlib otherwise). Files are memory-mapped, so
+reading page 250 of a 1.2MB book touches the index and decompresses one or two
+64KB chunks instead of loading the whole text.
+
+    python content_store.py --convert   # pack legacy books_data/*.txt rows
+"""
+import hashlib
+import mmap
+import os
+import shutil
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+try:
+    import zstandard
+except ImportError:  # zlib is always available
+    zstandard = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CONTENT_ROOT = os.environ.get("PAPERO_CONTENT_ROOT", os.path.join(BASE_DIR, "books_data"))
+CHUNK_SIZE = 64 * 1024    # Uncompressed bytes per chunk: the unit of decompression
+PAGE_BYTES = 3000         # Target page length, roughly one printed page
+OPEN_FILES = 64
+CHUNK_CACHE = 256         # Decompressed chunks kept in memory (~16MB)
+
+MAGIC = b"PPST"
+FORMAT = 1
+CODEC_ZLIB, CODEC_ZSTD = 1, 2
+# magic, format, codec, chunk_size, total_bytes, chunks, pages, blake2b-128 of the text
+HEADER = struct.Struct("<4sBBxxIQII16s")
+
+
+class ContentError(Exception):
+    pass
+
+
+def resolve(content_path):
+    """content_path values are stored relative to backend/ (legacy rows use 'books_data/<id>.txt')."""
+    return content_path if os.path.isabs(content_path) else os.path.join(BASE_DIR, content_path)
+
+
+def relative(path):
+    path = os.path.abspath(path)
+    return os.path.relpath(path, BASE_DIR) if path.startswith(BASE_DIR + os.sep) else path
+
+
+def _page_cut(data, pos, page_bytes):
+    """End of the page starting at `pos`: the last paragraph (or line, or space) break before page_bytes."""
+    limit = pos + page_bytes
+    for sep in (b"\n\n", b"\n", b" "):
+        cut = data.rfind(sep, pos + page_bytes // 2, limit)
+        if cut != -1:
+            return cut + len(sep)
+    cut = limit
+    while cut > pos and (data[cut] & 0xC0) == 0x80:  # Never split a UTF-8 sequence
+        cut -= 1
+    return cut
+
+
+def paginate(data, page_bytes=PAGE_BYTES):
+    """Page start offsets for a whole text."""
+    starts, pos = [0], 0
+    while len(data) - pos > page_bytes:
+        pos = _page_cut(data, pos, page_bytes)
+        starts.append(pos)
+    return starts
+
+
+def _compressor(codec):
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdCompressor(level=10).compress
+    return lambda chunk: zlib.compress(chunk, 9)
+
+
+class ContentWriter:
+    """Streams a text into a store file without holding it in memory.
+
+    Compressed chunks are spooled to a temp file as they fill; finish() writes the
+    header and indexes in front of them and renames the result into place.
+    """
+
+    def __init__(self, path, chunk_size=CHUNK_SIZE, page_bytes=PAGE_BYTES):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.page_bytes = page_bytes
+        self.codec = CODEC_ZSTD if zstandard is not None else CODEC_ZLIB
+        self._compress = _compressor(self.codec)
+        self._hash = hashlib.blake2b(digest_size=16)
+        self._pending = bytearray()   # Uncompressed bytes not yet in a chunk
+        self._page_tail = bytearray() # Bytes since the last page break
+        self._page_base = 0           # Offset of _page_tail[0] in the text
+        self.size = 0
+        self.pages = []
+        self.chunk_sizes = []
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._spool_path = f"{path}.{os.getpid()}.{threading.get_ident()}.spool"
+        self._spool = open(self._spool_path, "wb")
+
+    def write(self, data):
+        if not data:
+            return
+        if not self.pages:
+            self.pages.append(0)
+        self._hash.update(data)
+        self.size += len(data)
+
+        self._pending += data
+        while len(self._pending) >= self.chunk_size:
+            self._flush_chunk(bytes(self._pending[:self.chunk_size]))
+            del self._pending[:self.chunk_size]
+
+        self._page_tail += data
+        while len(self._page_tail) > self.page_bytes:
+            cut = _page_cut(self._page_tail, 0, self.page_bytes)
+            self._page_base += cut
+            self.pages.append(self._page_base)
+            del self._page_tail[:cut]
+
+    def _flush_chunk(self, chunk):
+        compressed = self._compress(chunk)
+        self._spool.write(compressed)
+        self.chunk_sizes.append(len(compressed))
+
+    def finish(self):
+        """Writes the store file. Returns the blake2b-128 hex digest of the text."""
+        if self._pending:
+            self._flush_chunk(bytes(self._pending))
+            self._pending.clear()
+        self._spool.close()
+        digest = self._hash.digest()
+
+        # Chunk offsets are absolute file positions; page offsets index the uncompressed text
+        data_start = HEADER.size + 8 * (len(self.chunk_sizes) + 1) + 8 * (len(self.pages) + 1)
+        chunk_offsets = [data_start]
+        for size in self.chunk_sizes:
+            chunk_offsets.append(chunk_offsets[-1] + size)
+
+        tmp = f"{self._spool_path}.tmp"
+        try:
+            with open(tmp, "wb") as f, open(self._spool_path, "rb") as spool:
+                f.write(HEADER.pack(MAGIC, FORMAT, self.codec, self.chunk_size, self.size,
+                                    len(self.chunk_sizes), len(self.pages), digest))
+                f.write(struct.pack(f"<{len(chunk_offsets)}Q", *chunk_offsets))
+                f.write(struct.pack(f"<{len(self.pages) + 1}Q", *self.pages, self.size))
+                shutil.copyfileobj(spool, f, 1024 * 1024)
+            os.replace(tmp, self.path)
+        finally:
+            for leftover in (tmp, self._spool_path):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        return digest.hex()
+
+    def abort(self):
+        self._spool.close()
+        if os.path.exists(self._spool_path):
+            os.remove(self._spool_path)
+
+
+def write_text(text, path, chunk_size=CHUNK_SIZE, page_bytes=PAGE_BYTES):
+    """Packs `text` (str or UTF-8 bytes) into a store file at `path`, atomically. Returns the text digest."""
+    writer = ContentWriter(path, chunk_size, page_bytes)
+    writer.write(text.encode("utf-8") if isinstance(text, str) else bytes(text))
+    return writer.finish()
+
+
+class ContentFile:
+    """A memory-mapped store file. Byte offsets refer to the uncompressed UTF-8 text."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mtime = os.fstat(f.fileno()).st_mtime_ns
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, fmt, self.codec, self.chunk_size, self.size, self.chunks, self.pages, digest = \
+            HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or fmt != FORMAT:
+            self.mm.close()
+            raise ContentError(f"{path} is not a content store file")
+        self.digest = digest.hex()
+        self._chunk_index = HEADER.size
+        self._page_index = self._chunk_index + 8 * (self.chunks + 1)
+
+    @property
+    def etag(self):
+        return self.digest
+
+    def close(self):
+        self.mm.close()
+
+    def page_span(self, page):
+        """(start, end) byte offsets of 1-based `page`."""
+        if not 1 <= page <= self.pages:
+            raise IndexError(page)
+        return struct.unpack_from("<QQ", self.mm, self._page_index + 8 * (page - 1))
+
+    def _chunk(self, index):
+        key = (self.path, self.mtime, index)
+        with _cache_lock:
+            chunk = _chunks.get(key)
+            if chunk is not None:
+                _chunks.move_to_end(key)
+                return chunk
+        chunk = self._decompress(index)
+        with _cache_lock:
+            _chunks[key] = chunk
+            while len(_chunks) > CHUNK_CACHE:
+                _chunks.popitem(last=False)
+        return chunk
+
+    def _decompress(self, index):
+        start, end = struct.unpack_from("<QQ", self.mm, self._chunk_index + 8 * index)
+        raw = self.mm[start:end]
+        if self.codec == CODEC_ZSTD:
+            if zstandard is None:
+                raise ContentError(f"{self.path} is zstd-compressed but zstandard is not installed")
+            return zstandard.ZstdDecompressor().decompress(raw, max_output_size=self.chunk_size)
+        return zlib.decompress(raw)
+
+    def verify(self):
+        """Decompresses every chunk and checks length and digest. Raises ContentError on mismatch."""
+        digest, size = hashlib.blake2b(digest_size=16), 0
+        try:
+            for index in range(self.chunks):
+                chunk = self._decompress(index)
+                digest.update(chunk)
+                size += len(chunk)
+        except zlib.error as e:
+            raise ContentError(f"{self.path}: corrupt chunk ({e})")
+        if size != self.size or digest.hexdigest() != self.digest:
+            raise ContentError(f"{self.path}: content does not match its checksum")
+        return self.digest
+
+    def read_bytes(self, start, end):
+        """Uncompressed bytes [start, end), decompressing only the chunks that overlap."""
+        start, end = max(0, start), min(end, self.size)
+        if start >= end:
+            return b""
+        first, last = start // self.chunk_size, (end - 1) // self.chunk_size
+        parts = [self._chunk(i) for i in range(first, last + 1)]
+        base = first * self.chunk_size
+        return b"".join(parts)[start - base:end - base]
+
+    def read_page(self, page):
+        start, end = self.page_span(page)
+        return self.read_bytes(start, end).decode("utf-8")
+
+
+_files = OrderedDict()
+_chunks = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def open_content(path):
+    """Shared ContentFile for `path`, reopened if the file was rewritten."""
+    path = resolve(path)
+    mtime = os.stat(path).st_mtime_ns
+    with _cache_lock:
+        cf = _files.get(path)
+        if cf is not None and cf.mtime == mtime:
+            _files.move_to_end(path)
+            return cf
+    cf = ContentFile(path)
+    with _cache_lock:
+        _files.pop(path, None)
+        _files[path] = cf
+        while len(_files) > OPEN_FILES:
+            _files.popitem(last=False)
+    # Evicted maps are left to the GC: a concurrent reader may still hold them
+    return cf
+
+
+def path_for(gutenberg_id=None, book_id=None):
+    name = f"gb{gutenberg_id}" if gutenberg_id is not None else f"book{book_id}"
+    return os.path.join(CONTENT_ROOT, f"{name}.pst")
+
+
+def store_text(text, gutenberg_id=None, book_id=None):
+    """Writes a book into CONTENT_ROOT. Returns (content_path for the books row, digest)."""
+    path = path_for(gutenberg_id, book_id)
+    digest = write_text(text, path)
+    return relative(path), digest
+
+
+def is_store_file(path):
+    try:
+        with open(resolve(path), "rb") as f:
+            return f.read(4) == MAGIC
+    except OSError:
+        return False
+
+
+def convert_legacy(conn, book_id, content_path):
+    """Packs a raw .txt written by the old ingest_gutenberg into the store and repoints the row."""
+    with open(resolve(content_path), "rb") as f:
+        data = f.read()
+    row = conn.execute("SELECT gutenberg_id FROM books WHERE id = ?", (book_id,)).fetchone()
+    new_path, _ = store_text(data, gutenberg_id=row[0] if row else None, book_id=book_id)
+    conn.execute("UPDATE books SET content_path = ? WHERE id = ?", (new_path, book_id))
+    conn.commit()
+    return new_path
+
+
+def convert_all(conn):
+    rows = conn.execute("SELECT id, content_path FROM books WHERE content_path IS NOT NULL").fetchall()
+    converted = 0
+    for book_id, content_path in rows:
+        if is_store_file(content_path) or not os.path.exists(resolve(content_path)):
+            continue
+        new_path = convert_legacy(conn, book_id, content_path)
+        print(f"📦 Book {book_id}: {content_path} -> {new_path}")
+        converted += 1
+    return converted
+
+
+if __name__ == "__main__":
+    import sys
+    from database import get_db_connection, init_db
+
+    if "--convert" not in sys.argv:
+        print(__doc__)
+        sys.exit(0)
+    init_db()
+    conn = get_db_connection()
+    try:
+        print(f"Converted {convert_all(conn)} books.")
+    finally:
+        conn.close()
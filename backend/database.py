@@ -1,5 +1,11 @@
 import sqlite3
 import os
+import queue
+import threading
+
+from flask import g, has_app_context
+
+from migrations import migrate, current_version
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 # Store DB in the backend directory for consistency, or root. 
@@ -10,109 +16,180 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 # Safe bet: Use os.path.dirname(__file__) which is 'backend/'. 
 # But if app.py is run from root, 'ebook_market.db' is in root.
 # I will switch to using the ROOT directory explicitly.
-DB_NAME = os.path.join(os.path.dirname(BASE_DIR), "ebook_market.db")
+DB_NAME = os.environ.get("PAPERO_DB_PATH") or os.path.join(os.path.dirname(BASE_DIR), "ebook_market.db")
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
+# --- CONNECTION POOL ---
+# Each gunicorn worker keeps a small pool of long-lived connections instead of
+# paying sqlite3.connect() (plus pragma setup) on every request.
+POOL_SIZE = int(os.environ.get("PAPERO_DB_POOL_SIZE", 8))  # 0 disables pooling
+BUSY_TIMEOUT_MS = int(os.environ.get("PAPERO_DB_BUSY_TIMEOUT_MS", 5000))
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",       # Readers never block the single writer
+    "PRAGMA synchronous = NORMAL",     # Durable across app crashes in WAL mode, far fewer fsyncs
+    "PRAGMA cache_size = -16000",      # ~16MB page cache per connection
+    "PRAGMA mmap_size = 268435456",    # Memory-map up to 256MB of the DB file
+    "PRAGMA temp_store = MEMORY",
+    f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+)
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() hands it back to the pool.
+
+    Existing call sites keep doing `conn = get_db_connection() ... conn.close()`;
+    nested checkouts inside one Flask request share the same connection and only
+    the request teardown actually returns it.
+    """
+    pool = None
+    checkouts = 0
+    request_scoped = False
+
+    def close(self):
+        if self.pool is None:
+            return super().close()
+        if self.checkouts <= 0:
+            return  # Already handed back (double close)
+        self.checkouts -= 1
+        if self.checkouts > 0:
+            return
+        if self.request_scoped:
+            # Match plain sqlite3 semantics: closing discards uncommitted work.
+            # The request teardown returns the connection itself.
+            if self.in_transaction:
+                self.rollback()
+        else:
+            self.pool.release(self)
+
+    def discard(self):
+        self.pool = None
+        super().close()
+
+
+class ConnectionPool:
+    """LIFO pool of configured connections, owned by a single process."""
+
+    def __init__(self, db_name, size=POOL_SIZE):
+        self.db_name = db_name
+        self.size = size
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue(maxsize=max(size, 1))
+        self._lock = threading.Lock()
+        self.stats = {"created": 0, "reused": 0, "discarded": 0}
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_name,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            factory=PooledConnection,
+            check_same_thread=False,  # Connections migrate between request threads
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        with self._lock:
+            self.stats["created"] += 1
+        return conn
+
+    def acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self.stats["reused"] += 1
+        except queue.Empty:
+            conn = self._connect()
+        conn.pool = self
+        conn.checkouts = 1
+        conn.request_scoped = False
+        return conn
+
+    def release(self, conn):
+        conn.checkouts = 0
+        try:
+            if conn.in_transaction:
+                conn.rollback()  # Never leak a half-finished transaction to the next user
+            self._idle.put_nowait(conn)
+        except (queue.Full, sqlite3.Error):
+            with self._lock:
+                self.stats["discarded"] += 1
+            conn.discard()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().discard()
+            except queue.Empty:
+                return
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Returns this process's pool, rebuilding it after a fork (gunicorn workers)."""
+    global _pool
+    if _pool is None or _pool.pid != os.getpid() or _pool.db_name != DB_NAME:
+        with _pool_lock:
+            if _pool is None or _pool.pid != os.getpid() or _pool.db_name != DB_NAME:
+                # Inherited connections belong to the parent; drop them without closing.
+                _pool = ConnectionPool(DB_NAME)
+    return _pool
+
+
+def _connect_unpooled():
+    conn = sqlite3.connect(DB_NAME, timeout=BUSY_TIMEOUT_MS / 1000)
     conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
     return conn
 
+
+def get_db_connection():
+    # Legacy mode (used by the benchmark baseline): one fresh connection per call
+    if POOL_SIZE <= 0:
+        return _connect_unpooled()
+
+    # Inside a Flask request: check out once, share across helpers, return on teardown
+    if has_app_context():
+        conn = g.get("_papero_db")
+        if conn is None:
+            conn = get_pool().acquire()
+            conn.request_scoped = True
+            g._papero_db = conn
+        else:
+            conn.checkouts += 1
+        return conn
+
+    return get_pool().acquire()
+
+
+def get_own_connection():
+    """A connection of the caller's own, even inside a request (never the shared request connection).
+
+    For writes that must commit independently of the request's transaction.
+    """
+    if POOL_SIZE <= 0:
+        return _connect_unpooled()
+    return get_pool().acquire()
+
+
+def release_request_connection(exc=None):
+    """Flask teardown hook: returns the request's connection to the pool."""
+    conn = g.pop("_papero_db", None)
+    if conn is not None and conn.pool is not None:
+        conn.pool.release(conn)
+
+
+def init_app(app):
+    app.teardown_appcontext(release_request_connection)
+
 def init_db():
     conn = get_db_connection()
-    c = conn.cursor()
-    
-    # Users Table
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Books Table (Real Content from Internet Archive)
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS books (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ia_id TEXT UNIQUE,          -- Internet Archive ID (e.g. 'prideandprejudic00aust')
-            title TEXT NOT NULL,
-            author TEXT NOT NULL,
-            cover_url TEXT,             -- Full URL to OpenLibrary Cover
-            category TEXT,
-            description TEXT,
-            price INTEGER DEFAULT 0,    -- Pre-calculated Price in INR
-            rating REAL DEFAULT 4.5,
-            year INTEGER
-        )
-    ''')
-    
-    # Purchases Table
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS purchases (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            book_id INTEGER,
-            purchase_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            progress INTEGER DEFAULT 0,
-            last_read_at TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            FOREIGN KEY (book_id) REFERENCES books (id),
-            UNIQUE(user_id, book_id)
-        )
-    ''')
-
-    # --- PHASE 6: NEW INTERACTIVE TABLES ---
-
-    # User Profiles (Gamification & Avatar)
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS user_profiles (
-            user_id INTEGER PRIMARY KEY,
-            bio TEXT,
-            avatar_url TEXT,
-            fav_genres TEXT, -- JSON string
-            streak_days INTEGER DEFAULT 0,
-            last_login TIMESTAMP,
-            badges TEXT, -- JSON string
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-
-    # Interactions (Likes/Dislikes for AI Training)
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS interactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            book_id TEXT, -- Can be local ID or global 'ext_' ID
-            interaction_type TEXT, -- 'like', 'dislike', 'onboard_interest'
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-
-    # Comments & Ratings (Community)
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS comments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            book_id TEXT, -- Can be local ID or global 'ext_' ID
-            text TEXT,
-            rating INTEGER, -- 1-5 Star
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # --- MIGRATION LOGIC (Self-Healing) ---
-    try:
-        # Check if 'last_read_at' exists in purchases
-        c.execute("SELECT last_read_at FROM purchases LIMIT 1")
-    except sqlite3.OperationalError:
-        print("🔧 Migrating DB: Adding 'last_read_at' to purchases...")
-        c.execute("ALTER TABLE purchases ADD COLUMN last_read_at TIMESTAMP")
-        
-    conn.commit()
+    # Tables, columns and indexes are all managed by versioned migrations
+    migrate(conn)
+    version = current_version(conn)
     conn.close()
-    print(f"Database {DB_NAME} initialized successfully with Phase 6 Schema.")
+    print(f"Database {DB_NAME} initialized successfully (schema v{version}).")
 
 if __name__ == "__main__":
     init_db()
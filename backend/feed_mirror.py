@@ -0,0 +1,157 @@
+"""
+Local mirror of OpenLibrary results for the feed's genre rows.
+
+The refresh_feed_mirror job fetches the first MIRROR_SIZE usable docs per
+genre (English, with a scan and a cover; same transform as the live feed)
+into ol_mirror, and /api/global_feed samples a random window from it with a
+single primary-key range read. Feed generation is then a local read; the
+upstream is only touched out of band, or live when a genre has no mirror yet.
+
+    python feed_mirror.py [--force] [genre ...]
+"""
+import json
+import os
+import random
+import time
+
+import http_client
+import jobs
+import openlibrary
+from database import get_db_connection
+
+GENRES = ['thriller', 'romance', 'history', 'science fiction', 'fantasy', 'biography', 'horror', 'business', 'cooking', 'art']
+MIRROR_SIZE = int(os.environ.get("PAPERO_FEED_MIRROR_SIZE", 200))          # Books kept per genre
+REFRESH_SECONDS = int(os.environ.get("PAPERO_FEED_MIRROR_REFRESH", 6 * 3600))
+PAGE_SIZE = 100
+MAX_PAGES = 6            # Filtering drops docs; stop looking after this many pages
+MIN_BOOKS = 30           # A refresh that finds fewer keeps the previous mirror
+CHECK_INTERVAL = 60      # Seconds between staleness checks from the request path
+
+SAMPLE_SQL = "SELECT doc FROM ol_mirror WHERE genre = ? AND slot >= ? ORDER BY slot LIMIT ?"
+
+metrics = {"hits": 0, "misses": 0}
+_last_check = 0.0
+
+
+def fetch_genre(genre, size=MIRROR_SIZE):
+    """Up to `size` de-duplicated feed books for `genre`, straight from OpenLibrary (no response cache)."""
+    query = f"subject:{genre}"
+    books, seen = [], set()
+    for page in range(MAX_PAGES):
+        params = dict(openlibrary.edition_params(query, PAGE_SIZE, page * PAGE_SIZE), fields=openlibrary.SEARCH_FIELDS)
+        response = http_client.get(openlibrary.SEARCH_URL, params=params, timeout=(3.05, 30))
+        response.raise_for_status()
+        res = response.json()
+        for book in openlibrary.edition_books(res, query):
+            if book['ia_id'] not in seen:
+                seen.add(book['ia_id'])
+                books.append(book)
+        if len(books) >= size or len(res.get('docs', [])) < PAGE_SIZE:
+            break
+    return books[:size]
+
+
+def store_genre(conn, genre, books):
+    """Replaces a genre's mirror in one transaction; readers see the old rows until it commits."""
+    conn.execute("DELETE FROM ol_mirror WHERE genre = ?", (genre,))
+    conn.executemany("INSERT INTO ol_mirror (genre, slot, ia_id, doc) VALUES (?, ?, ?, ?)",
+                     [(genre, slot, book['ia_id'], json.dumps(book)) for slot, book in enumerate(books)])
+    conn.execute('''
+        INSERT INTO ol_mirror_genres (genre, size, refreshed_at, last_error) VALUES (?, ?, ?, NULL)
+        ON CONFLICT(genre) DO UPDATE SET size = excluded.size, refreshed_at = excluded.refreshed_at, last_error = NULL
+    ''', (genre, len(books), time.time()))
+    conn.commit()
+
+
+def record_error(conn, genre, error):
+    conn.execute('''
+        INSERT INTO ol_mirror_genres (genre, last_error) VALUES (?, ?)
+        ON CONFLICT(genre) DO UPDATE SET last_error = excluded.last_error
+    ''', (genre, error))
+    conn.commit()
+
+
+def stale_genres(conn, now=None):
+    now = now or time.time()
+    refreshed = dict(conn.execute("SELECT genre, refreshed_at FROM ol_mirror_genres").fetchall())
+    return [g for g in GENRES if refreshed.get(g) is None or now - refreshed[g] > REFRESH_SECONDS]
+
+
+def refresh(genres=None, force=False, progress=None):
+    """Refreshes the given genres (default: the stale ones, or all with force). Returns a summary."""
+    conn = get_db_connection()
+    try:
+        todo = genres or (GENRES if force else stale_genres(conn))
+        refreshed, failed = {}, {}
+        for done, genre in enumerate(todo):
+            if progress:
+                progress({'genre': genre, 'done': done, 'total': len(todo)})
+            try:
+                books = fetch_genre(genre)
+            except Exception as e:
+                failed[genre] = str(e)
+            else:
+                if len(books) >= MIN_BOOKS:
+                    store_genre(conn, genre, books)
+                    refreshed[genre] = len(books)
+                    continue
+                failed[genre] = f"only {len(books)} usable books"
+            # Keep serving the previous mirror; the next refresh tries again
+            record_error(conn, genre, failed[genre])
+            print(f"⚠️ Feed mirror refresh for {genre} failed: {failed[genre]}")
+        if refreshed:
+            print(f"🪞 Feed mirror refreshed: {', '.join(f'{g} ({n})' for g, n in refreshed.items())}")
+        return {'refreshed': refreshed, 'failed': failed}
+    finally:
+        conn.close()
+
+
+def request_refresh(force=False):
+    """Queues a refresh job if any genre is stale. Checked at most once per CHECK_INTERVAL per process."""
+    global _last_check
+    now = time.time()
+    if not force and now - _last_check < CHECK_INTERVAL:
+        return None
+    _last_check = now
+    conn = get_db_connection()
+    try:
+        stale = stale_genres(conn, now)
+    finally:
+        conn.close()
+    if not stale and not force:
+        return None
+    return jobs.submit('refresh_feed_mirror', {'force': force}, dedupe_key='refresh_feed_mirror')
+
+
+def sample(conn, genre, limit):
+    """`limit` consecutive mirrored books from a random slot, or None if the genre isn't mirrored yet."""
+    row = conn.execute("SELECT size FROM ol_mirror_genres WHERE genre = ?", (genre,)).fetchone()
+    if not row or row[0] < limit:
+        metrics["misses"] += 1
+        return None
+    start = random.randint(0, row[0] - limit)
+    metrics["hits"] += 1
+    return [json.loads(doc) for (doc,) in conn.execute(SAMPLE_SQL, (genre, start, limit))]
+
+
+def stats():
+    conn = get_db_connection()
+    try:
+        rows = conn.execute("SELECT genre, size, refreshed_at, last_error FROM ol_mirror_genres").fetchall()
+    finally:
+        conn.close()
+    now = time.time()
+    genres = {genre: {'size': size,
+                      'age_s': round(now - refreshed_at) if refreshed_at else None,
+                      'last_error': last_error}
+              for genre, size, refreshed_at, last_error in rows}
+    return dict(metrics, genres=genres)
+
+
+if __name__ == "__main__":
+    import sys
+    from database import init_db
+
+    init_db()
+    args = [a for a in sys.argv[1:] if a != "--force"]
+    print(refresh(genres=args or None, force="--force" in sys.argv))
@@ -0,0 +1,330 @@
+"""
+Outbound HTTP for every upstream we call (openlibrary.org, gutenberg.org, the
+Hugging Face router).
+
+One shared requests.Session keeps TCP+TLS connections alive per host. Every
+call gets explicit connect/read timeouts, idempotent calls are retried with
+jittered exponential backoff, and a per-host circuit breaker fails fast while
+an upstream is down so it can't pin gunicorn workers.
+
+    import http_client
+    res = http_client.get("https://openlibrary.org/search.json", params=params)
+"""
+import asyncio
+import bisect
+import contextlib
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:  # Only the ASGI serving mode needs it
+    httpx = None
+
+DEFAULT_TIMEOUT = (3.05, 10)  # (connect, read) seconds
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+LATENCY_BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised without touching the network while a host's breaker is open."""
+
+
+class CircuitBreaker:
+    """closed -> open after `failure_threshold` consecutive failures,
+    open -> half_open after `reset_timeout` seconds (one trial request),
+    half_open -> closed on success, back to open on failure."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._trial_in_flight = False
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """The trial request ended without a verdict on the host; let the next request try."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"⚡ Circuit opened after {self.failures} failures")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.total_ms = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, ms):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, ms)] += 1
+            self.total_ms += ms
+
+    def snapshot(self):
+        with self._lock:
+            count = sum(self.counts)
+            labels = [f"le_{b}" for b in self.buckets] + ["le_inf"]
+            return {
+                "count": count,
+                "mean_ms": round(self.total_ms / count, 1) if count else 0.0,
+                "buckets": dict(zip(labels, self.counts)),
+            }
+
+
+class HostStats:
+    def __init__(self):
+        self.breaker = CircuitBreaker()
+        self.latency = LatencyHistogram()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.rejected = 0
+
+
+class HttpClient:
+    def __init__(self, retries=2, backoff=0.25, max_backoff=4.0, pool_maxsize=20):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.session = requests.Session()
+        # pool_connections = how many hosts keep a pool, pool_maxsize = sockets per host
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def host(self, url):
+        return self._host(url)
+
+    def _host(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = HostStats()
+            return self._hosts[host]
+
+    def retry_delay(self, attempt, response=None):
+        delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = min(self.max_backoff, float(retry_after))
+        return delay * random.uniform(0.5, 1.5)  # Jitter so workers don't retry in lockstep
+
+    def _sleep_before_retry(self, attempt, response=None):
+        time.sleep(self.retry_delay(attempt, response))
+
+    def request(self, method, url, timeout=DEFAULT_TIMEOUT, retries=None, **kwargs):
+        method = method.upper()
+        host = self._host(url)
+        if retries is None:
+            retries = self.retries if method in IDEMPOTENT_METHODS else 0
+
+        for attempt in range(retries + 1):
+            if not host.breaker.allow():
+                host.rejected += 1
+                raise CircuitOpenError(f"Circuit open for {urlsplit(url).netloc}")
+
+            host.requests += 1
+            if attempt:
+                host.retries += 1
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except requests.RequestException as e:
+                # Also ChunkedEncodingError, ContentDecodingError, InvalidURL...: every path must settle
+                # the breaker, or a failed half-open trial would leave the host rejected forever
+                host.latency.observe((time.perf_counter() - start) * 1000)
+                host.failures += 1
+                host.breaker.record_failure()
+                if attempt == retries or not isinstance(e, (requests.ConnectionError, requests.Timeout)):
+                    raise
+                self._sleep_before_retry(attempt)
+                continue
+            except BaseException:
+                host.breaker.release_trial()
+                raise
+
+            host.latency.observe((time.perf_counter() - start) * 1000)
+            if response.status_code in RETRY_STATUSES:
+                host.failures += 1
+                host.breaker.record_failure()
+                if attempt < retries:
+                    response.close()
+                    self._sleep_before_retry(attempt, response)
+                    continue
+            else:
+                host.breaker.record_success()  # 4xx means the host is up
+            return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            hosts = dict(self._hosts)
+        return {
+            name: {
+                "circuit": h.breaker.state,
+                "requests": h.requests,
+                "retries": h.retries,
+                "failures": h.failures,
+                "rejected": h.rejected,
+                "latency": h.latency.snapshot(),
+            }
+            for name, h in hosts.items()
+        }
+
+
+class AsyncHttpClient:
+    """httpx twin of HttpClient for the ASGI serving mode (asgi.py).
+
+    Same timeouts and retry policy, and it shares the sync client's per-host
+    circuit breakers and stats, so /api/metrics sees one view of each upstream.
+    """
+
+    def __init__(self, sync_client, max_connections=100, max_keepalive=20):
+        self.sync = sync_client
+        self.limits = (max_connections, max_keepalive)
+        self._sessions = {}  # One httpx.AsyncClient per event loop
+
+    def _session(self):
+        if httpx is None:
+            raise RuntimeError("The async serving mode needs httpx (pip install httpx)")
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.is_closed:
+            max_connections, max_keepalive = self.limits
+            session = self._sessions[loop] = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive),
+                follow_redirects=True,
+            )
+        return session
+
+    @staticmethod
+    def _timeout(timeout):
+        connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        return httpx.Timeout(read, connect=connect)
+
+    async def request(self, method, url, timeout=DEFAULT_TIMEOUT, retries=None, **kwargs):
+        method = method.upper()
+        host = self.sync.host(url)
+        if retries is None:
+            retries = self.sync.retries if method in IDEMPOTENT_METHODS else 0
+        session = self._session()
+
+        for attempt in range(retries + 1):
+            if not host.breaker.allow():
+                host.rejected += 1
+                raise CircuitOpenError(f"Circuit open for {urlsplit(url).netloc}")
+
+            host.requests += 1
+            if attempt:
+                host.retries += 1
+            start = time.perf_counter()
+            try:
+                response = await session.request(method, url, timeout=self._timeout(timeout), **kwargs)
+            except httpx.HTTPError as e:
+                # Same settling as HttpClient.request: any httpx error is a failure, only transport errors retry
+                host.latency.observe((time.perf_counter() - start) * 1000)
+                host.failures += 1
+                host.breaker.record_failure()
+                if attempt == retries or not isinstance(e, httpx.TransportError):
+                    raise
+                await asyncio.sleep(self.sync.retry_delay(attempt))
+                continue
+            except BaseException:
+                host.breaker.release_trial()  # Cancelled (e.g. a feed row past its deadline): no verdict
+                raise
+
+            host.latency.observe((time.perf_counter() - start) * 1000)
+            if response.status_code in RETRY_STATUSES:
+                host.failures += 1
+                host.breaker.record_failure()
+                if attempt < retries:
+                    await asyncio.sleep(self.sync.retry_delay(attempt, response))
+                    continue
+            else:
+                host.breaker.record_success()
+            return response
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    @contextlib.asynccontextmanager
+    async def stream(self, method, url, timeout=DEFAULT_TIMEOUT, **kwargs):
+        """Streaming request (no retries: the body may already be partly consumed)."""
+        host = self.sync.host(url)
+        if not host.breaker.allow():
+            host.rejected += 1
+            raise CircuitOpenError(f"Circuit open for {urlsplit(url).netloc}")
+        host.requests += 1
+        start = time.perf_counter()
+        try:
+            async with self._session().stream(method, url, timeout=self._timeout(timeout), **kwargs) as response:
+                host.latency.observe((time.perf_counter() - start) * 1000)
+                if response.status_code in RETRY_STATUSES:
+                    host.failures += 1
+                    host.breaker.record_failure()
+                else:
+                    host.breaker.record_success()
+                yield response
+        except httpx.HTTPError:
+            host.failures += 1
+            host.breaker.record_failure()
+            raise
+        except BaseException:
+            host.breaker.release_trial()
+            raise
+
+    async def aclose(self):
+        session = self._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.aclose()
+
+
+client = HttpClient()
+get = client.get
+post = client.post
+stats = client.stats
+
+async_client = AsyncHttpClient(client)
@@ -1,103 +1,234 @@
-import requests
+import http_client
+import argparse
+import hashlib
+import json
 import sqlite3
 import random
+import threading
 import time
-from database import DB_NAME, get_db_connection, init_db
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from database import get_db_connection, init_db
 
-# We want a library of ~100 books
+# We want a library of ~100 books by default, but the pipeline scales to 100k+
 # Strategy: Search for popular subjects to get guaranteed hits with Covers + IA IDs
 SUBJECTS = ["thriller", "romance", "fantasy", "science_fiction", "history", "biography"]
 
-def fetch_books_by_subject(subject, limit=20):
+PAGE_SIZE = 25          # Docs per OpenLibrary request (25 * 6 subjects = 150 potential books)
+PAGES_PER_SUBJECT = 1
+MAX_WORKERS = 4         # Concurrent fetchers
+REQUESTS_PER_SECOND = 2 # Be nice to API (shared across all fetchers)
+BATCH_SIZE = 500        # Books per INSERT transaction
+REPORT_EVERY = 5        # Seconds between progress lines
+
+class RateLimiter:
+    """Spaces calls at least 1/rate seconds apart across threads."""
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+def fetch_books_by_subject(subject, limit=20, offset=0):
     url = "https://openlibrary.org/search.json"
     params = {
         'subject': subject,
         'language': 'eng',
         'type': 'edition',
         'limit': limit,
+        'offset': offset,
         'has_fulltext': 'true'
     }
     try:
-        print(f"Fetching {subject}...")
-        res = requests.get(url, params=params).json()
+        print(f"Fetching {subject} (offset {offset})...")
+        res = http_client.get(url, params=params).json()
         return res.get('docs', [])
     except Exception as e:
         print(f"Error fetching {subject}: {e}")
-        return []
+        return None # Distinguish "failed" (retry next run) from "no more results"
+
+def to_book_row(doc, subject):
+    """OpenLibrary doc -> books row tuple, or None if it has no IA scan or cover."""
+    # Filter for valid IA ID and Cover
+    if 'ia' not in doc or 'cover_i' not in doc or not doc.get('title'):
+        return None
+    title = doc['title']
+    category = subject.replace('_', ' ').title()
+    
+    # Deterministic Price
+    price_seed = sum(ord(char) for char in title)
+    price = (price_seed % 500) + 99
+    
+    return (
+        doc['ia'][0], # Take first IA ID
+        title,
+        doc.get('author_name', ['Unknown Author'])[0],
+        category,
+        f"A classic {category} title: {title}.",
+        price,
+        round(random.uniform(3.8, 4.9), 1),
+        f"https://covers.openlibrary.org/b/id/{doc['cover_i']}-L.jpg",
+        doc.get('first_publish_year', 2000)
+    )
+
+def run_key_for(subjects, pages, page_size):
+    config = json.dumps({'subjects': sorted(subjects), 'pages': pages, 'page_size': page_size}, sort_keys=True)
+    return hashlib.sha1(config.encode()).hexdigest()[:16], config
+
+def start_or_resume_run(conn, run_key, config, fresh=False):
+    """Returns the (subject, page) pairs already done for an interrupted run with the same config."""
+    run = conn.execute("SELECT status FROM ingest_runs WHERE run_key = ?", (run_key,)).fetchone()
+    if run and run['status'] == 'running' and not fresh:
+        done = {(r['subject'], r['page']) for r in conn.execute(
+            "SELECT subject, page FROM ingest_checkpoints WHERE run_key = ?", (run_key,))}
+        print(f"⏯️ Resuming ingest run {run_key}: {len(done)} pages already done")
+        return done
+    conn.execute("DELETE FROM ingest_checkpoints WHERE run_key = ?", (run_key,))
+    conn.execute("INSERT OR REPLACE INTO ingest_runs (run_key, status, config) VALUES (?, 'running', ?)", (run_key, config))
+    conn.commit()
+    return set()
 
-def seed_database():
-    # if os.path.exists(DB_NAME):
-    #     os.remove(DB_NAME) # Clean slate
-    # init_db()
+def write_batch(conn, rows, checkpoints, run_key):
+    """Inserts a batch of books and the pages they came from in one transaction."""
+    cur = conn.executemany('''
+        INSERT OR IGNORE INTO books (ia_id, title, author, category, description, price, rating, cover_url, year)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    inserted = max(cur.rowcount, 0) # Rows actually inserted (ignored duplicates and trigger writes excluded)
+    conn.executemany('''
+        INSERT OR REPLACE INTO ingest_checkpoints (run_key, subject, page, books_found) VALUES (?, ?, ?, ?)
+    ''', [(run_key, subject, page, found) for subject, page, found in checkpoints])
+    conn.commit()
+    return inserted
+
+def seed_database(subjects=None, pages=PAGES_PER_SUBJECT, page_size=PAGE_SIZE, workers=MAX_WORKERS,
+                  rate=REQUESTS_PER_SECOND, batch_size=BATCH_SIZE, fresh=False, progress=None):
+    """Streams OpenLibrary subject pages into the books table.
     
+    Stages: concurrent rate-limited fetchers -> transform + dedupe -> batched
+    INSERT OR IGNORE in chunked transactions. Each committed batch records its
+    pages in ingest_checkpoints, so an interrupted run picks up where it left
+    off. `progress(stats)` is called after every fetched page (it is the job's
+    heartbeat and cancellation point). Returns the final stats.
+    """
+    subjects = subjects or SUBJECTS
     conn = get_db_connection()
-    c = conn.cursor()
     
     print("Seeding Library from OpenLibrary Search API...")
     
-    all_books = []
+    run_key, config = run_key_for(subjects, pages, page_size)
+    done = start_or_resume_run(conn, run_key, config, fresh)
+    tasks = [(s, p) for s in subjects for p in range(pages) if (s, p) not in done]
     
-    # 1. Fetch
-    for subject in SUBJECTS:
-        docs = fetch_books_by_subject(subject, limit=25) # 25 * 6 = 150 potential books
-        for doc in docs:
-            # Filter for valid IA ID and Cover
-            if 'ia' in doc and 'cover_i' in doc:
-                all_books.append({
-                    'title': doc.get('title'),
-                    'author': doc.get('author_name', ['Unknown Author'])[0],
-                    'ia_id': doc.get('ia')[0], # Take first IA ID
-                    'cover_id': doc.get('cover_i'),
-                    'year': doc.get('first_publish_year', 2000),
-                    'category': subject.replace('_', ' ').title()
-                })
-        time.sleep(1) # Be nice to API
-
-    # 2. Insert
-    count = 0
+    stats = {'run_key': run_key, 'pages_total': len(subjects) * pages, 'pages_done': len(done),
+             'pages_fetched': 0, 'pages_failed': 0, 'books_seen': 0, 'books_inserted': 0, 'elapsed_s': 0.0, 'books_per_s': 0.0}
+    limiter = RateLimiter(rate)
     seen_ia = set()
+    rows, checkpoints = [], []
+    started = last_report = time.perf_counter()
     
-    for book in all_books:
-        if book['ia_id'] in seen_ia:
-            continue
-        seen_ia.add(book['ia_id'])
-        
-        # Deterministic Price
-        price_seed = sum(ord(char) for char in book['title'])
-        price = (price_seed % 500) + 99 
-        
-        cover_url = f"https://covers.openlibrary.org/b/id/{book['cover_id']}-L.jpg"
-
-        try:
-            c.execute('''
-                INSERT INTO books (ia_id, title, author, category, description, price, rating, cover_url, year)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                book['ia_id'],
-                book['title'],
-                book['author'],
-                book['category'],
-                f"A classic {book['category']} title: {book['title']}.",
-                price,
-                round(random.uniform(3.8, 4.9), 1),
-                cover_url,
-                book['year']
-            ))
-            count += 1
-        except sqlite3.IntegrityError:
-            pass # Skip duplicates
+    def fetch(task):
+        subject, page = task
+        limiter.wait()
+        return task, fetch_books_by_subject(subject, limit=page_size, offset=page * page_size)
+    
+    def flush():
+        nonlocal rows, checkpoints
+        if rows or checkpoints:
+            stats['books_inserted'] += write_batch(conn, rows, checkpoints, run_key)
+            stats['pages_done'] += len(checkpoints)
+            rows, checkpoints = [], []
+        report()
 
-    # Create Demo User
+    def report():
+        nonlocal last_report
+        elapsed = time.perf_counter() - started
+        stats['elapsed_s'] = round(elapsed, 2)
+        stats['books_per_s'] = round(stats['books_inserted'] / elapsed, 1) if elapsed else 0.0
+        if progress:
+            progress(dict(stats))
+        if time.perf_counter() - last_report >= REPORT_EVERY:
+            last_report = time.perf_counter()
+            print(f"📚 {stats['pages_done']}/{stats['pages_total']} pages, "
+                  f"{stats['books_inserted']} books inserted ({stats['books_per_s']}/s)")
+    
+    try:
+        # Keep a bounded window of requests in flight so memory stays flat at any scale
+        pending = iter(tasks)
+        in_flight = set()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest") as pool:
+            for task in pending:
+                in_flight.add(pool.submit(fetch, task))
+                if len(in_flight) >= workers * 2:
+                    break
+            try:
+                while in_flight:
+                    finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        (subject, page), docs = future.result()
+                        if docs is None:
+                            stats['pages_failed'] += 1 # Not checkpointed: retried on resume
+                        else:
+                            found = 0
+                            for doc in docs:
+                                row = to_book_row(doc, subject)
+                                if row is None or row[0] in seen_ia:
+                                    continue
+                                seen_ia.add(row[0])
+                                rows.append(row)
+                                found += 1
+                            stats['books_seen'] += found
+                            checkpoints.append((subject, page, found))
+                        stats['pages_fetched'] += 1
+                        # Per page, not per batch: a run that fits in one batch must still heartbeat and be cancellable
+                        report()
+                        next_task = next(pending, None)
+                        if next_task is not None:
+                            in_flight.add(pool.submit(fetch, next_task))
+                    if len(rows) >= batch_size:
+                        flush()
+            except BaseException:
+                pool.shutdown(wait=False, cancel_futures=True) # Don't fetch queued pages for a cancelled run
+                raise
+        flush()
+    except BaseException:
+        conn.close() # Batches committed so far stay checkpointed for the next run
+        raise
+    
+    # Only a run with no failed pages counts as finished; otherwise the next call resumes it
+    if stats['pages_failed'] == 0:
+        conn.execute("UPDATE ingest_runs SET status = 'done', finished_at = CURRENT_TIMESTAMP WHERE run_key = ?", (run_key,))
+    
     # Create Demo User (Optional)
     try:
-        c.execute("INSERT INTO users (id, name, email, password_hash) VALUES (1, 'Fahim H.', 'user@test.com', 'hash')")
+        conn.execute("INSERT INTO users (id, name, email, password_hash) VALUES (1, 'Fahim H.', 'user@test.com', 'hash')")
     except sqlite3.IntegrityError:
         print("User already exists, skipping...")
     
     conn.commit()
     conn.close()
-    print(f"Database seeded with {count} books.")
+    print(f"Database seeded with {stats['books_inserted']} books "
+          f"({stats['pages_done']}/{stats['pages_total']} pages, {stats['pages_failed']} failed, "
+          f"{stats['elapsed_s']}s, {stats['books_per_s']} books/s).")
+    return stats
 
-import os
 if __name__ == "__main__":
-    seed_database()
+    parser = argparse.ArgumentParser(description="Seed the books table from OpenLibrary subjects.")
+    parser.add_argument("--subjects", help="Comma-separated subjects (default: %(default)s)", default=",".join(SUBJECTS))
+    parser.add_argument("--pages", type=int, default=PAGES_PER_SUBJECT, help="Pages per subject")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--rate", type=float, default=REQUESTS_PER_SECOND, help="Max requests/sec")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--fresh", action="store_true", help="Ignore checkpoints of an interrupted run")
+    args = parser.parse_args()
+    init_db()
+    seed_database(subjects=[s.strip() for s in args.subjects.split(",") if s.strip()], pages=args.pages,
+                  page_size=args.page_size, workers=args.workers, rate=args.rate,
+                  batch_size=args.batch_size, fresh=args.fresh)
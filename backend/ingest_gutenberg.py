@@ -1,8 +1,16 @@
-import requests
-import sqlite3
-import random
+import argparse
+import codecs
 import os
-from database import DB_NAME, get_db_connection, init_db
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import requests
+
+import http_client
+import content_store
+from database import get_db_connection, init_db
 
 # Curated list of Project Gutenberg IDs for "Kindle-quality" classics
 CLASSICS = [
@@ -18,89 +26,289 @@ CLASSICS = [
     { "id": 5200, "title": "Metamorphosis", "author": "Franz Kafka", "category": "Philosophy" }
 ]
 
-def fetch_book_text(gutenberg_id):
-    """Fetches the plain text of the book from Gutenberg."""
-    url = f"https://www.gutenberg.org/files/{gutenberg_id}/{gutenberg_id}-0.txt"
-    try:
-        response = requests.get(url)
-        response.encoding = 'utf-8' # Ensure utf-8
-        if response.status_code == 200:
-            return response.text
+DOWNLOAD_WORKERS = 6         # Concurrent downloads (each streams, so memory stays ~1 chunk per worker)
+STREAM_CHUNK = 64 * 1024
+HEADER_SCAN_BYTES = 256 * 1024 # Stop looking for the START marker after this much text
+MIN_TEXT_BYTES = 2 * 1024    # Anything shorter is an error page, not a book
+REPORT_EVERY = 5             # Seconds between progress lines
+
+START_MARKER = re.compile(rb"^\*\*\*\s*START OF (THE|THIS) PROJECT GUTENBERG", re.I)
+END_MARKER = re.compile(rb"^\*\*\*\s*END OF (THE|THIS) PROJECT GUTENBERG", re.I)
+
+def text_urls(gutenberg_id):
+    return [
+        f"https://www.gutenberg.org/files/{gutenberg_id}/{gutenberg_id}-0.txt",
         # Fallback for some IDs where URL structure differs
-        url_alt = f"https://www.gutenberg.org/cache/epub/{gutenberg_id}/pg{gutenberg_id}.txt"
-        response = requests.get(url_alt)
-        response.encoding = 'utf-8'
-        if response.status_code == 200:
-            return response.text
-        return None
-    except Exception as e:
-        print(f"Error fetching text for {gutenberg_id}: {e}")
-        return None
-
-def seed_database():
-    init_db() # Ensure tables exist
-    conn = get_db_connection()
-    c = conn.cursor()
+        f"https://www.gutenberg.org/cache/epub/{gutenberg_id}/pg{gutenberg_id}.txt",
+    ]
+
+class BoilerplateStripper:
+    """Drops the Project Gutenberg licence header and footer in one streaming pass.
     
-    print("Seeding database with Real Books...")
+    Text is fed in arbitrary UTF-8 chunks; complete lines go to `out` with CRLF
+    normalised and blank lines around the body trimmed. feed() returns False
+    once the END marker is seen, so the caller can stop reading.
+    """
+    def __init__(self, out):
+        self.out = out
+        self.saw_start = False
+        self.saw_end = False
+        self._in_body = False
+        self._carry = b""
+        self._header = []         # Lines before START, replayed if there is no marker
+        self._header_bytes = 0
+        self._blank_lines = 0
+        self._emitted = False
+
+    def feed(self, data):
+        if self.saw_end:
+            return False
+        lines = (self._carry + data).split(b"\n")
+        self._carry = lines.pop()
+        for line in lines:
+            self._line(line)
+            if self.saw_end:
+                return False
+        return True
+
+    def close(self):
+        if self._carry and not self.saw_end:
+            self._line(self._carry)
+        self._carry = b""
+        if not self._in_body:
+            self._replay_header() # No START marker at all: keep the whole text
+
+    def _line(self, line):
+        line = line.rstrip(b"\r")
+        if not self._in_body:
+            if START_MARKER.match(line.lstrip(b"\xef\xbb\xbf")):
+                self.saw_start = self._in_body = True
+                self._header = []
+                return
+            self._header.append(line)
+            self._header_bytes += len(line) + 1
+            if self._header_bytes > HEADER_SCAN_BYTES:
+                self._replay_header()
+            return
+        if END_MARKER.match(line):
+            self.saw_end = True # Trailing blank lines are dropped with the footer
+            return
+        self._body_line(line)
+
+    def _replay_header(self):
+        lines, self._header = self._header, []
+        self._in_body = True
+        for line in lines:
+            self._body_line(line)
+
+    def _body_line(self, line):
+        if not line.strip():
+            self._blank_lines += 1
+            return
+        if self._emitted and self._blank_lines:
+            self.out(b"\n" * self._blank_lines)
+        self._blank_lines = 0
+        self.out(line + b"\n")
+        self._emitted = True
+
+def response_charset(response):
+    # requests guesses ISO-8859-1 for any text/* without a charset; Gutenberg .txt files are UTF-8
+    if "charset=" in response.headers.get("Content-Type", "").lower():
+        return response.encoding
+    return "utf-8"
+
+def stream_to_store(response, path):
+    """Streams a text response through the stripper into a store file at `path`.
     
-    for book in CLASSICS:
-        # Check if already exists
-        exists = c.execute("SELECT id FROM books WHERE gutenberg_id = ?", (book['id'],)).fetchone()
-        if exists:
-            print(f"Skipping {book['title']} (Already exists)")
+    The text is transcoded to UTF-8 (strictly: bad bytes fail the download),
+    written to a temp file, re-read to check its checksum and only then moved
+    into place. Returns (digest, bytes).
+    """
+    tmp = f"{path}.download"
+    writer = content_store.ContentWriter(tmp)
+    stripper = BoilerplateStripper(writer.write)
+    decoder = codecs.getincrementaldecoder(response_charset(response))("strict")
+    try:
+        for chunk in response.iter_content(STREAM_CHUNK):
+            if not stripper.feed(decoder.decode(chunk).encode("utf-8")):
+                break
+        else:
+            stripper.feed(decoder.decode(b"", final=True).encode("utf-8"))
+        stripper.close()
+        if stripper.saw_start and not stripper.saw_end:
+            raise ValueError("END marker missing (truncated download?)")
+        if writer.size < MIN_TEXT_BYTES:
+            raise ValueError(f"only {writer.size} bytes of text")
+    except BaseException:
+        writer.abort()
+        raise
+    try:
+        digest = writer.finish()
+        stored = content_store.ContentFile(tmp)
+        try:
+            stored.verify()
+        finally:
+            stored.close()
+        size = writer.size
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return digest, size
+
+def download_book(book, manifest=None, force=False):
+    """Fetches one book into the content store. Never raises for network or content errors.
+    
+    With a manifest entry whose file still exists, the request is conditional
+    (If-None-Match / If-Modified-Since), so unchanged books cost one 304.
+    """
+    gutenberg_id = book['id']
+    path = content_store.path_for(gutenberg_id=gutenberg_id)
+    result = {'id': gutenberg_id, 'status': 'failed', 'error': None}
+    urls, headers = text_urls(gutenberg_id), {}
+    have_copy = manifest is not None and os.path.exists(content_store.resolve(manifest['content_path']))
+    if have_copy:
+        urls = [manifest['url']] + [u for u in urls if u != manifest['url']]
+        if not force:
+            if manifest['etag']:
+                headers['If-None-Match'] = manifest['etag']
+            if manifest['last_modified']:
+                headers['If-Modified-Since'] = manifest['last_modified']
+
+    for url in urls:
+        try:
+            response = http_client.get(url, headers=headers, stream=True)
+        except requests.RequestException as e:
+            result['error'] = str(e)
             continue
+        with response:
+            if response.status_code == 304 and have_copy:
+                result.update(status='unchanged', url=url, etag=manifest['etag'],
+                              last_modified=manifest['last_modified'], digest=manifest['digest'],
+                              bytes=manifest['bytes'], content_path=manifest['content_path'])
+                return result
+            if response.status_code != 200:
+                result['error'] = f"HTTP {response.status_code} from {url}"
+                continue
+            try:
+                digest, size = stream_to_store(response, path)
+            except (ValueError, requests.RequestException, content_store.ContentError) as e:
+                # UnicodeDecodeError is a ValueError
+                result['error'] = f"{url}: {e}"
+                continue
+            changed = not have_copy or digest != manifest['digest']
+            result.update(status='downloaded' if changed else 'unchanged', url=url,
+                          etag=response.headers.get('ETag'), last_modified=response.headers.get('Last-Modified'),
+                          digest=digest, bytes=size, content_path=content_store.relative(path))
+            return result
+    return result
 
-        print(f"Fetching content for: {book['title']}...")
-        content = fetch_book_text(book['id'])
-        
-        if content:
-            # Clean content (simple crop of headers/footers could go here, but keep raw for now)
-            # Assign random price
-            price = random.choice([2.99, 4.99, 0.99, 7.50, 5.99])
-            
-            # Use reliable cover service (Gutenberg covers are sometimes generic, OpenLibrary is better)
-            # Using placeholder for consistency or specific reliable URLs if possible
-            # Let's use a nice reliable placeholder service that looks like a book
-            cover_url = f"https://covers.openlibrary.org/b/title/{book['title'].replace(' ', '+')}-L.jpg"
-
-            c.execute('''
-                INSERT INTO books (gutenberg_id, title, author, category, description, price, cover_url, content_path)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                book['id'],
-                book['title'],
-                book['author'],
-                book['category'],
-                f"A classic masterpiece by {book['author']}. Read the full text now.",
-                price,
-                cover_url,
-                "db_text_storage" # Flag to say content is stored in a separate Text table or just manage dynamically. 
-                # Actually, for sqlite 70k books is heavy, but 10 is fine.
-                # Let's Update schema to store content or just save to disk?
-                # Storing 10 books in DB text column is fine.
-            ))
-            
-            # We need to update the Schema to actually store the text if we want to serve it.
-            # I forgot to add a 'content_blob' or similar to the schema in database.py
-            # For now I will assume I can update the row with the content.
-            # Wait, database.py had 'content_path'. I'll write the file to disk to keep DB light.
-            
-            filename = f"books_data/{book['id']}.txt"
-            os.makedirs("books_data", exist_ok=True)
-            with open(filename, "w", encoding="utf-8") as f:
-                f.write(content)
-                
-            # Update the record with the path
-            c.execute("UPDATE books SET content_path = ? WHERE gutenberg_id = ?", (filename, book['id']))
-            
-            print(f"-> Added {book['title']} (${price})")
-        else:
-            print(f"-> Failed to download {book['title']}")
+def record_download(conn, book, result):
+    """Upserts the manifest entry and the books row for a successful download."""
+    conn.execute('''
+        INSERT INTO gutenberg_manifest (gutenberg_id, url, etag, last_modified, digest, bytes, content_path)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(gutenberg_id) DO UPDATE SET
+            url = excluded.url, etag = excluded.etag, last_modified = excluded.last_modified,
+            digest = excluded.digest, bytes = excluded.bytes, content_path = excluded.content_path,
+            fetched_at = CASE WHEN gutenberg_manifest.digest = excluded.digest
+                              THEN gutenberg_manifest.fetched_at ELSE CURRENT_TIMESTAMP END,
+            checked_at = CURRENT_TIMESTAMP
+    ''', (book['id'], result['url'], result['etag'], result['last_modified'], result['digest'],
+          result['bytes'], result['content_path']))
 
+    existing = conn.execute("SELECT id FROM books WHERE gutenberg_id = ?", (book['id'],)).fetchone()
+    if existing:
+        conn.execute("UPDATE books SET content_path = ? WHERE id = ?", (result['content_path'], existing[0]))
+    else:
+        # Use reliable cover service (Gutenberg covers are sometimes generic, OpenLibrary is better)
+        cover_url = f"https://covers.openlibrary.org/b/title/{book['title'].replace(' ', '+')}-L.jpg"
+        conn.execute('''
+            INSERT INTO books (gutenberg_id, title, author, category, description, price, cover_url, content_path)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            book['id'],
+            book['title'],
+            book['author'],
+            book['category'],
+            f"A classic masterpiece by {book['author']}. Read the full text now.",
+            random.choice([2.99, 4.99, 0.99, 7.50, 5.99]),
+            cover_url,
+            result['content_path'],
+        ))
     conn.commit()
+
+def seed_database(books=None, workers=DOWNLOAD_WORKERS, force=False, progress=None):
+    """Downloads `books` (default: CLASSICS) into the content store and the books table.
+    
+    Downloads run `workers` at a time, each streamed to disk; only the main
+    thread touches the database. Re-runs send conditional requests and skip
+    books whose text has not changed. `progress(stats)` is called after every
+    book. Returns the final stats.
+    """
+    books = books or CLASSICS
+    init_db() # Ensure tables exist
+    conn = get_db_connection()
+    manifest = {row['gutenberg_id']: row for row in conn.execute("SELECT * FROM gutenberg_manifest")}
+    
+    print(f"Seeding database with {len(books)} Gutenberg books ({workers} workers)...")
+    
+    stats = {'total': len(books), 'done': 0, 'downloaded': 0, 'unchanged': 0, 'failed': 0,
+             'bytes': 0, 'elapsed_s': 0.0}
+    started = last_report = time.perf_counter()
+    pending = iter(books)
+    in_flight = {}
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gutenberg")
+    
+    def submit_next():
+        book = next(pending, None)
+        if book is not None:
+            in_flight[pool.submit(download_book, book, manifest.get(book['id']), force)] = book
+    
+    try:
+        # A bounded window of submitted downloads keeps thousands of titles cheap
+        for _ in range(workers * 2):
+            submit_next()
+        while in_flight:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                book = in_flight.pop(future)
+                result = future.result()
+                if result['status'] == 'failed':
+                    print(f"-> Failed to download {book['title']}: {result['error']}")
+                else:
+                    record_download(conn, book, result)
+                    if result['status'] == 'downloaded':
+                        stats['bytes'] += result['bytes']
+                        print(f"-> Added {book['title']} ({result['bytes'] // 1024} KB)")
+                stats[result['status']] += 1
+                stats['done'] += 1
+                submit_next()
+            stats['elapsed_s'] = round(time.perf_counter() - started, 2)
+            if progress:
+                progress(dict(stats))
+            if time.perf_counter() - last_report >= REPORT_EVERY:
+                last_report = time.perf_counter()
+                print(f"📚 {stats['done']}/{stats['total']} books ({stats['downloaded']} new, "
+                      f"{stats['unchanged']} unchanged, {stats['failed']} failed)")
+    except BaseException:
+        pool.shutdown(wait=False, cancel_futures=True)
+        conn.close() # Finished books are already recorded; a re-run skips them
+        raise
+    pool.shutdown()
     conn.close()
-    print("Database seeding complete!")
+    print(f"Database seeding complete! {stats['downloaded']} downloaded, {stats['unchanged']} unchanged, "
+          f"{stats['failed']} failed in {stats['elapsed_s']}s.")
+    return stats
 
 if __name__ == "__main__":
-    seed_database()
+    parser = argparse.ArgumentParser(description="Download Project Gutenberg classics into the content store.")
+    parser.add_argument("--ids", help="Comma-separated Gutenberg IDs from CLASSICS (default: all)")
+    parser.add_argument("--workers", type=int, default=DOWNLOAD_WORKERS)
+    parser.add_argument("--force", action="store_true", help="Skip conditional requests and re-download everything")
+    args = parser.parse_args()
+    books = CLASSICS
+    if args.ids:
+        wanted = {int(i) for i in args.ids.split(",") if i.strip()}
+        books = [b for b in CLASSICS if b['id'] in wanted]
+    seed_database(books=books, workers=args.workers, force=args.force)
@@ -0,0 +1,82 @@
+"""
+Like / dislike / onboarding-interest events as single-statement upserts.
+
+Each (user_id, book_id, interaction_type) has exactly one row (unique index,
+migration 13) with an `active` flag, so applying an event is one statement
+with no read first, and a batch of events shares one transaction:
+
+    toggle  INSERT ... ON CONFLICT DO UPDATE SET active = 1 - active RETURNING active
+    on      same upsert, only updating an inactive row
+    off     UPDATE ... SET active = 0 WHERE active = 1
+
+`on` and `off` are idempotent, so clients can safely replay a queued batch.
+"""
+ACTIONS = ('like', 'dislike', 'onboard_interest')
+OPS = ('toggle', 'on', 'off')
+MAX_BATCH = 1000
+
+_UPSERT = '''
+    INSERT INTO interactions (user_id, book_id, interaction_type, active) VALUES (?, ?, ?, 1)
+    ON CONFLICT (user_id, book_id, interaction_type) DO UPDATE SET {update}
+    RETURNING active
+'''
+SQL = {
+    'toggle': _UPSERT.format(update="active = 1 - active, created_at = CURRENT_TIMESTAMP"),
+    'on': _UPSERT.format(update="active = 1, created_at = CURRENT_TIMESTAMP WHERE active = 0"),
+    'off': '''
+        UPDATE interactions SET active = 0
+        WHERE user_id = ? AND book_id = ? AND interaction_type = ? AND active = 1
+        RETURNING active
+    ''',
+}
+
+
+class InvalidEvent(ValueError):
+    pass
+
+
+def parse_events(data):
+    """Validates a batch request body. Returns [(user_id, book_id, action, op)]."""
+    events = data.get('events') if isinstance(data, dict) else None
+    if not isinstance(events, list) or not events:
+        raise InvalidEvent("'events' must be a non-empty list")
+    if len(events) > MAX_BATCH:
+        raise InvalidEvent(f"At most {MAX_BATCH} events per batch")
+    parsed = []
+    for i, event in enumerate(events):
+        if not isinstance(event, dict):
+            raise InvalidEvent(f"events[{i}] must be an object")
+        user_id = event.get('user_id', data.get('user_id'))
+        book_id = event.get('book_id')
+        action = event.get('action')
+        op = event.get('op', 'toggle')
+        if not isinstance(user_id, int) or isinstance(user_id, bool):
+            raise InvalidEvent(f"events[{i}]: user_id must be an integer")
+        if book_id is None or book_id == '':
+            raise InvalidEvent(f"events[{i}]: book_id is required")
+        if action not in ACTIONS:
+            raise InvalidEvent(f"events[{i}]: action must be one of {', '.join(ACTIONS)}")
+        if op not in OPS:
+            raise InvalidEvent(f"events[{i}]: op must be one of {', '.join(OPS)}")
+        parsed.append((user_id, book_id, action, op))
+    return parsed
+
+
+def apply(conn, events):
+    """Applies [(user_id, book_id, action, op)] in one transaction.
+
+    Returns [(active, changed)] per event, in order.
+    """
+    results = []
+    try:
+        for user_id, book_id, action, op in events:
+            row = conn.execute(SQL[op], (user_id, book_id, action)).fetchall()
+            if row:
+                results.append((bool(row[0][0]), True))
+            else:  # on/off found the row already in that state
+                results.append((op == 'on', False))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return results
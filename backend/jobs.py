@@ -0,0 +1,338 @@
+"""
+Persistent background jobs: a SQLite-backed queue plus a worker thread.
+
+Anything that takes seconds (catalog seeding, model rebuilds) is submitted
+here instead of running at import time or inside a request:
+
+    job_id = jobs.submit('seed_catalog', dedupe_key='seed_catalog')
+    jobs.get(job_id)   # {'status': 'running', 'progress': {...}, ...}
+    jobs.cancel(job_id)
+
+Every gunicorn worker runs one worker thread; a job is claimed with a
+conditional UPDATE so exactly one of them runs it. Set PAPERO_JOBS_INPROCESS=0
+and run `python jobs.py` to use a dedicated worker process instead.
+Finished jobs are deleted after PAPERO_JOBS_RETENTION seconds.
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+
+from database import get_db_connection, get_own_connection
+
+POLL_INTERVAL = 2.0     # Seconds between queue checks when idle
+STALE_AFTER = 600       # A running job with no heartbeat for this long is requeued
+HEARTBEAT_INTERVAL = 60  # Seconds between heartbeats of a running job, well under STALE_AFTER
+INPROCESS = os.environ.get("PAPERO_JOBS_INPROCESS", "1") != "0"
+RETENTION = int(os.environ.get("PAPERO_JOBS_RETENTION", 24 * 3600))  # Seconds finished jobs stay visible
+PRUNE_INTERVAL = 600    # Seconds between retention sweeps per worker
+PRUNE_BATCH = 5000      # Rows per DELETE, so a backlog never holds the write lock for long
+
+HANDLERS = {}
+OPTIONS = {}  # kind -> payload keys a client may set through POST /api/jobs
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def handler(kind, options=()):
+    """Registers fn(ctx, **payload) as the implementation of a job kind.
+
+    `options` are the payload keys the jobs API accepts from clients; internal
+    submitters may pass anything the handler takes.
+    """
+    def register(fn):
+        HANDLERS[kind] = fn
+        OPTIONS[kind] = frozenset(options)
+        return fn
+    return register
+
+
+class JobContext:
+    def __init__(self, job_id, payload):
+        self.id = job_id
+        self.payload = payload
+
+    def progress(self, info=None):
+        """Records progress + heartbeat. Raises JobCancelled if a cancel was requested."""
+        conn = get_db_connection()
+        try:
+            conn.execute("UPDATE jobs SET progress = COALESCE(?, progress), heartbeat_at = CURRENT_TIMESTAMP WHERE id = ?",
+                         (json.dumps(info) if info is not None else None, self.id))
+            conn.commit()
+            cancelled = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (self.id,)).fetchone()[0]
+        finally:
+            conn.close()
+        if cancelled:
+            raise JobCancelled()
+
+
+def _row_to_dict(row):
+    job = dict(row)
+    for field in ('payload', 'progress', 'result'):
+        if job.get(field):
+            job[field] = json.loads(job[field])
+    return job
+
+
+def submit(kind, payload=None, dedupe_key=None):
+    """Queues a job and returns its id. With dedupe_key, returns the already active job instead.
+
+    Uses its own connection, so it never commits or rolls back a caller's open transaction;
+    call it after committing your own writes (an uncommitted write would hold the lock it needs).
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    conn = get_own_connection()
+    try:
+        while True:
+            try:
+                cur = conn.execute("INSERT INTO jobs (kind, payload, dedupe_key) VALUES (?, ?, ?)",
+                                   (kind, json.dumps(payload or {}), dedupe_key))
+                conn.commit()
+                job_id = cur.lastrowid
+                break
+            except sqlite3.IntegrityError:
+                conn.rollback()
+                row = conn.execute("SELECT id FROM jobs WHERE dedupe_key = ? AND status IN ('queued', 'running')",
+                                   (dedupe_key,)).fetchone()
+                if row:
+                    job_id = row[0]
+                    break
+                # The active job finished between our INSERT and SELECT; the key is free again
+    finally:
+        conn.close()
+    _wake.set()
+    return job_id
+
+
+def get(job_id):
+    conn = get_db_connection()
+    row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    conn.close()
+    return _row_to_dict(row) if row else None
+
+
+def recent(status=None, limit=50):
+    conn = get_db_connection()
+    if status:
+        rows = conn.execute("SELECT * FROM jobs WHERE status = ? ORDER BY id DESC LIMIT ?", (status, limit)).fetchall()
+    else:
+        rows = conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+    conn.close()
+    return [_row_to_dict(r) for r in rows]
+
+
+def cancel(job_id):
+    """Cancels a queued job now, or asks a running one to stop at its next progress() call."""
+    conn = get_own_connection()
+    try:
+        cur = conn.execute("UPDATE jobs SET status = 'cancelled', finished_at = CURRENT_TIMESTAMP "
+                           "WHERE id = ? AND status = 'queued'", (job_id,))
+        if not cur.rowcount:
+            cur = conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_id,))
+        conn.commit()
+        return cur.rowcount > 0
+    finally:
+        conn.close()
+
+
+# --- WORKER ---
+
+def _claim(conn, worker_id):
+    # Requeue jobs whose worker died mid-run (no heartbeat)
+    conn.execute(f'''
+        UPDATE jobs SET status = 'queued', worker = NULL
+        WHERE status = 'running' AND heartbeat_at < datetime('now', '-{int(STALE_AFTER)} seconds')
+    ''')
+    conn.commit()
+    kinds = list(HANDLERS)
+    candidate = conn.execute(
+        f"SELECT id FROM jobs WHERE status = 'queued' AND kind IN ({','.join('?' * len(kinds))}) ORDER BY id LIMIT 1",
+        kinds).fetchone()
+    if candidate is None:
+        return None
+    cur = conn.execute('''
+        UPDATE jobs SET status = 'running', worker = ?, started_at = CURRENT_TIMESTAMP, heartbeat_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND status = 'queued'
+    ''', (worker_id, candidate['id']))
+    conn.commit()
+    if not cur.rowcount:
+        return None  # Another worker got there first
+    return conn.execute("SELECT * FROM jobs WHERE id = ?", (candidate['id'],)).fetchone()
+
+
+def _finish(job_id, status, result=None, error=None):
+    conn = get_db_connection()
+    conn.execute("UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = CURRENT_TIMESTAMP WHERE id = ?",
+                 (status, json.dumps(result) if result is not None else None, error, job_id))
+    conn.commit()
+    conn.close()
+
+
+def _heartbeat(job_id, stop):
+    """Keeps a running job's heartbeat fresh until `stop` is set, so long fits aren't requeued."""
+    while not stop.wait(HEARTBEAT_INTERVAL):
+        try:
+            conn = get_own_connection()
+            try:
+                conn.execute("UPDATE jobs SET heartbeat_at = CURRENT_TIMESTAMP WHERE id = ? AND status = 'running'",
+                             (job_id,))
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Job {job_id} heartbeat failed: {e}")
+
+
+def run_next(worker_id):
+    """Claims and runs one job. Returns False if the queue was empty."""
+    conn = get_db_connection()
+    try:
+        job = _claim(conn, worker_id)
+    finally:
+        conn.close()
+    if job is None:
+        return False
+
+    payload = json.loads(job['payload'] or '{}')
+    print(f"⚙️ Job {job['id']} ({job['kind']}) started on {worker_id}")
+    started = time.perf_counter()
+    # progress() also beats, but a handler may spend longer than STALE_AFTER between calls
+    stop_heartbeat = threading.Event()
+    threading.Thread(target=_heartbeat, args=(job['id'], stop_heartbeat), daemon=True,
+                     name=f"job-{job['id']}-heartbeat").start()
+    try:
+        result = HANDLERS[job['kind']](JobContext(job['id'], payload), **payload)
+        _finish(job['id'], 'done', result=result)
+        print(f"✅ Job {job['id']} ({job['kind']}) done in {time.perf_counter() - started:.1f}s")
+    except JobCancelled:
+        _finish(job['id'], 'cancelled')
+        print(f"🛑 Job {job['id']} ({job['kind']}) cancelled")
+    except Exception as e:
+        traceback.print_exc()
+        _finish(job['id'], 'failed', error=str(e))
+    finally:
+        stop_heartbeat.set()
+    return True
+
+
+def prune(retention=None):
+    """Deletes jobs that finished more than `retention` seconds ago. Returns how many."""
+    retention = RETENTION if retention is None else retention
+    deleted = 0
+    conn = get_own_connection()
+    try:
+        while True:
+            cur = conn.execute(f'''
+                DELETE FROM jobs WHERE id IN (
+                    SELECT id FROM jobs WHERE status IN ('done', 'failed', 'cancelled')
+                    AND finished_at < datetime('now', '-{int(retention)} seconds') LIMIT {PRUNE_BATCH})
+            ''')
+            conn.commit()
+            deleted += cur.rowcount
+            if cur.rowcount < PRUNE_BATCH:
+                return deleted
+    finally:
+        conn.close()
+
+
+def work_forever(stop=None):
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    last_prune = 0.0
+    while stop is None or not stop.is_set():
+        try:
+            # Every like or purchase queues a feed rebuild; finished jobs would otherwise accumulate forever
+            if time.monotonic() - last_prune > PRUNE_INTERVAL:
+                last_prune = time.monotonic()
+                pruned = prune()
+                if pruned:
+                    print(f"🧹 Pruned {pruned} finished jobs")
+            if run_next(worker_id):
+                continue
+        except sqlite3.Error as e:
+            print(f"Job worker DB error: {e}")
+        _wake.wait(POLL_INTERVAL)
+        _wake.clear()
+
+
+_wake = threading.Event()
+_worker_pid = None
+
+
+def start_worker():
+    """Starts this process's worker thread once (safe to call from every gunicorn worker)."""
+    global _worker_pid
+    if not INPROCESS or _worker_pid == os.getpid():
+        return
+    _worker_pid = os.getpid()
+    threading.Thread(target=work_forever, daemon=True, name="job-worker").start()
+
+
+# --- JOB KINDS ---
+
+@handler('seed_catalog', options=('subjects', 'pages', 'fresh'))
+def seed_catalog_job(ctx, **options):
+    from ingest_archive import seed_database
+    # progress() doubles as the cancellation point; checkpoints make a cancelled seed resumable
+    return seed_database(progress=ctx.progress, **options)
+
+
+@handler('seed_gutenberg', options=('ids', 'force'))
+def seed_gutenberg_job(ctx, ids=None, **options):
+    from ingest_gutenberg import CLASSICS, seed_database
+    books = [b for b in CLASSICS if ids is None or b['id'] in ids]
+    return seed_database(books=books, progress=ctx.progress, **options)
+
+
+@handler('rebuild_recommender')
+def rebuild_recommender_job(ctx):
+    import recommender
+    ctx.progress({'stage': 'fitting'})
+    # Writes the artifact other workers warm-load, and swaps it into this process
+    recommender.refit_live_recommender()
+    model = recommender.get_live_recommender()
+    return {'books': model.n_base, 'artifact': model.artifact_dir}
+
+
+@handler('refresh_feed_mirror', options=('genres', 'force'))
+def refresh_feed_mirror_job(ctx, genres=None, force=False):
+    import feed_mirror
+    return feed_mirror.refresh(genres=genres, force=force, progress=ctx.progress)
+
+
+@handler('fit_collaborative')
+def fit_collaborative_job(ctx):
+    import collaborative
+    ctx.progress({'stage': 'fitting'})
+    # Writes the artifact every process warm-loads, and swaps it into this one
+    model = collaborative.refit()
+    return {'users': len(model.user_items), 'items': len(model.neighbors), 'artifact': collaborative.ARTIFACT_PATH}
+
+
+@handler('rebuild_user_feed', options=('user_id',))
+def rebuild_user_feed_job(ctx, user_id):
+    import collaborative
+    import user_feeds
+    model = collaborative.get_live_model()  # Rows are built here, so the worker's process holds the CF model
+    # The like or purchase that queued this rebuild was applied in the web worker that took it, not here
+    conn = get_db_connection()
+    try:
+        model.sync_user(conn, int(user_id))
+    finally:
+        conn.close()
+    if user_feeds.builder is None:  # Dedicated worker process: the app registers it on import
+        import app  # noqa: F401
+    label, books = user_feeds.build(user_id, user_feeds.builder)
+    return {'label': label, 'books': len(books)}
+
+
+if __name__ == "__main__":
+    from database import init_db
+    init_db()
+    print(f"Job worker running for: {', '.join(HANDLERS)}")
+    work_forever()
@@ -0,0 +1,439 @@
+"""
+Gateway for the chat model (an OpenAI-compatible /chat/completions endpoint).
+
+- Exact-prompt cache: replies are cached by model + normalized messages
+  (whitespace collapsed, case-folded), and identical prompts in flight share
+  one upstream call.
+- A semaphore caps concurrent upstream calls; callers that can't get a slot
+  within their budget fail fast with GatewayBusy instead of queueing.
+- Every call has one deadline covering queueing, connect and streaming.
+- Replies are streamed. ReplyParser pulls the "search_query" field and the
+  "text" field out of the model's JSON as it arrives, so the caller can
+  start the book search and show text before the reply is complete.
+
+Point PAPERO_LLM_URL at `python stub_upstreams.py` to run without the real model.
+"""
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+import requests
+
+import http_client
+from http_client import httpx
+from cache import ResponseCache, MemoryBackend
+
+API_URL = os.environ.get("PAPERO_LLM_URL", "https://router.huggingface.co/v1/chat/completions")
+MODEL = os.environ.get("PAPERO_LLM_MODEL", "meta-llama/Llama-3.1-8B-Instruct:cerebras")
+MAX_CONCURRENT = int(os.environ.get("PAPERO_LLM_CONCURRENCY", 4))
+TIMEOUT_BUDGET = float(os.environ.get("PAPERO_LLM_TIMEOUT", 25))  # Seconds, end to end
+CONNECT_TIMEOUT = 3.05
+CACHE_TTL = 24 * 3600
+
+
+class LLMError(Exception):
+    pass
+
+
+class LLMTimeout(LLMError):
+    pass
+
+
+class GatewayBusy(LLMError):
+    pass
+
+
+class ReplyParser:
+    """Incrementally extracts "search_query" and "text" from a streamed JSON reply.
+
+    Replies that aren't JSON are passed through as text.
+    """
+    QUERY = re.compile(r'"search_query"\s*:\s*(null|"(?:[^"\\]|\\.)*")')
+    TEXT_START = re.compile(r'"text"\s*:\s*"')
+    STRING_BODY = re.compile(r'(?:[^"\\]|\\.)*')
+
+    def __init__(self):
+        self.buffer = ""
+        self.is_json = None
+        self.query_done = False
+        self.search_query = None
+        self._text_start = None
+        self._text_sent = 0
+
+    def feed(self, delta):
+        """Returns (text_delta, search_query_if_just_found)."""
+        self.buffer += delta
+        if self.is_json is None:
+            head = self.buffer.lstrip()
+            if not head:
+                return "", None
+            self.is_json = head.startswith("{")
+        if not self.is_json:
+            return delta, None
+
+        found = None
+        if not self.query_done:
+            match = self.QUERY.search(self.buffer)
+            if match:
+                self.query_done = True
+                self.search_query = found = clean_query(json.loads(match.group(1)))
+
+        if self._text_start is None:
+            match = self.TEXT_START.search(self.buffer)
+            if match:
+                self._text_start = match.end()
+        text = ""
+        if self._text_start is not None:
+            decoded = self._decode(self.STRING_BODY.match(self.buffer, self._text_start).group(0))
+            text, self._text_sent = decoded[self._text_sent:], max(self._text_sent, len(decoded))
+        return text, found
+
+    @staticmethod
+    def _decode(raw):
+        # The tail may stop inside an escape sequence (e.g. '\\u00'); decode the safe prefix
+        while raw:
+            try:
+                return json.loads(f'"{raw}"')
+            except ValueError:
+                raw = raw[:raw.rfind("\\")] if "\\" in raw else ""
+        return ""
+
+    def result(self):
+        """The final {'text', 'search_query'} once the stream has ended."""
+        try:
+            data = json.loads(self.buffer)
+            if isinstance(data, dict):
+                return {"text": data.get("text") or "I found some books for you.",
+                        "search_query": clean_query(data.get("search_query"))}
+        except ValueError:
+            pass
+        # Fallback if JSON fails
+        return {"text": self.buffer.strip(), "search_query": self.search_query}
+
+
+def clean_query(value):
+    if not isinstance(value, str) or value.strip().lower() in ("", "null", "none"):
+        return None
+    return value.strip()
+
+
+class LLMGateway:
+    def __init__(self, url=API_URL, token=None, model=MODEL, max_concurrent=MAX_CONCURRENT,
+                 timeout=TIMEOUT_BUDGET, max_tokens=500):
+        self.url = url
+        self.token = token
+        self.model = model
+        self.timeout = timeout
+        self.max_tokens = max_tokens
+        self.cache = ResponseCache(MemoryBackend(max_entries=500), ttl=CACHE_TTL, stale_ttl=0, name="llm_replies")
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self.max_concurrent = max_concurrent
+        self._inflight = {}
+        self._inflight_async = {}
+        self._loop_slots = {}  # asyncio.Semaphore per event loop (ASGI mode)
+        self._lock = threading.Lock()
+        self.first_token = http_client.LatencyHistogram()
+        self.latency = http_client.LatencyHistogram()
+        self.counters = {"requests": 0, "cache_hits": 0, "coalesced": 0, "upstream_calls": 0,
+                         "busy": 0, "timeouts": 0, "errors": 0, "active": 0}
+
+    def _count(self, counter, n=1):
+        with self._lock:
+            self.counters[counter] += n
+
+    def _cache_params(self, messages):
+        return {"model": self.model, "max_tokens": self.max_tokens,
+                "messages": json.dumps(messages, sort_keys=True, ensure_ascii=False)}
+
+    def stream_chat(self, messages, deadline=None):
+        """Yields ('query', str|None), ('text', delta) and finally ('done', {'text', 'search_query', 'cached'}).
+
+        Raises LLMTimeout, GatewayBusy or LLMError.
+        """
+        deadline = deadline or time.monotonic() + self.timeout
+        self._count("requests")
+        started = time.perf_counter()
+        params = self._cache_params(messages)
+
+        cached = self.cache.peek(self.url, params)
+        if cached is not None:
+            self._count("cache_hits")
+            yield from self._replay(cached)
+            return
+
+        key = self._inflight_key(params)
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+            else:
+                self.counters["coalesced"] += 1
+        if not leader:
+            try:
+                result = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except FutureTimeout:
+                self._count("timeouts")
+                raise LLMTimeout("Timed out waiting for an identical request")
+            yield from self._replay(result)
+            return
+
+        try:
+            if not self._slots.acquire(timeout=self._queue_timeout(deadline)):
+                self._count("busy")
+                raise GatewayBusy("The librarian is busy, please try again in a moment")
+            self._count("active")
+            parser = ReplyParser()
+            try:
+                for delta in self._upstream(messages, deadline):
+                    yield from self._parse(parser, delta, started)
+            finally:
+                self._count("active", -1)
+                self._slots.release()
+            result = self._finish(parser, params, started)
+            future.set_result(result)
+            if not parser.query_done:
+                yield "query", result["search_query"]
+            yield "done", dict(result, cached=False)
+        except BaseException as e:
+            # Including GeneratorExit when the client goes away: release any followers
+            self._fail(future, e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    async def astream_chat(self, messages, deadline=None):
+        """stream_chat() for the ASGI mode: an async generator on the non-blocking client."""
+        deadline = deadline or time.monotonic() + self.timeout
+        self._count("requests")
+        started = time.perf_counter()
+        params = self._cache_params(messages)
+
+        cached = self.cache.peek(self.url, params)
+        if cached is not None:
+            self._count("cache_hits")
+            for event in self._replay(cached):
+                yield event
+            return
+
+        key = self._inflight_key(params)
+        future = self._inflight_async.get(key)
+        if future is not None:
+            self._count("coalesced")
+            try:
+                result = await asyncio.wait_for(asyncio.shield(future), max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                self._count("timeouts")
+                raise LLMTimeout("Timed out waiting for an identical request")
+            for event in self._replay(result):
+                yield event
+            return
+
+        future = self._inflight_async[key] = asyncio.get_running_loop().create_future()
+        try:
+            slots = self._async_slots()
+            try:
+                await asyncio.wait_for(slots.acquire(), self._queue_timeout(deadline))
+            except asyncio.TimeoutError:
+                self._count("busy")
+                raise GatewayBusy("The librarian is busy, please try again in a moment")
+            self._count("active")
+            parser = ReplyParser()
+            try:
+                async for delta in self._aupstream(messages, deadline):
+                    for event in self._parse(parser, delta, started):
+                        yield event
+            finally:
+                self._count("active", -1)
+                slots.release()
+            result = self._finish(parser, params, started)
+            future.set_result(result)
+            if not parser.query_done:
+                yield "query", result["search_query"]
+            yield "done", dict(result, cached=False)
+        except BaseException as e:
+            self._fail(future, e)
+            raise
+        finally:
+            self._inflight_async.pop(key, None)
+
+    # --- SHARED BY THE SYNC AND ASYNC PATHS ---
+
+    def _inflight_key(self, params):
+        return self.url + json.dumps(params, sort_keys=True).lower()
+
+    def _queue_timeout(self, deadline):
+        # Waiting long for a slot only to then time out upstream helps nobody
+        return max(0.0, min(deadline - time.monotonic(), 2.0))
+
+    def _async_slots(self):
+        loop = asyncio.get_running_loop()
+        slots = self._loop_slots.get(loop)
+        if slots is None:
+            slots = self._loop_slots[loop] = asyncio.Semaphore(self.max_concurrent)
+        return slots
+
+    def _parse(self, parser, delta, started):
+        if not parser.buffer:
+            self.first_token.observe((time.perf_counter() - started) * 1000)
+        text, query = parser.feed(delta)
+        if query is not None:
+            yield "query", query
+        if text:
+            yield "text", text
+
+    def _finish(self, parser, params, started):
+        result = parser.result()
+        self.cache.store(self.url, params, result)
+        self.latency.observe((time.perf_counter() - started) * 1000)
+        return result
+
+    def _fail(self, future, error):
+        if not future.done():
+            future.set_exception(error if isinstance(error, LLMError) else LLMError("Upstream call aborted"))
+            future.exception()  # Mark retrieved: there may be no followers waiting on it
+        if isinstance(error, LLMTimeout):
+            self._count("timeouts")
+        elif isinstance(error, LLMError) and not isinstance(error, GatewayBusy):
+            self._count("errors")
+
+    def _replay(self, result):
+        yield "query", result["search_query"]
+        yield "text", result["text"]
+        yield "done", dict(result, cached=True)
+
+    def _request(self, messages):
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "max_tokens": self.max_tokens,
+            "response_format": {"type": "json_object"},
+            "stream": True,
+        }
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        return payload, headers
+
+    @staticmethod
+    def _remaining(deadline):
+        left = deadline - time.monotonic()
+        if left <= 0:
+            raise LLMTimeout("The librarian took too long to answer")
+        return left
+
+    @staticmethod
+    def _sse_delta(line, status):
+        """Content delta of one SSE line: '' to skip, None at [DONE]."""
+        if not line.startswith("data:"):
+            return ""
+        body = line[5:].strip()
+        if body == "[DONE]":
+            return None
+        try:
+            event = json.loads(body)
+        except ValueError:
+            raise LLMError("The model sent a malformed stream event")
+        if not isinstance(event, dict):
+            raise LLMError("The model sent an unexpected stream event")
+        if "error" in event:
+            raise LLMError(error_message(event, status))
+        try:
+            choices = event.get("choices") or [{}]
+            return (choices[0].get("delta") or {}).get("content") or ""
+        except (AttributeError, IndexError, KeyError, TypeError):
+            raise LLMError("The model sent an unexpected stream event")
+
+    @staticmethod
+    def _whole_reply(body, status):
+        """Content of a non-streamed reply body (bytes or str)."""
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            raise LLMError(f"The model sent a non-JSON reply (HTTP {status})")
+        if status != 200 or not isinstance(data, dict) or "error" in data:
+            raise LLMError(error_message(data, status))
+        try:
+            content = data["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError):
+            raise LLMError("The model's reply had no message content")
+        if not isinstance(content, str):
+            raise LLMError("The model's reply had no message content")
+        return content
+
+    def _upstream(self, messages, deadline):
+        """Yields content deltas from the upstream stream (or the whole reply for non-streaming servers)."""
+        payload, headers = self._request(messages)
+        self._count("upstream_calls")
+        try:
+            response = http_client.post(self.url, headers=headers, json=payload, stream=True,
+                                        timeout=(min(CONNECT_TIMEOUT, self._remaining(deadline)),
+                                                 self._remaining(deadline)))
+        except requests.Timeout:
+            raise LLMTimeout("The librarian took too long to answer")
+        except requests.RequestException as e:
+            raise LLMError(f"Could not reach the model: {e}")
+
+        with response:
+            if "text/event-stream" not in response.headers.get("Content-Type", ""):
+                yield self._whole_reply(response.content, response.status_code)
+                return
+            try:
+                for line in response.iter_lines():
+                    self._remaining(deadline)
+                    delta = self._sse_delta(line.decode("utf-8", "replace"), response.status_code)
+                    if delta is None:
+                        return
+                    if delta:
+                        yield delta
+            except requests.RequestException as e:
+                # urllib3 reports a read timeout mid-stream as a connection error
+                if time.monotonic() >= deadline or "timed out" in str(e).lower():
+                    raise LLMTimeout("The librarian took too long to answer")
+                raise LLMError(f"Model stream broke: {e}")
+
+    async def _aupstream(self, messages, deadline):
+        payload, headers = self._request(messages)
+        self._count("upstream_calls")
+        try:
+            async with http_client.async_client.stream(
+                    "POST", self.url, headers=headers, json=payload,
+                    timeout=(min(CONNECT_TIMEOUT, self._remaining(deadline)), self._remaining(deadline))) as response:
+                if "text/event-stream" not in response.headers.get("Content-Type", ""):
+                    body = await response.aread()
+                    yield self._whole_reply(body, response.status_code)
+                    return
+                async for line in response.aiter_lines():
+                    self._remaining(deadline)
+                    delta = self._sse_delta(line, response.status_code)
+                    if delta is None:
+                        return
+                    if delta:
+                        yield delta
+        except httpx.TimeoutException:
+            raise LLMTimeout("The librarian took too long to answer")
+        except httpx.HTTPError as e:  # Transport and decoding errors
+            raise LLMError(f"Could not reach the model: {e}")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats.update({
+            "max_concurrent": self.max_concurrent,
+            "cache": self.cache.stats(),
+            "first_token": self.first_token.snapshot(),
+            "latency": self.latency.snapshot(),
+        })
+        return stats
+
+
+def error_message(data, status):
+    error = data.get("error") if isinstance(data, dict) else None
+    if isinstance(error, dict):
+        return error.get("message", str(error))
+    return str(error or f"HTTP {status}")
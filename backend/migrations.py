@@ -0,0 +1,531 @@
+"""
+Versioned schema migrations for ebook_market.db.
+
+Each migration runs once, in order, inside its own short BEGIN IMMEDIATE
+transaction and is recorded in `schema_version`. Because the database runs in
+WAL mode, readers keep reading the last committed snapshot while a migration
+(e.g. an index build) holds the write lock, so this is safe on a live DB.
+
+    python migrations.py               # apply pending migrations
+    python migrations.py --check-plans # fail if a hot query falls back to a table scan
+"""
+import sqlite3
+import sys
+
+MIGRATIONS = []
+
+
+def migration(version, name):
+    """Registers a migration function `fn(conn)`. Versions must be unique and increasing."""
+    def register(fn):
+        MIGRATIONS.append((version, name, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+
+def column_exists(conn, table, column):
+    return any(row[1] == column for row in conn.execute(f"PRAGMA table_info({table})"))
+
+
+@migration(1, "baseline phase 6 schema")
+def create_baseline_tables(conn):
+    # Users Table
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Books Table (Real Content from Internet Archive)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS books (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ia_id TEXT UNIQUE,          -- Internet Archive ID (e.g. 'prideandprejudic00aust')
+            title TEXT NOT NULL,
+            author TEXT NOT NULL,
+            cover_url TEXT,             -- Full URL to OpenLibrary Cover
+            category TEXT,
+            description TEXT,
+            price INTEGER DEFAULT 0,    -- Pre-calculated Price in INR
+            rating REAL DEFAULT 4.5,
+            year INTEGER
+        )
+    ''')
+
+    # Purchases Table
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS purchases (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            book_id INTEGER,
+            purchase_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            progress INTEGER DEFAULT 0,
+            last_read_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (book_id) REFERENCES books (id),
+            UNIQUE(user_id, book_id)
+        )
+    ''')
+
+    # User Profiles (Gamification & Avatar)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_profiles (
+            user_id INTEGER PRIMARY KEY,
+            bio TEXT,
+            avatar_url TEXT,
+            fav_genres TEXT, -- JSON string
+            streak_days INTEGER DEFAULT 0,
+            last_login TIMESTAMP,
+            badges TEXT, -- JSON string
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+
+    # Interactions (Likes/Dislikes for AI Training)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS interactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            book_id TEXT, -- Can be local ID or global 'ext_' ID
+            interaction_type TEXT, -- 'like', 'dislike', 'onboard_interest'
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Comments & Ratings (Community)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS comments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            book_id TEXT, -- Can be local ID or global 'ext_' ID
+            text TEXT,
+            rating INTEGER, -- 1-5 Star
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+@migration(2, "purchases.last_read_at")
+def add_last_read_at(conn):
+    # Databases created before 'Continue Reading' lack this column
+    if not column_exists(conn, "purchases", "last_read_at"):
+        conn.execute("ALTER TABLE purchases ADD COLUMN last_read_at TIMESTAMP")
+
+
+@migration(3, "indexes for hot read paths")
+def add_hot_path_indexes(conn):
+    # comments(): WHERE book_id = ? ORDER BY created_at DESC
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_comments_book_created ON comments (book_id, created_at)")
+    # interact(): WHERE user_id = ? AND book_id = ? AND interaction_type = ?
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_interactions_user_book_type ON interactions (user_id, book_id, interaction_type)")
+    # get_library(): covering, already in ORDER BY order so no temp b-tree sort
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_purchases_user_last_read
+        ON purchases (user_id, last_read_at DESC, purchase_date DESC, book_id, progress)
+    ''')
+    # get_user_interests(): most recent purchases first
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_purchases_user_date ON purchases (user_id, purchase_date DESC, book_id)")
+    # books.ia_id lookups already use the implicit UNIQUE index (sqlite_autoindex_books_1)
+
+
+def fts5_available(conn):
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x)")
+        conn.execute("DROP TABLE temp.fts5_probe")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+@migration(4, "books_fts full-text index")
+def add_books_fts(conn):
+    if not fts5_available(conn):
+        # search.py falls back to LIKE queries when the index is missing
+        print("⚠️ SQLite was built without FTS5; local search will use LIKE scans.")
+        return
+    # External-content table: the text lives only in `books`, the index holds tokens
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+            title, author, category, description,
+            content='books', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+    ''')
+    # Keep the index in sync with every write to books
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books BEGIN
+            INSERT INTO books_fts (rowid, title, author, category, description)
+            VALUES (new.id, new.title, new.author, new.category, new.description);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books BEGIN
+            INSERT INTO books_fts (books_fts, rowid, title, author, category, description)
+            VALUES ('delete', old.id, old.title, old.author, old.category, old.description);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_fts_au AFTER UPDATE OF title, author, category, description ON books BEGIN
+            INSERT INTO books_fts (books_fts, rowid, title, author, category, description)
+            VALUES ('delete', old.id, old.title, old.author, old.category, old.description);
+            INSERT INTO books_fts (rowid, title, author, category, description)
+            VALUES (new.id, new.title, new.author, new.category, new.description);
+        END
+    ''')
+    conn.execute("INSERT INTO books_fts (books_fts) VALUES ('rebuild')")  # Index existing rows
+
+
+@migration(5, "catalog version counter and books filter indexes")
+def add_catalog_version(conn):
+    # A counter bumped by every write to books; /api/books derives its ETags from it
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    ''')
+    conn.execute("INSERT OR IGNORE INTO catalog_meta (key, value) VALUES ('books_version', 1)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS books_version_{event.lower()} AFTER {event} ON books BEGIN
+                UPDATE catalog_meta SET value = value + 1 WHERE key = 'books_version';
+            END
+        ''')
+    # Keyset pages within a filter: WHERE category = ? AND id > ? ORDER BY id
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_books_category_id ON books (category, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_books_year_id ON books (year, id)")
+
+
+@migration(6, "ingestion checkpoints")
+def add_ingest_checkpoints(conn):
+    # One row per seeding run; 'running' rows are resumed by the next seed_database()
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ingest_runs (
+            run_key TEXT PRIMARY KEY,
+            status TEXT NOT NULL,           -- 'running' or 'done'
+            config TEXT,                    -- JSON of subjects/pages for the report
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    # Committed in the same transaction as the page's books, so a page is either fully in or redone
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ingest_checkpoints (
+            run_key TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            page INTEGER NOT NULL,
+            books_found INTEGER DEFAULT 0,
+            finished_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (run_key, subject, page)
+        )
+    ''')
+
+
+@migration(7, "background jobs")
+def add_jobs(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT,                   -- JSON arguments
+            status TEXT NOT NULL DEFAULT 'queued', -- queued, running, done, failed, cancelled
+            progress TEXT,                  -- JSON, updated by the running job
+            result TEXT,                    -- JSON
+            error TEXT,
+            dedupe_key TEXT,
+            cancel_requested INTEGER DEFAULT 0,
+            worker TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            heartbeat_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id)")
+    # At most one queued/running job per dedupe key, even with several gunicorn workers
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active_dedupe ON jobs (dedupe_key)
+        WHERE status IN ('queued', 'running')
+    ''')
+
+
+
+@migration(8, "books content columns")
+def add_book_content_columns(conn):
+    # ingest_gutenberg.py has always written these; the baseline schema never had them
+    if not column_exists(conn, "books", "gutenberg_id"):
+        conn.execute("ALTER TABLE books ADD COLUMN gutenberg_id INTEGER")
+    if not column_exists(conn, "books", "content_path"):
+        conn.execute("ALTER TABLE books ADD COLUMN content_path TEXT")  # content_store file, relative to backend/
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_books_gutenberg_id ON books (gutenberg_id)")
+
+
+@migration(9, "gutenberg download manifest")
+def add_gutenberg_manifest(conn):
+    # Validators for conditional re-downloads, plus the checksum of what we stored
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS gutenberg_manifest (
+            gutenberg_id INTEGER PRIMARY KEY,
+            url TEXT NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            digest TEXT NOT NULL,           -- blake2b-128 of the stripped text
+            bytes INTEGER NOT NULL,
+            content_path TEXT NOT NULL,
+            fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+# Bucket for a comment's star rating in book_stats (0 = unrated)
+RATING_BUCKET = "MIN(MAX(CAST(ROUND(COALESCE({r}, 0)) AS INTEGER), 0), 5)"
+
+
+def _book_stats_delta(ref, sign):
+    """Trigger body that adds (sign=+1) or removes (-1) comment `ref` (NEW/OLD) from book_stats."""
+    bucket = RATING_BUCKET.format(r=f"{ref}.rating")
+    histogram = ", ".join(f"r{n} = r{n} + {sign} * ({bucket} = {n})" for n in range(1, 6))
+    return f'''
+            INSERT OR IGNORE INTO book_stats (book_id) VALUES ({ref}.book_id);
+            UPDATE book_stats SET
+                review_count = review_count + {sign},
+                rating_count = rating_count + {sign} * ({bucket} > 0),
+                rating_sum = rating_sum + {sign} * {bucket},
+                {histogram}
+            WHERE book_id = {ref}.book_id;
+    '''
+
+
+@migration(10, "book_stats rating aggregates")
+def add_book_stats(conn):
+    # Maintained by triggers so the book detail view never aggregates over comments
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS book_stats (
+            book_id TEXT PRIMARY KEY,       -- Same affinity as comments.book_id
+            review_count INTEGER NOT NULL DEFAULT 0,
+            rating_count INTEGER NOT NULL DEFAULT 0,  -- Comments with a 1-5 star rating
+            rating_sum INTEGER NOT NULL DEFAULT 0,
+            r1 INTEGER NOT NULL DEFAULT 0,
+            r2 INTEGER NOT NULL DEFAULT 0,
+            r3 INTEGER NOT NULL DEFAULT 0,
+            r4 INTEGER NOT NULL DEFAULT 0,
+            r5 INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS book_stats_ai AFTER INSERT ON comments BEGIN {_book_stats_delta('NEW', 1)} END")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS book_stats_ad AFTER DELETE ON comments BEGIN {_book_stats_delta('OLD', -1)} END")
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS book_stats_au AFTER UPDATE OF book_id, rating ON comments BEGIN
+            {_book_stats_delta('OLD', -1)}
+            {_book_stats_delta('NEW', 1)}
+        END
+    ''')
+
+    bucket = RATING_BUCKET.format(r="rating")
+    histogram = ", ".join(f"SUM({bucket} = {n})" for n in range(1, 6))
+    conn.execute("DELETE FROM book_stats")
+    conn.execute(f'''
+        INSERT INTO book_stats (book_id, review_count, rating_count, rating_sum, r1, r2, r3, r4, r5)
+        SELECT book_id, COUNT(*), SUM({bucket} > 0), SUM({bucket}), {histogram}
+        FROM comments GROUP BY book_id
+    ''')
+
+
+@migration(11, "openlibrary feed mirror")
+def add_ol_mirror(conn):
+    # Pre-fetched OpenLibrary docs per feed genre, refreshed by the refresh_feed_mirror job.
+    # Slots are dense (0..size-1) so a random row is one range read on the primary key.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ol_mirror (
+            genre TEXT NOT NULL,
+            slot INTEGER NOT NULL,
+            ia_id TEXT NOT NULL,
+            doc TEXT NOT NULL,              -- JSON, already in feed row shape
+            PRIMARY KEY (genre, slot)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ol_mirror_genres (
+            genre TEXT PRIMARY KEY,
+            size INTEGER NOT NULL DEFAULT 0,
+            refreshed_at REAL,              -- Unix time of the last successful refresh
+            last_error TEXT
+        )
+    ''')
+
+
+# Writes that change what a user's recommended row should contain
+USER_FEED_SIGNALS = (
+    ("purchases", "INSERT"), ("purchases", "DELETE"),
+    ("interactions", "INSERT"), ("interactions", "UPDATE"), ("interactions", "DELETE"),
+    ("user_profiles", "INSERT"), ("user_profiles", "UPDATE OF fav_genres"),
+)
+
+
+@migration(12, "per-user feed materialization")
+def add_user_feeds(conn):
+    # One precomputed recommended row per user. Triggers bump `epoch` whenever the
+    # user's signals change; the row is stale while built_epoch lags behind it.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_feeds (
+            user_id INTEGER PRIMARY KEY,
+            epoch INTEGER NOT NULL DEFAULT 0,
+            built_epoch INTEGER,
+            label TEXT,
+            books TEXT,                     -- JSON list, feed row shape
+            built_at REAL,                  -- Unix time
+            build_ms REAL
+        )
+    ''')
+    for table, event in USER_FEED_SIGNALS:
+        ref = "OLD" if event == "DELETE" else "NEW"
+        name = f"user_feeds_{table}_{event.split()[0].lower()}"
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table} BEGIN
+                UPDATE user_feeds SET epoch = epoch + 1 WHERE user_id = {ref}.user_id;
+            END
+        ''')
+
+
+@migration(13, "interactions active flag and uniqueness")
+def add_interaction_uniqueness(conn):
+    # One row per (user, book, type); a toggle flips `active` in a single upsert instead of SELECT + DELETE/INSERT
+    if not column_exists(conn, "interactions", "active"):
+        conn.execute("ALTER TABLE interactions ADD COLUMN active INTEGER NOT NULL DEFAULT 1")
+    # Toggling off used to delete the row, so duplicates are repeated inserts (e.g. onboarding twice): keep the first
+    conn.execute('''
+        DELETE FROM interactions WHERE id NOT IN (
+            SELECT MIN(id) FROM interactions GROUP BY user_id, book_id, interaction_type
+        )
+    ''')
+    conn.execute("DROP INDEX IF EXISTS idx_interactions_user_book_type")
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_interactions_user_book_type_unique
+        ON interactions (user_id, book_id, interaction_type)
+    ''')
+
+
+def current_version(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def migrate(conn):
+    """Applies all pending migrations. Returns the list of versions applied."""
+    applied = []
+    if conn.in_transaction:
+        conn.commit()
+    version = current_version(conn)
+
+    for target, name, fn in MIGRATIONS:
+        if target <= version:
+            continue
+        # Take the write lock up front, then re-check: another worker may have
+        # applied this migration while we were waiting.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            done = conn.execute("SELECT 1 FROM schema_version WHERE version = ?", (target,)).fetchone()
+            if not done:
+                print(f"🔧 Migrating DB to v{target}: {name}...")
+                fn(conn)
+                conn.execute("INSERT INTO schema_version (version, name) VALUES (?, ?)", (target, name))
+                applied.append(target)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        version = target
+
+    if applied:
+        conn.execute("PRAGMA optimize")  # Refresh planner stats for the new indexes
+    return applied
+
+
+# --- QUERY PLAN REGRESSION CHECK ---
+# The request-path queries that must always be served from an index.
+# Keep these in sync with the SQL in app.py.
+HOT_QUERIES = {
+    "comments page by book": ('''
+        SELECT c.*, u.name as user_name, u.email
+        FROM comments c
+        JOIN users u ON c.user_id = u.id
+        WHERE c.book_id = ? AND (c.created_at, c.id) < (?, ?)
+        ORDER BY c.created_at DESC, c.id DESC
+        LIMIT ?
+    ''', (1, '9999-12-31', 0, 20)),
+    "book stats": ("SELECT * FROM book_stats WHERE book_id = ?", (1,)),
+    "user feed": ("SELECT * FROM user_feeds WHERE user_id = ?", (1,)),
+    "feed mirror sample": (
+        "SELECT doc FROM ol_mirror WHERE genre = ? AND slot >= ? ORDER BY slot LIMIT ?", ('thriller', 0, 15)),
+    "interaction state": (
+        'SELECT active FROM interactions WHERE user_id = ? AND book_id = ? AND interaction_type = ?',
+        (1, 1, 'like')),
+    "library by last read": ('''
+        SELECT b.*, p.purchase_date, p.progress, p.last_read_at, p.user_id
+        FROM books b
+        JOIN purchases p ON b.id = p.book_id
+        WHERE p.user_id = ?
+        ORDER BY p.last_read_at DESC, p.purchase_date DESC
+    ''', (1,)),
+    "recent purchases for interests": ('''
+        SELECT b.author, b.category, b.title
+        FROM purchases p
+        JOIN books b ON p.book_id = b.id
+        WHERE p.user_id = ?
+        ORDER BY p.purchase_date DESC LIMIT 5
+    ''', (1,)),
+    "book by ia_id": ("SELECT id FROM books WHERE ia_id = ?", ('x',)),
+    "catalog page by category": (
+        "SELECT id, title FROM books WHERE category = ? AND id > ? ORDER BY id LIMIT ?", ('Horror', 0, 50)),
+    "catalog page by year": (
+        "SELECT id, title FROM books WHERE year = ? AND id > ? ORDER BY id LIMIT ?", (2000, 0, 50)),
+}
+
+
+def plan_problems(plan_details):
+    """Returns the plan steps that indicate a full scan or an unindexed sort."""
+    return [d for d in plan_details if d.startswith("SCAN ") or "TEMP B-TREE" in d]
+
+
+def check_query_plans(conn):
+    """EXPLAIN QUERY PLAN every hot query. Returns {query_name: [offending steps]}."""
+    failures = {}
+    for name, (sql, params) in HOT_QUERIES.items():
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+        problems = plan_problems(plan)
+        if problems:
+            failures[name] = problems
+    return failures
+
+
+if __name__ == "__main__":
+    from database import get_db_connection
+
+    conn = get_db_connection()
+    versions = migrate(conn)
+    print(f"Applied migrations: {versions or 'none (up to date)'}")
+
+    if "--check-plans" in sys.argv:
+        failures = check_query_plans(conn)
+        conn.close()
+        for name, problems in failures.items():
+            print(f"❌ {name}: {'; '.join(problems)}")
+        if failures:
+            sys.exit(1)
+        print(f"✅ All {len(HOT_QUERIES)} hot queries use indexes.")
+    else:
+        conn.close()
@@ -0,0 +1,93 @@
+"""OpenLibrary search client shared by the feed, external search and chatbot."""
+import os
+import http_client
+from cache import ResponseCache, MemoryBackend, SQLiteBackend
+from database import BASE_DIR
+
+SEARCH_URL = os.environ.get("PAPERO_OPENLIBRARY_URL", "https://openlibrary.org/search.json")
+
+# Only the fields our transforms read; keeps upstream payloads and cache entries small
+SEARCH_FIELDS = "key,title,author_name,cover_i,ia,language,first_publish_year,edition_key,ratings_average"
+
+CACHE_BACKEND = os.environ.get("PAPERO_SEARCH_CACHE", "memory")  # 'memory' or 'sqlite'
+CACHE_PATH = os.environ.get("PAPERO_SEARCH_CACHE_PATH", os.path.join(os.path.dirname(BASE_DIR), "search_cache.db"))
+
+
+def make_search_cache():
+    if CACHE_BACKEND == "sqlite":
+        backend = SQLiteBackend(CACHE_PATH, max_entries=5000)
+    else:
+        backend = MemoryBackend(max_entries=1000)
+    # Catalog results change slowly: fresh for 10 min, then served stale for up to 6h while refreshing
+    return ResponseCache(backend, ttl=600, stale_ttl=6 * 3600, name="openlibrary_search")
+
+
+search_cache = make_search_cache()
+
+
+def edition_params(query, limit=20, offset=0):
+    """Search params for English editions with a readable scan (feed rows and the catalog mirror)."""
+    return {
+        'q': query,
+        'language': 'eng',
+        'type': 'edition',
+        'limit': limit,
+        'offset': offset,
+        'has_fulltext': 'true'
+    }
+
+
+def edition_books(res, query):
+    """Feed-shaped book dicts for the docs in a search response that have a scan, a cover and English text."""
+    results = []
+    for doc in res.get('docs', []):
+        if 'ia' in doc and 'cover_i' in doc:
+            # Strict Language Check
+            if 'eng' not in doc.get('language', []):
+                continue
+
+            # Deterministic Price
+            price_seed = sum(ord(char) for char in doc['title'])
+            price = (price_seed % 500) + 99
+
+            results.append({
+                'id': f"ext_{doc.get('ia')[0]}",
+                'ia_id': doc.get('ia')[0],
+                'title': doc.get('title'),
+                'author': doc.get('author_name', ['Unknown'])[0],
+                'cover_url': f"https://covers.openlibrary.org/b/id/{doc.get('cover_i')}-L.jpg",
+                'price': price,
+                'year': doc.get('first_publish_year', 2000),
+                'category': query.replace('subject:', '').capitalize(), # Use query as category label
+                'description': "Imported from Global Library"
+            })
+    return results
+
+
+def peek(params):
+    """The cached response for these params, or None. Never calls upstream."""
+    return search_cache.peek(SEARCH_URL, dict(params, fields=SEARCH_FIELDS))
+
+
+def search(params):
+    """Cached GET /search.json. Returns the decoded JSON response."""
+    params = dict(params, fields=SEARCH_FIELDS)
+
+    def fetch():
+        response = http_client.get(SEARCH_URL, params=params)
+        response.raise_for_status()  # Never cache an error body; the cache serves its stale copy instead
+        return response.json()
+
+    return search_cache.get_or_fetch(SEARCH_URL, params, fetch)
+
+
+async def search_async(params):
+    """search() for the ASGI mode: same cache, fetched with the non-blocking client."""
+    params = dict(params, fields=SEARCH_FIELDS)
+
+    async def fetch():
+        response = await http_client.async_client.get(SEARCH_URL, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    return await search_cache.get_or_fetch_async(SEARCH_URL, params, fetch)
@@ -0,0 +1,232 @@
+"""
+Password hashing off the request thread, and login attempt rate limiting.
+
+werkzeug's scrypt/pbkdf2 hashes are deliberately expensive (~150 ms of CPU
+each), so they run on a small dedicated process pool instead of the request
+thread: request threads only wait on the result, and the pool size caps how
+much CPU a burst of logins can take from every other endpoint. At most
+MAX_PENDING hashes may be queued or running; callers past that fail fast with
+HashingBusy (503) instead of piling up.
+
+METHOD is werkzeug's method string, e.g. "scrypt:32768:8:1" (n, r, p) or
+"pbkdf2:sha256:600000". Changing it is transparent: stored hashes made with
+other parameters still verify, and are rehashed in the background on the
+user's next successful login.
+
+Attempts are charged to per-account and per-IP token buckets before any
+hashing, so brute-force floods get 429 without costing CPU. Buckets live in
+this worker process, like the in-memory response cache.
+
+start() launches the pool from a forkserver (spawn where there is none), so
+workers never inherit a server process's threads or held locks, even when the
+pool is rebuilt after a worker dies. Each server process gets its own pool:
+under gunicorn --preload, a worker doesn't reuse the one created in the master.
+Workers only run the werkzeug functions below.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from database import get_db_connection
+
+METHOD = os.environ.get("PAPERO_PASSWORD_METHOD", "scrypt:32768:8:1")
+WORKERS = int(os.environ.get("PAPERO_HASH_WORKERS", 1))           # Hashing processes per server process
+MAX_PENDING = int(os.environ.get("PAPERO_HASH_MAX_PENDING", 16))   # Queued + running hashes
+TIMEOUT = float(os.environ.get("PAPERO_HASH_TIMEOUT", 10))         # Seconds a request waits for its hash
+
+# Token buckets: BURST attempts at once, refilled at PER_MINUTE
+ACCOUNT_BURST = int(os.environ.get("PAPERO_LOGIN_ACCOUNT_BURST", 5))
+ACCOUNT_PER_MINUTE = float(os.environ.get("PAPERO_LOGIN_ACCOUNT_PER_MIN", 5))
+IP_BURST = int(os.environ.get("PAPERO_LOGIN_IP_BURST", 20))
+IP_PER_MINUTE = float(os.environ.get("PAPERO_LOGIN_IP_PER_MIN", 30))
+MAX_BUCKETS = 50000  # Least recently used buckets are dropped past this
+
+_pool = None
+_pool_pid = None  # Process that started _pool; a forked child must not submit to its parent's pool
+_pool_lock = threading.Lock()
+_pending = threading.BoundedSemaphore(MAX_PENDING)
+_lock = threading.Lock()
+metrics = {
+    "hashes": 0, "verifies": 0, "rehashes": 0, "busy": 0, "timeouts": 0,
+    "hash_ms_total": 0.0, "limited_account": 0, "limited_ip": 0,
+}
+
+
+class HashingBusy(Exception):
+    pass
+
+
+def _count(**increments):
+    with _lock:
+        for key, value in increments.items():
+            metrics[key] += value
+
+
+def _mp_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def start():
+    """Starts this process's hashing workers. Safe to call more than once, and after a fork."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(max_workers=WORKERS, mp_context=_mp_context())
+            _pool_pid = os.getpid()
+            # Pay the worker start-up now rather than on the first login
+            _pool.submit(int).result()
+        return _pool
+
+
+def _release(_future):
+    _pending.release()
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        _pool = None
+
+
+def _run(fn, *args):
+    if not _pending.acquire(blocking=False):
+        _count(busy=1)
+        raise HashingBusy("Too many password operations in progress")
+    start_time = time.perf_counter()
+    try:
+        future = start().submit(fn, *args)
+    except BrokenProcessPool:  # A worker died (e.g. OOM-killed); the next call gets a new pool
+        _reset_pool()
+        _pending.release()
+        raise HashingBusy("Password hashing pool restarting")
+    # The slot is held until the worker finishes, even if this caller stops waiting
+    future.add_done_callback(_release)
+    try:
+        return future.result(timeout=TIMEOUT)
+    except FutureTimeout:
+        _count(timeouts=1)
+        raise HashingBusy("Password hashing timed out")
+    except BrokenProcessPool:
+        _reset_pool()
+        raise HashingBusy("Password hashing pool restarting")
+    finally:
+        _count(hash_ms_total=(time.perf_counter() - start_time) * 1000)
+
+
+def hash_password(password):
+    _count(hashes=1)
+    return _run(generate_password_hash, password, METHOD)
+
+
+def verify(pwhash, password):
+    if not pwhash or "$" not in pwhash:
+        return False  # Placeholder hashes (seed users) never match; don't spend a worker on them
+    _count(verifies=1)
+    return _run(check_password_hash, pwhash, password)
+
+
+def needs_rehash(pwhash):
+    """True if `pwhash` was made with other parameters than METHOD."""
+    return pwhash.split("$", 1)[0] != METHOD
+
+
+def rehash_later(user_id, old_hash, password):
+    """Re-hashes with METHOD on a background thread; the login response doesn't wait for it."""
+    def run():
+        try:
+            new_hash = hash_password(password)
+        except HashingBusy:
+            return  # Next login tries again
+        conn = get_db_connection()
+        try:
+            # Only if the password wasn't changed meanwhile
+            cur = conn.execute("UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?",
+                               (new_hash, user_id, old_hash))
+            conn.commit()
+        finally:
+            conn.close()
+        if cur.rowcount:
+            _count(rehashes=1)
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+class TokenBuckets:
+    """Per-key token buckets: `burst` tokens, refilled at `per_minute`."""
+
+    def __init__(self, burst, per_minute, max_keys=MAX_BUCKETS):
+        self.burst = burst
+        self.rate = per_minute / 60.0
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def _level(self, key, now):
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def take(self, key, now=None):
+        """Spends a token. Returns 0, or the seconds until one is available."""
+        now = now or time.monotonic()
+        with self._lock:
+            tokens = self._level(key, now)
+            if tokens < 1:
+                return (1 - tokens) / self.rate if self.rate else 60.0
+            self._buckets[key] = (tokens - 1, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return 0
+
+    def reset(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+accounts = TokenBuckets(ACCOUNT_BURST, ACCOUNT_PER_MINUTE)
+ips = TokenBuckets(IP_BURST, IP_PER_MINUTE)
+
+
+def check_rate(email=None, ip=None):
+    """Charges one attempt to the IP and account buckets. Returns 0, or the Retry-After seconds."""
+    if ip:
+        wait = ips.take(ip)
+        if wait:
+            _count(limited_ip=1)
+            return wait
+    if email:
+        wait = accounts.take(email.strip().lower())
+        if wait:
+            _count(limited_account=1)
+            return wait
+    return 0
+
+
+def login_succeeded(email):
+    """A correct password refills the account's bucket (the IP's keeps counting)."""
+    accounts.reset(email.strip().lower())
+
+
+def stats():
+    with _lock:
+        m = dict(metrics)
+    calls = m["hashes"] + m["verifies"]
+    return {
+        "method": METHOD, "workers": WORKERS, "max_pending": MAX_PENDING,
+        "in_flight": MAX_PENDING - _pending._value,
+        "hashes": m["hashes"], "verifies": m["verifies"], "rehashes": m["rehashes"],
+        "busy": m["busy"], "timeouts": m["timeouts"],
+        "avg_ms": round(m["hash_ms_total"] / calls, 1) if calls else 0.0,
+        "limited": {"account": m["limited_account"], "ip": m["limited_ip"]},
+        "buckets": {"account": len(accounts), "ip": len(ips)},
+    }
@@ -0,0 +1,382 @@
+"""
+Write-coalescing buffer for reading progress and last_read_at.
+
+Reader clients report progress many times a minute. Instead of one UPDATE +
+COMMIT per report (each taking SQLite's single writer lock), updates are kept
+in memory per (user_id, book_id), latest value wins, and a background thread
+writes them in one transaction every FLUSH_INTERVAL_MS or FLUSH_MAX_UPDATES.
+
+Every update is also appended to a per-process log before it is acknowledged;
+the log is dropped once its batch commits. Logs left behind by a process that
+died are replayed by the next one to start, so a crash loses nothing that was
+acknowledged (short of an OS crash before the page cache is written back).
+
+Log names carry a random per-process token, not just the PID (PIDs repeat
+after a container restart). Each process holds a POSIX lock on
+owner-{token}.lock for its lifetime; the kernel drops it when the process
+dies, which is how orphaned logs are recognised.
+
+Set PAPERO_PROGRESS_BUFFER=0 to write through synchronously.
+"""
+import atexit
+import fcntl
+import glob
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+import database
+
+ENABLED = os.environ.get("PAPERO_PROGRESS_BUFFER", "1") != "0"
+FLUSH_INTERVAL_MS = int(os.environ.get("PAPERO_PROGRESS_FLUSH_MS", 250))
+FLUSH_MAX_UPDATES = int(os.environ.get("PAPERO_PROGRESS_FLUSH_MAX", 500))
+LOG_DIR = os.environ.get("PAPERO_PROGRESS_LOG_DIR")  # Default: progress_log/ next to the database
+
+UPDATE_SQL = '''
+    UPDATE purchases
+    SET progress = COALESCE(?, progress),
+        last_read_at = COALESCE(?, last_read_at)
+    WHERE user_id = ? AND book_id = ?
+'''
+
+
+def sql_timestamp(ts):
+    """Same format as SQLite's CURRENT_TIMESTAMP (UTC)."""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(ts))
+
+
+def log_dir():
+    return LOG_DIR or os.path.join(os.path.dirname(os.path.abspath(database.DB_NAME)), "progress_log")
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _owner_path(directory, token):
+    return os.path.join(directory, f"owner-{token}.lock")
+
+
+_own_tokens = set()  # A process can always re-take its own lockf() lock, so probing can't see these
+
+
+def _hold_owner_lock(directory, token):
+    """Locks owner-{token}.lock until this process exits. Returns the fd (keep it open)."""
+    fd = os.open(_owner_path(directory, token), os.O_RDWR | os.O_CREAT, 0o644)
+    fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    _own_tokens.add(token)
+    return fd
+
+
+def _owner_alive(directory, token):
+    """True while the process that took `token` is running (it holds the owner lock).
+
+    lockf() locks belong to a process and are not inherited by forked children,
+    so a helper process outliving its parent does not keep a log "alive".
+    """
+    if token in _own_tokens:
+        return True
+    try:
+        fd = os.open(_owner_path(directory, token), os.O_RDWR | os.O_CREAT, 0o644)
+    except OSError:
+        return True  # Can't tell; leave the logs for a later start
+    try:
+        fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return True
+    finally:
+        os.close(fd)  # Also releases the probe lock
+    return False
+
+
+def _parse_log_name(path):
+    """(pid, token) from progress-{pid}-{token}-{seq}.log; token is None for pre-token names."""
+    parts = os.path.basename(path)[:-len(".log")].split("-")
+    if len(parts) == 4 and parts[0] == "progress":
+        return int(parts[1]), parts[2]
+    if len(parts) == 3 and parts[0] == "progress":
+        return int(parts[1]), None
+    raise ValueError(path)
+
+
+def _merge(pending, key, progress, read_at, queued_at):
+    entry = pending.get(key)
+    if entry is None:
+        pending[key] = [progress, read_at, queued_at]
+        return False
+    # Latest value wins; a touch without progress keeps the buffered progress and vice versa
+    if progress is not None:
+        entry[0] = progress
+    if read_at is not None:
+        entry[1] = read_at
+    return True
+
+
+def write_batch(conn, pending):
+    """Applies {(user_id, book_id): [progress, read_at, queued_at]} in one transaction."""
+    conn.executemany(UPDATE_SQL, [
+        (progress, sql_timestamp(read_at) if read_at is not None else None, user_id, book_id)
+        for (user_id, book_id), (progress, read_at, _) in pending.items()
+    ])
+    conn.commit()
+
+
+class ProgressBuffer:
+    def __init__(self, directory=None, interval_ms=FLUSH_INTERVAL_MS, max_updates=FLUSH_MAX_UPDATES):
+        self.pid = os.getpid()
+        self.token = secrets.token_hex(8)  # Unique per process, unlike the PID across restarts
+        self.directory = directory or log_dir()
+        self.interval = interval_ms / 1000
+        self.max_updates = max_updates
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # One flush at a time (thread + explicit callers)
+        self._wake = threading.Event()
+        self._stopped = False
+        self._seq = 0
+        self._sealed_logs = []  # Logs whose updates are in a batch not yet committed
+        self.metrics = {
+            "updates": 0, "coalesced": 0, "flushes": 0, "rows_written": 0, "errors": 0, "replayed": 0,
+            "last_batch_size": 0, "max_batch_size": 0,
+            "last_flush_lag_ms": 0.0, "max_flush_lag_ms": 0.0, "last_flush_ms": 0.0,
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        self._owner_fd = _hold_owner_lock(self.directory, self.token)  # Before any log exists
+        self._log_fd = self._open_log()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="progress-flush")
+        self._thread.start()
+
+    # --- APPEND LOG ---
+
+    def _log_path(self, seq):
+        return os.path.join(self.directory, f"progress-{self.pid}-{self.token}-{seq}.log")
+
+    def _open_log(self):
+        self._seq += 1
+        return os.open(self._log_path(self._seq), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def _seal_log(self):
+        """Starts a new log; the old one is deleted once its batch commits. Caller holds _lock."""
+        os.close(self._log_fd)
+        self._sealed_logs.append(self._log_path(self._seq))
+        self._log_fd = self._open_log()
+
+    # --- PUBLIC API ---
+
+    def record(self, user_id, book_id, progress=None, touch=False):
+        """Buffers an update. `touch` sets last_read_at to now."""
+        now = time.time()
+        read_at = now if touch else None
+        line = json.dumps([user_id, book_id, progress, read_at], separators=(",", ":")) + "\n"
+        with self._lock:
+            os.write(self._log_fd, line.encode())  # O_APPEND: one atomic write per update
+            if _merge(self._pending, (user_id, book_id), progress, read_at, now):
+                self.metrics["coalesced"] += 1
+            self.metrics["updates"] += 1
+            full = len(self._pending) >= self.max_updates
+        if full:
+            self._wake.set()
+
+    def has_pending(self, user_id):
+        with self._lock:
+            return any(key[0] == user_id for key in self._pending)
+
+    def flush(self):
+        """Writes everything buffered so far. Returns the batch size."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                batch, self._pending = self._pending, {}
+                self._seal_log()
+            started = time.time()
+            lag_ms = (started - min(entry[2] for entry in batch.values())) * 1000
+            conn = database.get_own_connection()  # Never the request's: we commit or roll back here
+            try:
+                write_batch(conn, batch)
+            except sqlite3.Error as e:
+                conn.rollback()
+                with self._lock:
+                    # Newer updates that arrived meanwhile take precedence over the failed batch
+                    for key, (progress, read_at, queued_at) in batch.items():
+                        if key not in self._pending:
+                            self._pending[key] = [progress, read_at, queued_at]
+                        else:
+                            entry = self._pending[key]
+                            if entry[0] is None:
+                                entry[0] = progress
+                            if entry[1] is None:
+                                entry[1] = read_at
+                            entry[2] = min(entry[2], queued_at)
+                    self.metrics["errors"] += 1
+                print(f"⚠️ Progress flush of {len(batch)} updates failed, will retry: {e}")
+                return 0
+            finally:
+                conn.close()
+
+            with self._lock:
+                sealed, self._sealed_logs = self._sealed_logs, []
+            for path in sealed:
+                os.remove(path)
+            m = self.metrics
+            m["flushes"] += 1
+            m["rows_written"] += len(batch)
+            m["last_batch_size"] = len(batch)
+            m["max_batch_size"] = max(m["max_batch_size"], len(batch))
+            m["last_flush_lag_ms"] = round(lag_ms, 1)
+            m["max_flush_lag_ms"] = round(max(m["max_flush_lag_ms"], lag_ms), 1)
+            m["last_flush_ms"] = round((time.time() - started) * 1000, 2)
+            return len(batch)
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+        self._thread.join(timeout=5)
+        self.flush()
+        with self._lock:
+            if not self._pending:  # Clean shutdown: nothing left for a successor to replay
+                os.close(self._log_fd)
+                os.remove(self._log_path(self._seq))
+                os.remove(_owner_path(self.directory, self.token))
+
+    def stats(self):
+        with self._lock:
+            buffered = len(self._pending)
+            oldest = min((entry[2] for entry in self._pending.values()), default=None)
+        stats = dict(self.metrics)
+        stats["buffered"] = buffered
+        stats["oldest_buffered_ms"] = round((time.time() - oldest) * 1000, 1) if oldest else 0.0
+        stats["avg_batch_size"] = round(stats["rows_written"] / stats["flushes"], 1) if stats["flushes"] else 0.0
+        stats["interval_ms"] = self.interval * 1000
+        return stats
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ Progress flusher error: {e}")
+
+    # --- CRASH RECOVERY ---
+
+    def replay_orphaned_logs(self):
+        """Applies logs left by processes that are no longer running. Returns updates replayed."""
+        claimed, dead = [], set()
+        for path in glob.glob(os.path.join(self.directory, "progress-*.log")):
+            try:
+                pid, token = _parse_log_name(path)
+            except ValueError:
+                continue
+            if token == self.token:
+                continue
+            if token is None:
+                # Written before logs carried a token; no new process reuses these names
+                if pid == self.pid or _pid_alive(pid):
+                    continue
+            elif token in dead or not _owner_alive(self.directory, token):
+                dead.add(token)
+            else:
+                continue
+            # rename() is atomic: exactly one starting process claims each orphan
+            target = os.path.join(self.directory, f"replay-{self.token}-{len(claimed)}-{os.path.basename(path)}")
+            try:
+                os.rename(path, target)
+            except FileNotFoundError:
+                continue
+            claimed.append(target)
+        # Logs another starting process claimed but died before replaying
+        for path in glob.glob(os.path.join(self.directory, "replay-*.log")):
+            claimer = os.path.basename(path).split("-")[1]
+            if path in claimed or claimer == self.token:
+                continue
+            if claimer in dead or not _owner_alive(self.directory, claimer):
+                dead.add(claimer)
+                target = os.path.join(self.directory, f"replay-{self.token}-{len(claimed)}-{os.path.basename(path)}")
+                try:
+                    os.rename(path, target)
+                except FileNotFoundError:
+                    continue
+                claimed.append(target)
+        for token in dead:
+            try:
+                os.remove(_owner_path(self.directory, token))
+            except FileNotFoundError:
+                pass
+        if not claimed:
+            return 0
+
+        batch, count = {}, 0
+        for path in sorted(claimed, key=os.path.getmtime):
+            with open(path, encoding="utf-8", errors="replace") as f:
+                for line in f:
+                    try:
+                        user_id, book_id, progress, read_at = json.loads(line)
+                    except ValueError:
+                        continue  # Torn last line from the crash
+                    _merge(batch, (user_id, book_id), progress, read_at, read_at or 0)
+                    count += 1
+        conn = database.get_own_connection()
+        try:
+            write_batch(conn, batch)
+        finally:
+            conn.close()
+        for path in claimed:
+            os.remove(path)
+        self.metrics["replayed"] += count
+        print(f"♻️ Replayed {count} buffered progress updates from {len(claimed)} orphaned logs")
+        return count
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    """This process's buffer (a forked gunicorn worker gets its own)."""
+    global _buffer
+    if _buffer is None or _buffer.pid != os.getpid():
+        with _buffer_lock:
+            if _buffer is None or _buffer.pid != os.getpid():
+                _buffer = ProgressBuffer()
+                atexit.register(_buffer.stop)
+    return _buffer
+
+
+def start():
+    """Replays orphaned logs and starts the flusher. Called once at app startup."""
+    if ENABLED:
+        get_buffer().replay_orphaned_logs()
+
+
+def record(user_id, book_id, progress=None, touch=False):
+    if not ENABLED:
+        conn = database.get_own_connection()
+        try:
+            write_batch(conn, {(user_id, book_id): [progress, time.time() if touch else None, 0]})
+        finally:
+            conn.close()
+        return
+    get_buffer().record(user_id, book_id, progress=progress, touch=touch)
+
+
+def flush_for_user(user_id):
+    """Read-your-writes for this process: flush first if `user_id` has buffered updates."""
+    if ENABLED and _buffer is not None and _buffer.pid == os.getpid() and _buffer.has_pending(user_id):
+        _buffer.flush()
+
+
+def stats():
+    if not ENABLED or _buffer is None or _buffer.pid != os.getpid():
+        return {"enabled": ENABLED}
+    return dict(get_buffer().stats(), enabled=True)
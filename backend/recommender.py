@@ -1,14 +1,122 @@
 import pandas as pd
+import numpy as np
+import hashlib
 import json
 import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import sklearn
+from scipy.sparse import csr_matrix, vstack
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import linear_kernel
+
+# Fitted models are saved here, one directory per hash of the fitted columns
+# (id, category, description), so gunicorn workers load them in milliseconds
+# instead of refitting on boot. A worker with no matching artifact loads the
+# newest one and catches up from the books table through the delta index.
+ARTIFACT_ROOT = os.environ.get("PAPERO_RECOMMENDER_ARTIFACTS",
+                               os.path.join(os.path.dirname(__file__), 'models', 'recommender'))
+ARTIFACT_FORMAT = 1  # Bump when the on-disk layout or the feature recipe changes
+KEEP_ARTIFACTS = 3
+
+# Incremental updates are appended to a small delta index. Once it grows past
+# this share of the fitted corpus, or too many new tokens fall outside the
+# fitted vocabulary, a full refit is scheduled in the background.
+REFIT_DELTA_FRACTION = 0.2
+REFIT_OOV_RATIO = 0.3
+REFIT_MIN_TOKENS = 500
+LOAD_RETRY_SECONDS = 10  # Between background warm-load attempts while no artifact is current
+SYNC_CHECK_SECONDS = 10  # Between checks of the catalog version and newest artifact, per process
+
+BOOK_COLUMNS = "id, ia_id, title, author, category, description, cover_url, price, rating, year"
+FITTED_COLUMNS = ('id', 'category', 'description')  # All the artifact hash covers
+
+def load_catalog_from_db():
+    """The live catalog: every row of the books table, as plain dicts."""
+    from database import get_db_connection
+    conn = get_db_connection()
+    rows = conn.execute(f"SELECT {BOOK_COLUMNS} FROM books ORDER BY id").fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+def catalog_version():
+    """The books_version counter, bumped by triggers on every write to books."""
+    from database import get_db_connection
+    conn = get_db_connection()
+    row = conn.execute("SELECT value FROM catalog_meta WHERE key = 'books_version'").fetchone()
+    conn.close()
+    return row[0] if row else 0
+
+class ArtifactMissing(Exception):
+    """No saved model matches the catalog, and the caller asked not to fit one."""
 
 class Recommender:
-    def __init__(self):
+    def __init__(self, catalog=None, artifact_root=ARTIFACT_ROOT, fit=True, stale_ok=False):
+        """With fit=False, only warm-loads. With stale_ok, an older artifact is loaded and caught up to `catalog`."""
         self.data_path = os.path.join(os.path.dirname(__file__), 'data', 'catalog.json')
-        self.df = self._load_data()
-        self.cosine_sim = self._train_model()
+        self.catalog_hash, load_records = self._catalog_source(catalog)
+        self.artifact_dir = os.path.join(artifact_root, self.catalog_hash[:16]) if artifact_root else None
+        self.base_dir = None  # The artifact directory the fitted rows came from
+        catch_up = False
+
+        if self.artifact_dir and self._artifact_is_current():
+            # Warm start: no JSON->DataFrame->fit, just mmap the saved arrays
+            self._load_artifacts(self.artifact_dir)
+            if catalog is not None:
+                self.df = pd.DataFrame(catalog)  # Same ids in the same order; titles, prices... are unhashed
+        elif stale_ok and catalog is not None and latest_artifact(artifact_root):
+            self._load_artifacts(latest_artifact(artifact_root))
+            catch_up = True
+        elif not fit:
+            raise ArtifactMissing(self.artifact_dir)
+        else:
+            self.df = pd.DataFrame(load_records())
+            self.tfidf_matrix = self._train_model()
+            if self.artifact_dir:
+                self.save_artifacts()
+                self.base_dir = self.artifact_dir
+
+        # title -> row, first occurrence wins (same as the old boolean-mask lookup)
+        self.title_index = {}
+        for idx, title in enumerate(self.df['title']):
+            self.title_index.setdefault(title, idx)
+        self.id_index = {}
+        if 'id' in self.df.columns:
+            self.id_index = {book_id: idx for idx, book_id in enumerate(self.df['id'])}
+
+        # Incremental layer: rows added since the fit, and fitted rows they replace
+        self.n_base = self.tfidf_matrix.shape[0]
+        self.delta = (csr_matrix((0, self.tfidf_matrix.shape[1])), [])  # (matrix, book records)
+        self.superseded = set()
+        self.oov_tokens = 0
+        self.seen_tokens = 0
+        self._write_lock = threading.Lock()
+        if catch_up:
+            self.apply_catalog(catalog)
+
+    @classmethod
+    def from_db(cls, artifact_root=ARTIFACT_ROOT, fit=True, stale_ok=False):
+        """Builds (or warm-loads) the model for the live books table. With fit=False, only warm-loads."""
+        return cls(catalog=load_catalog_from_db(), artifact_root=artifact_root, fit=fit, stale_ok=stale_ok)
+
+    def _catalog_source(self, catalog):
+        """Returns (content hash, loader) without parsing the catalog unless it's needed."""
+        if catalog is not None:
+            # Only what the fit depends on: editing a title or price must not invalidate the artifact
+            fitted = [[book.get(column) for column in FITTED_COLUMNS] for book in catalog]
+            raw = json.dumps(fitted, default=str).encode()
+            return self._hash(raw), lambda: catalog
+        with open(self.data_path, 'rb') as f:
+            raw = f.read()
+        return self._hash(raw), lambda: json.loads(raw)
+
+    @staticmethod
+    def _hash(raw):
+        h = hashlib.sha256(raw)
+        h.update(f"format={ARTIFACT_FORMAT}".encode())
+        return h.hexdigest()
 
     def _load_data(self):
         """Loads book data from JSON into a Pandas DataFrame."""
@@ -20,36 +128,398 @@ class Recommender:
         """Trains the Content-Based Filtering Model."""
         # Create a "soup" of metadata (Category + Description)
         # This tells the AI what the book is "about"
-        self.df['soup'] = self.df['category'] + " " + self.df['description']
+        self.df['soup'] = self.df['category'].fillna('') + " " + self.df['description'].fillna('')
         
         # Convert text to Matrix of token counts (TF-IDF)
-        tfidf = TfidfVectorizer(stop_words='english')
-        tfidf_matrix = tfidf.fit_transform(self.df['soup'])
+        self.vectorizer = TfidfVectorizer(stop_words='english')
         
-        # Calculate Cosine Similarity Matrix
-        # (How similar is every book to every other book?)
-        cosine_sim = linear_kernel(tfidf_matrix, tfidf_matrix)
-        return cosine_sim
+        # Keep only the sparse matrix. Rows are L2-normalised, so a dot product
+        # between two rows IS their cosine similarity; there is no need for the
+        # dense N x N matrix (80GB of float64 at 100k books).
+        return self.vectorizer.fit_transform(self.df['soup']).tocsr()
 
-    def get_recommendations(self, title):
-        """Returns top 5 recommended books given a book title."""
-        # Check if book exists
-        if title not in self.df['title'].values:
-            # Fallback: Return top books generic
-            return self.df.head(3).to_dict('records')
+    # --- MODEL ARTIFACTS ---
+
+    def _artifact_is_current(self):
+        try:
+            with open(os.path.join(self.artifact_dir, 'manifest.json')) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return False
+        return (manifest.get('format') == ARTIFACT_FORMAT
+                and manifest.get('catalog_hash') == self.catalog_hash
+                and manifest.get('sklearn_version') == sklearn.__version__)
+
+    def save_artifacts(self):
+        """Writes vocabulary, IDF weights, CSR arrays and the book records.
+
+        Files are written to a temp dir and renamed into place, so a worker
+        booting concurrently never sees a half-written model.
+        """
+        os.makedirs(os.path.dirname(self.artifact_dir), exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=os.path.dirname(self.artifact_dir), prefix='.building-')
+        try:
+            m = self.tfidf_matrix
+            np.save(os.path.join(tmp, 'data.npy'), m.data)
+            np.save(os.path.join(tmp, 'indices.npy'), m.indices)
+            np.save(os.path.join(tmp, 'indptr.npy'), m.indptr)
+            np.save(os.path.join(tmp, 'idf.npy'), self.vectorizer.idf_)
+            with open(os.path.join(tmp, 'vocabulary.json'), 'w') as f:
+                json.dump({term: int(i) for term, i in self.vectorizer.vocabulary_.items()}, f)
+            with open(os.path.join(tmp, 'books.json'), 'w') as f:
+                json.dump(self.df.drop(columns=['soup']).to_dict('records'), f, default=str)
+            with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+                json.dump({
+                    'format': ARTIFACT_FORMAT,
+                    'catalog_hash': self.catalog_hash,
+                    'sklearn_version': sklearn.__version__,
+                    'shape': list(m.shape),
+                    'built_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                }, f, indent=2)
+            try:
+                os.rename(tmp, self.artifact_dir)
+            except OSError:
+                shutil.rmtree(tmp, ignore_errors=True)  # Another worker won the race; same content
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        prune_artifacts(os.path.dirname(self.artifact_dir), keep=KEEP_ARTIFACTS)
+
+    def _load_artifacts(self, d):
+        self.base_dir = d
+        with open(os.path.join(d, 'manifest.json')) as f:
+            shape = tuple(json.load(f)['shape'])
+        # mmap_mode='r': pages are shared between workers via the OS page cache
+        arrays = [np.load(os.path.join(d, name), mmap_mode='r') for name in ('data.npy', 'indices.npy', 'indptr.npy')]
+        self.tfidf_matrix = csr_matrix(tuple(arrays), shape=shape, copy=False)
+
+        with open(os.path.join(d, 'vocabulary.json')) as f:
+            vocabulary = json.load(f)
+        self.vectorizer = TfidfVectorizer(stop_words='english', vocabulary=vocabulary)
+        self.vectorizer.idf_ = np.load(os.path.join(d, 'idf.npy'))
+
+        with open(os.path.join(d, 'books.json')) as f:
+            self.df = pd.DataFrame(json.load(f))
+
+    # --- INCREMENTAL UPDATES ---
+
+    def add_or_update_book(self, book):
+        """Indexes a new or edited book immediately, using the fitted vocabulary.
+
+        No refit happens here: the book is transformed with the existing IDF
+        weights and appended to the delta index; an older version of the same
+        book id is masked out of results.
+        """
+        soup = f"{book.get('category') or ''} {book.get('description') or ''}"
+        row = self.vectorizer.transform([soup]).tocsr()
+
+        tokens = self.vectorizer.build_analyzer()(soup)
+        vocabulary = self.vectorizer.vocabulary_
+
+        with self._write_lock:
+            self.seen_tokens += len(tokens)
+            self.oov_tokens += sum(1 for t in tokens if t not in vocabulary)
+
+            matrix, books = self.delta
+            idx = self.n_base + len(books)
+            previous = self.id_index.get(book.get('id')) if book.get('id') is not None else None
+            if previous is not None:
+                self.superseded.add(previous)
+                self.id_index[book['id']] = idx
+                if self.title_index.get(book.get('title')) == previous:
+                    self.title_index[book['title']] = idx
+            elif book.get('id') is not None:
+                self.id_index[book['id']] = idx
+            self.title_index.setdefault(book.get('title'), idx)
+
+            # Swap in a new tuple so concurrent readers see either the old or new delta, never half
+            self.delta = (vstack([matrix, row], format='csr'), books + [dict(book)])
+        return idx
+
+    def apply_catalog(self, catalog):
+        """Catches the model up with `catalog` (the live books table) without refitting.
 
-        # Get index of the book
-        idx = self.df.index[self.df['title'] == title][0]
+        New and edited books go through add_or_update_book(); books that are
+        gone are masked out. Lets a worker serve from an older artifact, and
+        picks up books other workers imported.
+        """
+        current = {}
+        for idx, record in enumerate(self._records(self.df)):
+            if self.id_index.get(record.get('id')) == idx:
+                current[record.get('id')] = record
+        for record in self.delta[1]:
+            current[record.get('id')] = record
 
-        # Get similarity scores for all books with this book
-        sim_scores = list(enumerate(self.cosine_sim[idx]))
+        relabeled = {}  # Base row -> book, where only display columns (price, cover...) changed
+        for book in catalog:
+            known = current.pop(book.get('id'), None)
+            if known is not None and all(known.get(column) == value for column, value in book.items()):
+                continue
+            idx = self.id_index.get(book.get('id'))
+            if known is not None and idx < self.n_base and \
+                    all(known.get(column) == book.get(column) for column in FITTED_COLUMNS + ('title',)):
+                relabeled[idx] = book
+            else:
+                self.add_or_update_book(book)
+        if relabeled:
+            df = self.df.copy()
+            for idx, book in relabeled.items():
+                for column, value in book.items():
+                    if column in df.columns:
+                        df.at[df.index[idx], column] = value
+            self.df = df  # Swapped whole, like delta, so readers never see a half-edited frame
+        with self._write_lock:
+            for book_id, record in current.items():  # Deleted from the table
+                idx = self.id_index.pop(book_id, None)
+                if idx is not None:
+                    self.superseded.add(idx)
+                    if self.title_index.get(record.get('title')) == idx:
+                        del self.title_index[record.get('title')]
 
-        # Sort books based on similarity scores
-        sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
+    def needs_refit(self):
+        """True once incremental drift makes a full refit worthwhile."""
+        n_delta = len(self.delta[1])
+        if n_delta > max(1, self.n_base) * REFIT_DELTA_FRACTION:
+            return True
+        return self.seen_tokens >= REFIT_MIN_TOKENS and self.oov_tokens / self.seen_tokens > REFIT_OOV_RATIO
 
-        # Get top 5 (excluding the book itself)
-        sim_scores = sim_scores[1:6]
-        book_indices = [i[0] for i in sim_scores]
+    # --- QUERIES ---
+
+    def _query_rows(self, indices, delta_matrix):
+        base = [i for i in indices if i < self.n_base]
+        if len(base) == len(indices):
+            return self.tfidf_matrix[indices]
+        return vstack([self.tfidf_matrix[[i]] if i < self.n_base else delta_matrix[[i - self.n_base]]
+                       for i in indices], format='csr')
+
+    def _similarities(self, indices, delta_matrix=None):
+        """Cosine similarity of the given rows against every book, shape (len(indices), N)."""
+        if delta_matrix is None:
+            delta_matrix = self.delta[0]
+        # Densify only the query rows (len(indices) x vocab); sparse matrix x dense
+        # block is several times faster than a sparse x sparse.T product.
+        queries = self._query_rows(indices, delta_matrix).toarray()
+        scores = np.asarray(self.tfidf_matrix @ queries.T).T
+        if delta_matrix.shape[0]:
+            scores = np.hstack([scores, np.asarray(delta_matrix @ queries.T).T])
+        return scores
+
+    def _top_k(self, scores, k, exclude):
+        """Indices of the k highest scores (best first), skipping `exclude` and superseded rows."""
+        scores[exclude] = -np.inf
+        if self.superseded:
+            scores[list(self.superseded)] = -np.inf
+        k = min(k, len(scores) - 1 - len(self.superseded))
+        if k <= 0:
+            return np.array([], dtype=int)
+        # O(N) selection instead of sorting the whole catalog, then sort just the k winners
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top], kind='stable')]
+
+    @staticmethod
+    def _records(frame):
+        # NULL columns come back from pandas as NaN, which is not valid JSON
+        frame = frame.drop(columns=['soup'], errors='ignore').astype(object)
+        return frame.where(pd.notna(frame), None).to_dict('records')
+
+    def _books(self, indices, delta_books):
+        base = [i for i in indices if i < self.n_base]
+        records = dict(zip(base, self._records(self.df.iloc[base])))
+        return [records[i] if i < self.n_base else delta_books[i - self.n_base] for i in indices]
+
+    def _fallback(self):
+        # Fallback: Return top books generic
+        return self._records(self.df.head(3))
+
+    def get_recommendations(self, title, k=5):
+        """Returns top k (default 5) recommended books given a book title."""
+        # Check if book exists
+        if title not in self.title_index:
+            return self._fallback()
+        return self._recommend_for_index(self.title_index[title], k)
+
+    def get_recommendations_for_id(self, book_id, k=5):
+        """Same as get_recommendations, keyed by books.id (DB-backed models only)."""
+        if book_id not in self.id_index:
+            return self._fallback()
+        return self._recommend_for_index(self.id_index[book_id], k)
+
+    def _recommend_for_index(self, idx, k):
+        delta_matrix, delta_books = self.delta
+        scores = self._similarities([idx], delta_matrix)[0]
+        book_indices = self._top_k(scores, k, idx)
 
         # Return the actual book objects
-        return self.df.iloc[book_indices].to_dict('records')
+        return self._books(list(book_indices), delta_books)
+
+    def get_recommendations_batch(self, titles, k=5, batch_size=64):
+        """Recommendations for many titles at once: {title: [books]}.
+
+        Similarities are computed batch_size rows at a time with one sparse
+        product, which bounds the dense intermediates at batch_size x N.
+        """
+        results = {}
+        known = [t for t in dict.fromkeys(titles) if t in self.title_index]
+        for t in titles:
+            if t not in self.title_index:
+                results[t] = self._fallback()
+
+        delta_matrix, delta_books = self.delta
+        for start in range(0, len(known), batch_size):
+            chunk = known[start:start + batch_size]
+            rows = [self.title_index[t] for t in chunk]
+            sims = self._similarities(rows, delta_matrix)
+            for title, idx, scores in zip(chunk, rows, sims):
+                results[title] = self._books(list(self._top_k(scores, k, idx)), delta_books)
+        return results
+
+def latest_artifact(root):
+    """The most recently built artifact directory this process can load, or None."""
+    try:
+        dirs = [os.path.join(root, d) for d in os.listdir(root) if not d.startswith('.')]
+    except OSError:
+        return None
+    for d in sorted(dirs, key=os.path.getmtime, reverse=True):
+        try:
+            with open(os.path.join(d, 'manifest.json')) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if manifest.get('format') == ARTIFACT_FORMAT and manifest.get('sklearn_version') == sklearn.__version__:
+            return d
+    return None
+
+def prune_artifacts(root, keep=KEEP_ARTIFACTS):
+    """Deletes all but the `keep` most recently built artifact directories."""
+    try:
+        dirs = [os.path.join(root, d) for d in os.listdir(root) if not d.startswith('.')]
+    except OSError:
+        return
+    dirs.sort(key=os.path.getmtime, reverse=True)
+    for stale in dirs[keep:]:
+        shutil.rmtree(stale, ignore_errors=True)
+
+# --- LIVE MODEL (one per worker process) ---
+
+_live = None
+_live_lock = threading.Lock()
+_changed_during_refit = None
+_load_thread = None
+_last_load_attempt = 0.0
+_last_sync_check = 0.0
+_live_version = None  # books_version the live model was last caught up to
+
+def get_live_recommender():
+    """The DB-backed model for this process, built (or warm-loaded) on first use."""
+    global _live
+    if _live is None:
+        with _live_lock:
+            if _live is None:
+                _live = Recommender.from_db(artifact_root=ARTIFACT_ROOT)
+    return _live
+
+def live_model_loaded():
+    return _live is not None
+
+def load_in_background():
+    """The live model, or None while this process warm-loads it on a background thread.
+
+    Never fits: with no artifact at all, the rebuild_recommender job fits and
+    saves one. Once loaded, every SYNC_CHECK_SECONDS it also checks whether
+    the books table or the newest artifact changed, and catches up in the
+    background, so books imported by other workers become recommendable.
+    """
+    global _load_thread, _last_load_attempt, _last_sync_check
+    with _live_lock:
+        busy = _load_thread is not None and _load_thread.is_alive()
+        now = time.monotonic()
+        if _live is None:
+            if not busy and now - _last_load_attempt >= LOAD_RETRY_SECONDS:
+                _last_load_attempt = now
+                _load_thread = threading.Thread(target=_warm_load, daemon=True, name="recommender-load")
+                _load_thread.start()
+            return None
+        model = _live
+        if busy or now - _last_sync_check < SYNC_CHECK_SECONDS:
+            return model
+        _last_sync_check = now
+    if catalog_version() != _live_version or latest_artifact(ARTIFACT_ROOT) != model.base_dir:
+        with _live_lock:
+            if _load_thread is None or not _load_thread.is_alive():
+                _load_thread = threading.Thread(target=_warm_load, daemon=True, name="recommender-sync")
+                _load_thread.start()
+    return model
+
+def _warm_load():
+    """Loads the newest artifact (or catches the current model up) to the books table as of now."""
+    global _live, _live_version
+    try:
+        version = catalog_version()
+        catalog = load_catalog_from_db()
+        model = _live
+        if model is None or latest_artifact(ARTIFACT_ROOT) != model.base_dir:
+            model = Recommender(catalog=catalog, artifact_root=ARTIFACT_ROOT, fit=False, stale_ok=True)
+        else:
+            model.apply_catalog(catalog)
+    except ArtifactMissing:
+        request_rebuild()
+        return
+    except Exception as e:
+        print(f"⚠️ Recommender warm load failed: {e}")
+        return
+    with _live_lock:
+        _live, _live_version = model, version
+    if model.needs_refit():
+        request_rebuild()
+
+def request_rebuild():
+    """Queues a full refit on the job worker (deduplicated across processes)."""
+    import jobs
+    return jobs.submit('rebuild_recommender', dedupe_key='rebuild_recommender')
+
+def notify_book_changed(book):
+    """Call after a book row is inserted/updated. Cheap: no-op until the model is loaded.
+
+    Only this process sees the change right away; other workers catch up on
+    their next sync check (see load_in_background).
+    """
+    model = _live
+    if model is None:
+        return
+    with _live_lock:
+        if _changed_during_refit is not None:
+            _changed_during_refit.append(dict(book))
+    model.add_or_update_book(book)
+    if model.needs_refit():
+        request_rebuild()
+
+def refit_live_recommender():
+    """Full refit from the books table, then swap it in for new requests. Jobs only."""
+    global _live, _live_version, _changed_during_refit
+    with _live_lock:
+        _changed_during_refit = []
+    try:
+        version = catalog_version()
+        fresh = Recommender.from_db(artifact_root=ARTIFACT_ROOT)
+    finally:
+        with _live_lock:
+            changed, _changed_during_refit = _changed_during_refit, None
+    # Books imported while we were reading the table may be missing from the snapshot
+    for book in changed:
+        if book.get('id') not in fresh.id_index:
+            fresh.add_or_update_book(book)
+    with _live_lock:
+        _live, _live_version = fresh, version
+    print(f"🔁 Recommender refit on {fresh.n_base} books")
+
+if __name__ == "__main__":
+    # Build step: python recommender.py [--db | catalog.json]
+    started = time.perf_counter()
+    if sys.argv[1:] == ['--db']:
+        rec = Recommender.from_db()
+    elif len(sys.argv) > 1:
+        with open(sys.argv[1]) as f:
+            rec = Recommender(catalog=json.load(f))
+    else:
+        rec = Recommender()
+    print(f"Model for {len(rec.df)} books ready at {rec.artifact_dir} ({time.perf_counter() - started:.2f}s)")
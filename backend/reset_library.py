@@ -8,7 +8,7 @@ def reset_library():
     c = conn.cursor()
     
     # Clear tables
-    tables_to_clear = ['purchases', 'books', 'comments', 'interactions']
+    tables_to_clear = ['purchases', 'books', 'comments', 'interactions', 'ingest_checkpoints', 'ingest_runs']
     for table in tables_to_clear:
         c.execute(f"DELETE FROM {table}")
         print(f"   - Cleared {table}")
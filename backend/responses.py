@@ -0,0 +1,136 @@
+"""
+Response pipeline: fast JSON encoding and negotiated compression.
+
+- FastJSONProvider makes every jsonify() use orjson when it is installed
+  (falling back to the stdlib encoder) and understands sqlite3.Row.
+- rows_response() turns a tuple cursor into a JSON response straight from the
+  tuples: keys are encoded once per response, never a dict per row.
+- compress_response() gzip/brotli-encodes bodies above MIN_COMPRESS_BYTES when
+  the client's Accept-Encoding allows it (q-values honoured, q=0 refuses).
+"""
+import gzip
+import json
+import sqlite3
+
+from flask import current_app, request
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import parse_accept_header
+
+try:
+    import orjson
+except ImportError:  # Optional speed-up; the stdlib encoder still works
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_COMPRESS_BYTES = 1024
+GZIP_LEVEL = 5        # Dynamic responses: most of level 9's ratio at a fraction of the CPU
+BROTLI_QUALITY = 4
+ENCODING_SUFFIX = {"br": "-br", "gzip": "-gz"}
+
+
+def _default(obj):
+    if isinstance(obj, sqlite3.Row):
+        return dict(zip(obj.keys(), obj))
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        if orjson is not None:
+            # Keys stay sorted, matching Flask's default output order
+            return orjson.dumps(obj, default=_default, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS).decode()
+        kwargs.setdefault("default", _default)
+        return super().dumps(obj, **kwargs)
+
+    def encode(self, obj):
+        """UTF-8 JSON for one value, byte-identical to how response() would encode it."""
+        if orjson is not None:
+            return orjson.dumps(obj, default=_default, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+        return json.dumps(obj, default=_default, sort_keys=True, separators=(",", ":")).encode()
+
+    def response(self, *args, **kwargs):
+        body = self.encode(self._prepare_response_obj(args, kwargs))
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def rows_response(cursor):
+    """JSON response for a cursor executed with row_factory=None (plain tuples).
+
+    Same bytes as jsonify([dict(zip(names, row)), ...]): keys sorted, and a
+    repeated column name keeps its last value.
+    """
+    provider = current_app.json
+    names = [col[0] for col in cursor.description]
+    last = {name: i for i, name in enumerate(names)}
+    columns = [last[name] for name in sorted(last)]
+    # b'{"author":%b,"title":%b}': only the values are encoded per row
+    keys = [provider.encode(names[i]).replace(b"%", b"%%") for i in columns]
+    template = b"{" + b",".join(key + b":%b" for key in keys) + b"}"
+    encode = provider.encode
+    body = b",".join([template % tuple([encode(row[i]) for i in columns]) for row in cursor])
+    return current_app.response_class(b"[" + body + b"]", mimetype=provider.mimetype)
+
+
+def tuple_cursor(conn):
+    """A cursor that yields plain tuples, for use with rows_response()."""
+    cur = conn.cursor()
+    cur.row_factory = None
+    return cur
+
+
+def etag_matches(etag):
+    """If-None-Match check that also accepts the per-encoding variants we emit."""
+    candidates = [etag] + [etag + suffix for suffix in ENCODING_SUFFIX.values()]
+    return any(request.if_none_match.contains(c) for c in candidates)
+
+
+def choose_encoding(accept_encoding):
+    """The acceptable coding with the highest q-value ("br" wins ties), or None."""
+    accepted = parse_accept_header(accept_encoding)
+    offered = ["br", "gzip"] if brotli is not None else ["gzip"]
+    best = max(offered, key=accepted.quality)
+    return best if accepted.quality(best) > 0 else None
+
+
+def encode_body(body, accept_encoding):
+    """(body, content_encoding): compressed when worthwhile and accepted, else (body, None)."""
+    encoding = choose_encoding(accept_encoding)
+    if encoding is None or len(body) < MIN_COMPRESS_BYTES:
+        return body, None
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY), encoding
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0), encoding
+
+
+def compress_response(response):
+    """after_request hook: compress large uncompressed bodies the client can decode."""
+    if (response.direct_passthrough or response.is_streamed or response.status_code < 200
+            or response.status_code in (204, 206, 304) or "Content-Encoding" in response.headers
+            or response.mimetype == "text/event-stream"):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    if choose_encoding(request.headers.get("Accept-Encoding", "")) is None:
+        return response
+    compressed, encoding = encode_body(response.get_data(), request.headers.get("Accept-Encoding", ""))
+    if encoding is None:
+        return response
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+
+    # A strong ETag must change with the encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag + ENCODING_SUFFIX[encoding])
+    return response
+
+
+def init_app(app):
+    app.json = FastJSONProvider(app)
+    app.after_request(compress_response)
@@ -0,0 +1,61 @@
+"""
+Local catalog search backed by the books_fts FTS5 index.
+
+Queries are tokenized the same way the index is (unicode61), every term is a
+prefix match ("drac" finds "Dracula"), all terms must match, and results are
+ranked with bm25 weighting title > author > category > description.
+"""
+import re
+
+# bm25() column weights, in books_fts column order: title, author, category, description
+BM25_WEIGHTS = (10.0, 5.0, 2.0, 1.0)
+RESULT_COLUMNS = "b.id, b.ia_id, b.title, b.author, b.cover_url, b.category, b.price, b.rating, b.year"
+MAX_TERMS = 8
+
+
+def query_terms(query):
+    return re.findall(r"\w+", (query or "").lower())[:MAX_TERMS]
+
+
+def build_match_query(query):
+    """'dracula sto' -> '"dracula"* AND "sto"*'. Quoting stops FTS syntax injection."""
+    terms = query_terms(query)
+    if not terms:
+        return None
+    return " AND ".join(f'"{t}"*' for t in terms)
+
+
+def has_fts_index(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'books_fts'").fetchone() is not None
+
+
+def search_books(conn, query, limit=20, offset=0):
+    """Returns (rows, total_matches) for a ranked, paginated local search."""
+    match = build_match_query(query)
+    if match is None:
+        return [], 0
+
+    if not has_fts_index(conn):
+        return _search_books_like(conn, query_terms(query), limit, offset)
+
+    weights = ", ".join(str(w) for w in BM25_WEIGHTS)
+    rows = conn.execute(f'''
+        SELECT {RESULT_COLUMNS}, bm25(books_fts, {weights}) AS score
+        FROM books_fts
+        JOIN books b ON b.id = books_fts.rowid
+        WHERE books_fts MATCH ?
+        ORDER BY score
+        LIMIT ? OFFSET ?
+    ''', (match, limit, offset)).fetchall()
+    total = conn.execute("SELECT COUNT(*) FROM books_fts WHERE books_fts MATCH ?", (match,)).fetchone()[0]
+    return rows, total
+
+
+def _search_books_like(conn, terms, limit, offset):
+    """Unranked fallback for SQLite builds without FTS5 (full scan)."""
+    clauses = " AND ".join("(b.title LIKE ? OR b.author LIKE ? OR b.category LIKE ?)" for _ in terms)
+    params = [p for t in terms for p in (f"%{t}%",) * 3]
+    rows = conn.execute(f"SELECT {RESULT_COLUMNS}, 0 AS score FROM books b WHERE {clauses} ORDER BY b.id LIMIT ? OFFSET ?",
+                        params + [limit, offset]).fetchall()
+    total = conn.execute(f"SELECT COUNT(*) FROM books b WHERE {clauses}", params).fetchone()[0]
+    return rows, total
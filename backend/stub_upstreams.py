@@ -0,0 +1,138 @@
+"""
+Local stand-ins for the upstreams the backend calls, for development and benchmarks.
+
+    python stub_upstreams.py --port 8089 --token-delay-ms 20
+    PAPERO_LLM_URL=http://127.0.0.1:8089/v1/chat/completions python app.py
+
+POST /v1/chat/completions answers like an OpenAI-compatible server in JSON
+mode: {"search_query": ..., "text": ...}, streamed token by token as
+Server-Sent Events when the request sets "stream": true.
+
+GET /search.json answers like openlibrary.org's search API after a fixed
+delay (PAPERO_OPENLIBRARY_URL=http://127.0.0.1:8089/search.json).
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qsl, urlsplit
+
+
+def stub_reply(messages):
+    question = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+    topic = " ".join(question.split()[-3:]) or None
+    return json.dumps({
+        "search_query": topic,
+        "text": f"Here are a few books about {topic} you might enjoy. \"Classics\" never go out of style.",
+    })
+
+
+def stub_docs(query, limit, offset):
+    seed = zlib.crc32(query.encode())
+    return [{
+        "key": f"/works/OL{seed + i}W",
+        "title": f"{query.title()} Volume {i + 1}",
+        "author_name": [f"Author {(seed + i) % 97}"],
+        "cover_i": seed % 100000 + i,
+        "ia": [f"stub{seed}_{i}"],
+        "edition_key": [f"OL{seed + i}M"],
+        "language": ["eng"],
+        "first_publish_year": 1900 + (seed + i) % 120,
+        "ratings_average": 3.5 + (seed + i) % 15 / 10,
+    } for i in range(offset, offset + limit)]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # Headers and body go out in separate writes
+    token_delay = 0.02
+    search_delay = 0.2
+    calls = 0
+    searches = 0
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path.rstrip("/") != "/search.json":
+            return self._json(404, {"error": "not found"})
+        query = dict(parse_qsl(url.query))
+        StubHandler.searches += 1
+        time.sleep(self.search_delay)
+        limit, offset = int(query.get("limit", 20)), int(query.get("offset", 0))
+        docs = stub_docs(query.get("q", ""), limit, offset)
+        self._json(200, {"numFound": 1000, "start": offset, "docs": docs})
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            return self._json(404, {"error": {"message": "not found"}})
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        StubHandler.calls += 1
+        reply = stub_reply(request.get("messages", []))
+
+        if not request.get("stream"):
+            time.sleep(self.token_delay * len(reply) / 4)
+            return self._json(200, {"choices": [{"message": {"role": "assistant", "content": reply}}]})
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send(data):
+            payload = f"data: {data}\n\n".encode()
+            self.wfile.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+            self.wfile.flush()
+
+        try:
+            for i in range(0, len(reply), 4):  # ~4 characters per token
+                time.sleep(self.token_delay)
+                send(json.dumps({"choices": [{"delta": {"content": reply[i:i + 4]}}]}))
+            send("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True  # Client gave up (e.g. its deadline passed)
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # Benchmarks open hundreds of connections at once
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+def serve(port=0, token_delay_ms=20, search_delay_ms=200):
+    """Starts the stub server on a background thread. Returns (server, base_url)."""
+    handler = type("Handler", (StubHandler,), {"token_delay": token_delay_ms / 1000,
+                                               "search_delay": search_delay_ms / 1000})
+    server = StubServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run stub upstream servers.")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--token-delay-ms", type=float, default=20)
+    parser.add_argument("--search-delay-ms", type=float, default=200)
+    args = parser.parse_args()
+    server, url = serve(args.port, args.token_delay_ms, args.search_delay_ms)
+    print(f"Stub upstreams on {url} (LLM: {url}/v1/chat/completions, OpenLibrary: {url}/search.json)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
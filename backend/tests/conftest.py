@@ -0,0 +1,44 @@
+"""
+Shared fixtures. Every test gets a freshly migrated SQLite file; nothing
+touches ebook_market.db or the network.
+
+    cd backend && python -m pytest -q
+"""
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# app.py migrates and queues jobs at import: point it at a scratch DB and keep the job worker out of process
+os.environ["PAPERO_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="papero-tests-"), "import.db")
+os.environ["PAPERO_JOBS_INPROCESS"] = "0"
+os.environ["PAPERO_CF_ARTIFACT"] = os.path.join(tempfile.mkdtemp(prefix="papero-tests-"), "cf", "item_item.pkl")
+os.environ["PAPERO_RECOMMENDER_ARTIFACTS"] = os.path.join(tempfile.mkdtemp(prefix="papero-tests-"), "recommender")
+
+import contextlib
+import io
+
+import pytest
+
+import database
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A migrated, empty database. Yields a pooled connection to it."""
+    monkeypatch.setattr(database, "DB_NAME", str(tmp_path / "test.db"))
+    with contextlib.redirect_stdout(io.StringIO()):
+        database.init_db()
+    conn = database.get_db_connection()
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def client(db):
+    """Flask test client over the `db` fixture's database."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        from app import app
+    return app.test_client()
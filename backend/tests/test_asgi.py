@@ -0,0 +1,126 @@
+"""The ASGI mode serves the same handlers (and CORS headers) as the Flask app."""
+import asyncio
+import contextlib
+import io
+import json
+
+import pytest
+
+import openlibrary
+
+DOC = {"ia": ["ia1"], "cover_i": 7, "title": "Dune", "language": ["eng"], "author_name": ["Herbert"]}
+
+
+@pytest.fixture
+def asgi(client):
+    with contextlib.redirect_stdout(io.StringIO()):
+        import asgi
+    return asgi
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Both OpenLibrary clients answer from `upstream.docs`, or raise `upstream.error`."""
+    class Upstream:
+        docs = [DOC]
+        error = None
+
+        def respond(self, params):
+            if self.error:
+                raise self.error
+            return {"docs": self.docs}
+
+    fake = Upstream()
+
+    async def search_async(params):
+        return fake.respond(params)
+
+    monkeypatch.setattr(openlibrary, "search", fake.respond)
+    monkeypatch.setattr(openlibrary, "search_async", search_async)
+    return fake
+
+
+def call(asgi, method, path, query="", headers=(), body=b""):
+    """(status, headers, body) for one request to the ASGI app."""
+    scope = {"type": "http", "method": method, "path": path, "query_string": query.encode(),
+             "headers": [(k.lower().encode(), v.encode()) for k, v in headers],
+             "http_version": "1.1", "scheme": "http", "server": ("test", 80), "root_path": ""}
+    messages = [{"type": "http.request", "body": body}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi.app(scope, receive, send))
+    start = sent[0]
+    return (start["status"], {k.decode(): v.decode() for k, v in start["headers"]},
+            b"".join(m.get("body", b"") for m in sent[1:]))
+
+
+def test_search_external_matches_flask(asgi, client, upstream):
+    status, _, body = call(asgi, "GET", "/api/search_external", "q=dune")
+    assert status == 200
+    assert json.loads(body) == client.get('/api/search_external?q=dune').json
+    assert json.loads(body)[0]["ia_id"] == "ia1"
+
+
+@pytest.mark.parametrize("query", ["", "q=subject:"])
+def test_search_external_skips_empty_queries(asgi, upstream, query):
+    upstream.error = AssertionError("searched")
+    assert json.loads(call(asgi, "GET", "/api/search_external", query)[2]) == []
+
+
+def test_search_external_upstream_error_is_empty(asgi, client, upstream):
+    upstream.error = ValueError("boom")
+    assert json.loads(call(asgi, "GET", "/api/search_external", "q=dune")[2]) == []
+    assert client.get('/api/search_external?q=dune').json == []
+
+
+def test_cors_headers_match_flask(asgi, client, upstream):
+    origin = [("Origin", "https://papero.example")]
+    _, headers, _ = call(asgi, "GET", "/api/search_external", "q=dune", origin)
+    flask_headers = client.get('/api/search_external?q=dune', headers=dict(origin)).headers
+    for name in ("Access-Control-Allow-Origin", "Access-Control-Expose-Headers"):
+        assert headers[name.lower()] == flask_headers[name]
+
+
+def test_chat_without_message_is_rejected_like_flask(asgi, client):
+    status, _, body = call(asgi, "POST", "/api/chat", body=b"{}")
+    assert (status, json.loads(body)) == (400, client.post('/api/chat', json={}).json)
+
+
+def test_flask_routes_run_through_the_threaded_adapter(asgi):
+    status, _, body = call(asgi, "GET", "/health")
+    assert status == 200
+
+
+def test_global_feed_matches_flask(asgi, client, upstream, monkeypatch):
+    import app as papero
+    monkeypatch.setattr(papero, "plan_genre_rows", lambda: [("fantasy", "subject:fantasy", 15, 0)])
+    status, headers, body = call(asgi, "GET", "/api/global_feed", "user_id=1")
+    assert status == 200
+    assert "recommended;dur=" in headers["server-timing"]
+    feed = json.loads(body)
+    assert set(feed) == {"Fantasy", "Recommended (Because you read bestsellers)"}
+    # The first call materialized the user's row; Flask serves the same feed from it
+    assert client.get('/api/global_feed?user_id=1').json == feed
+
+
+def test_chat_turn_matches_flask(asgi, client, upstream, monkeypatch):
+    import app as papero
+    events = [("query", "dune"), ("text", "Try "), ("text", "Dune."), ("result", {"text": "Try Dune.", "cached": False})]
+
+    async def astream_chat(messages, deadline=None):
+        for event in events:
+            yield event
+
+    monkeypatch.setattr(papero.librarian, "stream_chat", lambda messages, deadline=None: iter(events))
+    monkeypatch.setattr(papero.librarian, "astream_chat", astream_chat)
+    status, _, body = call(asgi, "POST", "/api/chat", body=b'{"message": "something epic"}')
+    reply = json.loads(body)
+    assert status == 200
+    assert reply["text"] == "Try Dune." and reply["books"][0]["title"] == "Dune"
+    assert client.post('/api/chat', json={"message": "something epic"}).json == reply
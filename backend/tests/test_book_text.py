@@ -0,0 +1,33 @@
+"""Caching headers of /api/read/<id>/text."""
+import pytest
+
+import content_store
+
+
+@pytest.fixture
+def book_with_text(db, monkeypatch, tmp_path):
+    monkeypatch.setattr(content_store, "CONTENT_ROOT", str(tmp_path))
+    cur = db.execute("INSERT INTO books (title, author) VALUES ('Emma', 'Jane Austen')")
+    book_id = cur.lastrowid
+
+    def store(text):
+        content_path, _ = content_store.store_text(text, book_id=book_id)
+        db.execute("UPDATE books SET content_path = ? WHERE id = ?", (content_path, book_id))
+        db.commit()
+
+    store("Emma Woodhouse, handsome, clever, and rich.")
+    return book_id, store
+
+
+@pytest.mark.parametrize("query", ["", "?page=1"])
+def test_text_revalidates_after_the_text_changes(client, book_with_text, query):
+    book_id, store = book_with_text
+    first = client.get(f'/api/read/{book_id}/text{query}')
+    assert first.headers['Cache-Control'] == 'no-cache'
+    assert client.get(f'/api/read/{book_id}/text{query}',
+                      headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+    store("It is a truth universally acknowledged.")
+    second = client.get(f'/api/read/{book_id}/text{query}', headers={'If-None-Match': first.headers['ETag']})
+    assert second.status_code == 200
+    assert second.headers['ETag'] != first.headers['ETag']
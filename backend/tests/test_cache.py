@@ -0,0 +1,83 @@
+"""Stale-while-revalidate refreshes and the async path's backend calls."""
+import asyncio
+import threading
+import time
+
+import cache
+
+
+def stale_cache(backend, keys):
+    """A ResponseCache whose entries for `keys` are all stale."""
+    response_cache = cache.ResponseCache(backend, ttl=1, stale_ttl=3600)
+    for key in keys:
+        backend.set(cache.make_key("u", {"k": key}), "old", time.time() - 10)
+    return response_cache
+
+
+def test_stale_refreshes_share_a_bounded_pool(monkeypatch):
+    monkeypatch.setattr(cache, "_refresh_pool", None)
+    release = threading.Event()
+    fetches = []
+
+    def fetch():
+        fetches.append(threading.current_thread().name)
+        release.wait(5)
+        return "new"
+
+    keys = range(20)
+    response_cache = stale_cache(cache.MemoryBackend(), keys)
+    for _ in range(3):  # Repeated stale hits on a key queue one refresh, not three
+        for key in keys:
+            assert response_cache.get_or_fetch("u", {"k": key}, fetch) == "old"
+    refresh_threads = [t for t in threading.enumerate() if t.name.startswith("cache-refresh")]
+    release.set()
+    cache._refresh_executor().submit(int).result()  # Let the queue drain
+
+    assert len(refresh_threads) <= cache.REFRESH_WORKERS
+    assert response_cache.counters["refreshes"] == len(keys)
+    assert response_cache.get_or_fetch("u", {"k": 0}, fetch) == "new"
+
+
+def test_stale_refreshes_are_capped_per_cache(monkeypatch):
+    monkeypatch.setattr(cache, "REFRESH_MAX_PENDING", 2)
+    release = threading.Event()
+    keys = range(5)
+    response_cache = stale_cache(cache.MemoryBackend(), keys)
+    for key in keys:
+        response_cache.get_or_fetch("u", {"k": key}, lambda: release.wait(5) and "new")
+    release.set()
+    assert response_cache.counters["refreshes"] == 2
+
+
+class RecordingSQLiteBackend(cache.SQLiteBackend):
+    def __init__(self, path):
+        super().__init__(path)
+        self.threads = set()
+
+    def get(self, key):
+        self.threads.add(threading.get_ident())
+        return super().get(key)
+
+    def set(self, key, value, stored_at):
+        self.threads.add(threading.get_ident())
+        return super().set(key, value, stored_at)
+
+
+def test_async_path_keeps_sqlite_off_the_event_loop(tmp_path):
+    backend = RecordingSQLiteBackend(str(tmp_path / "cache.db"))
+    response_cache = cache.ResponseCache(backend)
+    backend.threads.clear()
+
+    async def fetch():
+        return {"docs": [1]}
+
+    async def run():
+        first = await response_cache.get_or_fetch_async("u", {"q": "x"}, fetch)
+        second = await response_cache.get_or_fetch_async("u", {"q": "x"}, fetch)
+        return threading.get_ident(), first, second
+
+    loop_thread, first, second = asyncio.run(run())
+    assert first == second == {"docs": [1]}
+    assert response_cache.counters["hits"] == 1
+    assert backend.threads and loop_thread not in backend.threads
+
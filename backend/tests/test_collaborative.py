@@ -0,0 +1,89 @@
+import os
+import time
+
+import pytest
+
+import collaborative
+import jobs
+from collaborative import ItemItemCF
+
+
+def test_recommends_co_purchased_items():
+    model = ItemItemCF()
+    model.add_feedback(1, 10, 3.0)
+    model.add_feedback(1, 11, 3.0)
+    model.add_feedback(2, 10, 3.0)
+    assert [item for item, _ in model.recommend(2)] == [11]
+    model.set_disliked(2, 11, True)
+    assert model.recommend(2) == []
+
+
+@pytest.fixture
+def no_model(tmp_path, monkeypatch):
+    """No model loaded in this process, and a private artifact path."""
+    monkeypatch.setattr(collaborative, "ARTIFACT_PATH", str(tmp_path / "cf" / "item_item.pkl"))
+    monkeypatch.setattr(collaborative, "_live", None)
+    monkeypatch.setattr(collaborative, "_live_mtime", None)
+    monkeypatch.setattr(collaborative, "_last_check", float("-inf"))
+
+
+def test_request_path_queues_a_fit_instead_of_fitting(client, no_model, monkeypatch):
+    import app
+    monkeypatch.setattr(ItemItemCF, "fit", lambda self, conn: (_ for _ in ()).throw(AssertionError("fitted inline")))
+    assert app.local_recommendations(1) == []
+    monkeypatch.setattr(collaborative, "_last_check", float("-inf"))
+    assert app.local_recommendations(1) == []
+    queued = [job for job in jobs.recent() if job['kind'] == 'fit_collaborative']
+    assert len(queued) == 1  # Deduplicated while queued
+
+
+def test_fit_job_artifact_is_warm_loaded_by_other_processes(db, no_model, monkeypatch):
+    db.executemany("INSERT INTO books (id, title, author) VALUES (?, 'b', 'a')", [(10,), (11,)])
+    db.executemany("INSERT INTO purchases (user_id, book_id) VALUES (?, ?)", [(1, 10), (1, 11), (2, 10)])
+    db.commit()
+    jobs.HANDLERS['fit_collaborative'](jobs.JobContext(jobs.submit('fit_collaborative'), {}))
+    assert os.path.exists(collaborative.ARTIFACT_PATH)
+
+    # Another worker: nothing loaded, never fits, picks the artifact up in the background
+    monkeypatch.setattr(collaborative, "_live", None)
+    monkeypatch.setattr(collaborative, "_live_mtime", None)
+    monkeypatch.setattr(ItemItemCF, "fit", lambda self, conn: pytest.fail("fitted outside the job"))
+    assert collaborative.live_model() is None
+    collaborative._load_thread.join(5)
+    assert [item for item, _ in collaborative.live_model().recommend(2)] == [11]
+
+
+def test_old_artifact_queues_a_periodic_refit(db, no_model, monkeypatch):
+    ItemItemCF().save(collaborative.ARTIFACT_PATH)
+    old = time.time() - collaborative.REFIT_SECONDS - 60
+    os.utime(collaborative.ARTIFACT_PATH, (old, old))
+    collaborative.live_model()
+    collaborative._load_thread.join(5)
+    assert collaborative.live_model_loaded()
+    assert [job for job in jobs.recent() if job['kind'] == 'fit_collaborative']
+
+
+def test_purchase_rejects_non_numeric_user_before_writing(client, db):
+    db.execute("INSERT INTO books (id, title, author) VALUES (1, 'b', 'a')")
+    db.commit()
+    response = client.post('/api/purchase', json={"user_id": "abc", "book_id": 1})
+    assert response.status_code == 400
+    assert db.execute("SELECT COUNT(*) FROM purchases").fetchone()[0] == 0
+
+
+def test_feed_rebuild_job_sees_feedback_recorded_by_another_process(db, no_model, monkeypatch):
+    import user_feeds
+    db.executemany("INSERT INTO books (id, title, author) VALUES (?, 'b', 'a')", [(10,), (11,), (12,)])
+    db.executemany("INSERT INTO purchases (user_id, book_id) VALUES (?, ?)", [(1, 10), (1, 11), (1, 12), (2, 10)])
+    db.commit()
+    collaborative.refit()
+    assert 11 in [item for item, _ in collaborative.get_live_model().recommend(2)]
+
+    # User 2 buys book 11 through some other worker: only the database knows
+    db.execute("INSERT INTO purchases (user_id, book_id) VALUES (2, 11)")
+    db.commit()
+    seen = []
+    monkeypatch.setattr(user_feeds, "builder", lambda user_id: seen.append(
+        [item for item, _ in collaborative.get_live_model().recommend(user_id)]) or ("label", [{"id": 1}]))
+    jobs.HANDLERS['rebuild_user_feed'](jobs.JobContext(jobs.submit('rebuild_user_feed', {'user_id': 2}), {}), user_id=2)
+    assert seen == [[12]]
@@ -0,0 +1,114 @@
+import pytest
+import requests
+
+import http_client
+from http_client import CircuitBreaker, CircuitOpenError, HttpClient
+
+
+def test_breaker_opens_and_half_opens(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(http_client.time, "monotonic", lambda: clock[0])
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+    clock[0] += 10
+    assert breaker.allow()        # The one trial request
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+@pytest.fixture
+def tripped(monkeypatch):
+    """An HttpClient whose host breaker is open and due for its half-open trial."""
+    clock = [100.0]
+    monkeypatch.setattr(http_client.time, "monotonic", lambda: clock[0])
+    client = HttpClient(retries=0)
+    host = client.host("http://upstream.test/x")
+    host.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    host.breaker.record_failure()
+    clock[0] += 10
+    return client, host, clock
+
+
+@pytest.mark.parametrize("error", [requests.exceptions.ChunkedEncodingError, requests.exceptions.ContentDecodingError,
+                                   requests.exceptions.InvalidURL])
+def test_failed_trial_with_any_request_exception_reopens(tripped, monkeypatch, error):
+    client, host, clock = tripped
+
+    def boom(*args, **kwargs):
+        raise error("broken")
+    monkeypatch.setattr(client.session, "request", boom)
+    with pytest.raises(error):
+        client.get("http://upstream.test/x")
+    assert host.breaker.state == "open"
+    clock[0] += 10
+    assert host.breaker.allow()  # Not stuck with a trial "in flight"
+
+
+def test_trial_interrupted_by_other_exception_is_released(tripped, monkeypatch):
+    client, host, clock = tripped
+
+    def boom(*args, **kwargs):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(client.session, "request", boom)
+    with pytest.raises(KeyboardInterrupt):
+        client.get("http://upstream.test/x")
+    assert host.breaker.allow()
+
+
+def test_open_circuit_rejects_without_network(tripped, monkeypatch):
+    client, host, clock = tripped
+    host.breaker.allow()  # Someone else holds the trial
+    monkeypatch.setattr(client.session, "request", lambda *a, **k: pytest.fail("touched the network"))
+    with pytest.raises(CircuitOpenError):
+        client.get("http://upstream.test/x")
+
+
+@pytest.fixture
+def async_tripped(monkeypatch):
+    """An AsyncHttpClient whose host is due for its half-open trial, answering with handlers[0]."""
+    httpx = pytest.importorskip("httpx")
+    client = HttpClient(retries=0)
+    host = client.host("http://upstream.test/x")
+    host.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)  # The real clock: asyncio needs it
+    host.breaker.record_failure()
+    async_client = http_client.AsyncHttpClient(client)
+    handlers = []
+    monkeypatch.setattr(async_client, "_session",
+                        lambda: httpx.AsyncClient(transport=httpx.MockTransport(lambda r: handlers[0](r))))
+    return async_client, host, handlers
+
+
+def test_cancelled_async_trial_is_released(async_tripped):
+    import asyncio
+    async_client, host, handlers = async_tripped
+
+    async def slow(request):
+        await asyncio.sleep(10)
+
+    handlers.append(slow)
+
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(async_client.get("http://upstream.test/x"), 0.05)
+
+    asyncio.run(run())
+    assert host.breaker.allow()
+
+
+def test_async_trial_failing_with_any_httpx_error_reopens(async_tripped):
+    import asyncio
+    import httpx
+    async_client, host, handlers = async_tripped
+
+    async def redirects(request):
+        raise httpx.TooManyRedirects("loop", request=request)
+
+    handlers.append(redirects)
+    with pytest.raises(httpx.TooManyRedirects):
+        asyncio.run(async_client.get("http://upstream.test/x"))
+    assert host.breaker.state == "open"
+    assert host.breaker.allow()  # reset_timeout=0: the next trial is allowed at once
@@ -0,0 +1,16 @@
+"""Importing external (OpenLibrary) books into the catalog."""
+import pytest
+
+
+@pytest.mark.parametrize("book_data, price", [
+    ({"price": 0}, 0),
+    ({"price": 349}, 349),
+    ({}, 199),
+    ({"price": None}, 199),
+])
+def test_import_keeps_the_given_price(client, db, book_data, price):
+    from app import import_external_book
+    book_id, imported = import_external_book(db, "ext_free_book", dict(book_data, title="t", author="a"))
+    db.commit()
+    assert imported
+    assert db.execute("SELECT price FROM books WHERE id = ?", (book_id,)).fetchone()[0] == price
@@ -0,0 +1,47 @@
+"""seed_database reports progress per fetched page, so a job can be cancelled mid-batch."""
+import pytest
+
+import ingest_archive
+
+pytestmark = pytest.mark.usefixtures("db")
+
+
+class Stop(Exception):
+    pass
+
+
+@pytest.fixture
+def fetched(monkeypatch):
+    """Serves fake subject pages instead of OpenLibrary; records what was fetched."""
+    calls = []
+
+    def fake_fetch(subject, limit=20, offset=0):
+        calls.append((subject, offset))
+        return [{"ia": [f"{subject}-{offset}"], "cover_i": 1, "title": f"{subject} {offset}"}]
+
+    monkeypatch.setattr(ingest_archive, "fetch_books_by_subject", fake_fetch)
+    return calls
+
+
+def seed(**kwargs):
+    return ingest_archive.seed_database(subjects=["a", "b"], pages=5, page_size=1, workers=1, rate=0, **kwargs)
+
+
+def test_progress_is_reported_for_every_page_within_one_batch(fetched):
+    reports = []
+    stats = seed(progress=reports.append)
+    assert stats["books_inserted"] == 10
+    # One report per page (the batch never filled), plus the final flush
+    assert [r["pages_fetched"] for r in reports] == list(range(1, 11)) + [10]
+
+
+def test_cancel_stops_the_run_before_the_batch_fills(fetched, db):
+    def progress(stats):
+        if stats["pages_fetched"] == 2:
+            raise Stop()
+
+    with pytest.raises(Stop):
+        seed(progress=progress)
+    # Only the bounded in-flight window was fetched, not every page
+    assert len(fetched) < 10
+    assert db.execute("SELECT COUNT(*) FROM books").fetchone()[0] == 0
@@ -0,0 +1,113 @@
+import time
+
+import pytest
+
+import database
+import jobs
+
+
+def active_jobs(db, key):
+    return db.execute("SELECT COUNT(*) FROM jobs WHERE dedupe_key = ? AND status IN ('queued', 'running')",
+                      (key,)).fetchone()[0]
+
+
+def test_submit_dedupes_active_jobs(db):
+    first = jobs.submit('refresh_feed_mirror', dedupe_key='k')
+    assert jobs.submit('refresh_feed_mirror', dedupe_key='k') == first
+    db.execute("UPDATE jobs SET status = 'done' WHERE id = ?", (first,))
+    db.commit()
+    assert jobs.submit('refresh_feed_mirror', dedupe_key='k') != first
+
+
+def test_submit_retries_when_active_job_finishes_mid_conflict(db, monkeypatch):
+    first = jobs.submit('refresh_feed_mirror', dedupe_key='k')
+
+    class FinishesBeforeSelect:
+        """The active job completes between the failed INSERT and the SELECT."""
+        def __init__(self, conn):
+            self.conn = conn
+
+        def execute(self, sql, params=()):
+            if sql.startswith("SELECT id FROM jobs"):
+                other = database.get_own_connection()
+                other.execute("UPDATE jobs SET status = 'done' WHERE id = ?", (first,))
+                other.commit()
+                other.close()
+            return self.conn.execute(sql, params)
+
+        def __getattr__(self, name):
+            return getattr(self.conn, name)
+
+    monkeypatch.setattr(jobs, "get_own_connection", lambda: FinishesBeforeSelect(database.get_own_connection()))
+    second = jobs.submit('refresh_feed_mirror', dedupe_key='k')
+    assert second != first
+    assert active_jobs(db, 'k') == 1
+
+
+def test_submit_leaves_the_request_transaction_alone(client):
+    from app import app
+    jobs.submit('refresh_feed_mirror', dedupe_key='k')
+    with app.test_request_context():
+        shared = database.get_db_connection()
+        shared.execute("BEGIN")
+        shared.execute("SELECT COUNT(*) FROM books").fetchone()
+        jobs.submit('refresh_feed_mirror', dedupe_key='k')  # Conflicts, then rolls back its own connection
+        assert shared.in_transaction
+        shared.rollback()
+
+
+@pytest.fixture
+def admin(monkeypatch):
+    import app
+    monkeypatch.setattr(app, "ADMIN_TOKEN", "s3cret")
+    return {"Authorization": "Bearer s3cret"}
+
+
+def test_jobs_api_requires_admin_token(client, admin):
+    assert client.post('/api/jobs', json={"kind": "refresh_feed_mirror"}).status_code == 401
+    assert client.post('/api/jobs', json={"kind": "refresh_feed_mirror"},
+                       headers={"Authorization": "Bearer nope"}).status_code == 401
+    assert client.post('/api/seed_db').status_code == 401
+    assert client.get('/api/jobs').status_code == 401
+
+
+def test_jobs_api_whitelists_payload_keys(client, admin):
+    response = client.post('/api/jobs', json={"kind": "seed_catalog", "payload": {"workers": 500}}, headers=admin)
+    assert response.status_code == 400
+    assert "workers" in response.json["error"]
+    response = client.post('/api/jobs', json={"kind": "seed_catalog", "payload": {"pages": 1}}, headers=admin)
+    assert response.status_code == 202
+    assert jobs.get(response.json["job_id"])["payload"] == {"pages": 1}
+
+
+def test_prune_deletes_only_old_finished_jobs(db):
+    db.executemany("INSERT INTO jobs (kind, status, finished_at) VALUES (?, ?, datetime('now', ?))", [
+        ('rebuild_user_feed', 'done', '-2 days'),
+        ('rebuild_user_feed', 'failed', '-2 days'),
+        ('rebuild_user_feed', 'cancelled', '-2 days'),
+        ('rebuild_user_feed', 'done', '-1 minutes'),
+    ])
+    db.execute("INSERT INTO jobs (kind, status) VALUES ('rebuild_user_feed', 'queued')")
+    db.commit()
+    assert jobs.prune(retention=3600) == 3
+    assert sorted(r[0] for r in db.execute("SELECT status FROM jobs")) == ['done', 'queued']
+
+
+def test_running_job_keeps_its_heartbeat_between_progress_calls(db, monkeypatch):
+    monkeypatch.setattr(jobs, "HEARTBEAT_INTERVAL", 0.05)
+
+    def long_fit(ctx):
+        conn = database.get_own_connection()
+        try:
+            conn.execute("UPDATE jobs SET heartbeat_at = datetime('now', '-1 hour') WHERE id = ?", (ctx.id,))
+            conn.commit()
+            time.sleep(0.5)  # No progress() calls in here
+            return conn.execute("SELECT heartbeat_at > datetime('now', ?) FROM jobs WHERE id = ?",
+                                (f"-{jobs.STALE_AFTER} seconds", ctx.id)).fetchone()[0]
+        finally:
+            conn.close()
+
+    monkeypatch.setitem(jobs.HANDLERS, 'long_fit', long_fit)
+    job_id = jobs.submit('long_fit')
+    assert jobs.run_next('test-worker')
+    assert jobs.get(job_id)['result'] == 1
@@ -0,0 +1,83 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import llm_gateway
+from llm_gateway import LLMError, LLMGateway
+
+
+class Upstream(BaseHTTPRequestHandler):
+    reply = (200, "application/json", b"{}")
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        status, content_type, body = self.server.reply
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def upstream():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Upstream)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+
+
+def sse(*events):
+    return "".join(f"data: {event}\n\n" for event in events).encode()
+
+
+BAD_REPLIES = {
+    "html error page": (502, "text/html", b"<html>Bad Gateway</html>"),
+    "non-JSON 200": (200, "application/json", b"not json"),
+    "no choices": (200, "application/json", b'{"id": "x"}'),
+    "null content": (200, "application/json", b'{"choices": [{"message": {"content": null}}]}'),
+    "malformed stream event": (200, "text/event-stream", sse('{"choices": [', "[DONE]")),
+    "non-object stream event": (200, "text/event-stream", sse('[1, 2]', "[DONE]")),
+    "choices of the wrong shape": (200, "text/event-stream", sse('{"choices": ["x"]}', "[DONE]")),
+}
+
+
+@pytest.mark.parametrize("name", sorted(BAD_REPLIES))
+def test_bad_upstream_replies_raise_llm_error(upstream, name):
+    upstream.reply = BAD_REPLIES[name]
+    gateway = LLMGateway(url=f"http://127.0.0.1:{upstream.server_port}/v1/chat/completions", timeout=5)
+    with pytest.raises(LLMError):
+        list(gateway.stream_chat([{"role": "user", "content": name}]))
+
+
+def test_streamed_reply_parses(upstream):
+    content = json.dumps({"search_query": "dune", "text": "Try Dune."})
+    deltas = [json.dumps({"choices": [{"delta": {"content": content[i:i + 7]}}]}) for i in range(0, len(content), 7)]
+    upstream.reply = (200, "text/event-stream", sse(*deltas, "[DONE]"))
+    gateway = LLMGateway(url=f"http://127.0.0.1:{upstream.server_port}/v1/chat/completions", timeout=5)
+    events = list(gateway.stream_chat([{"role": "user", "content": "dune"}]))
+    assert events[-1] == ("done", {"search_query": "dune", "text": "Try Dune.", "cached": False})
+
+
+@pytest.mark.parametrize("body", [b"not json", b'{"choices": []}', b'"just a string"'])
+def test_whole_reply_shape_errors(body):
+    with pytest.raises(LLMError):
+        LLMGateway._whole_reply(body, 200)
+
+
+def test_chat_endpoints_report_errors_as_json(client, upstream, monkeypatch):
+    import app
+    upstream.reply = BAD_REPLIES["html error page"]
+    monkeypatch.setattr(app, "librarian", LLMGateway(
+        url=f"http://127.0.0.1:{upstream.server_port}/v1/chat/completions", timeout=5))
+    response = client.post("/api/chat", json={"message": "hello"})
+    assert response.status_code == 500
+    assert "text" in response.json
+
+    stream = client.post("/api/chat/stream", json={"message": "hello again"}).get_data(as_text=True)
+    assert "event: error" in stream
@@ -0,0 +1,23 @@
+import pytest
+
+from migrations import HOT_QUERIES, MIGRATIONS, check_query_plans, current_version, plan_problems
+
+
+def test_migrates_to_latest_version(db):
+    assert current_version(db) == max(version for version, _, _ in MIGRATIONS)
+
+
+@pytest.mark.parametrize("name", sorted(HOT_QUERIES))
+def test_hot_query_uses_an_index(db, name):
+    sql, params = HOT_QUERIES[name]
+    plan = [row[3] for row in db.execute("EXPLAIN QUERY PLAN " + sql, params)]
+    assert plan_problems(plan) == [], f"{name}: {plan}"
+
+
+def test_check_query_plans_reports_nothing(db):
+    assert check_query_plans(db) == {}
+
+
+def test_check_query_plans_flags_a_scan(db, monkeypatch):
+    monkeypatch.setitem(HOT_QUERIES, "unindexed", ("SELECT id FROM books WHERE description = ?", ("x",)))
+    assert "unindexed" in check_query_plans(db)
@@ -0,0 +1,53 @@
+"""Upstream errors must never be cached as search results."""
+import asyncio
+import time
+
+import httpx
+import pytest
+import requests
+
+import cache
+import http_client
+import openlibrary
+
+ERROR_BODY = {"error": "search temporarily unavailable"}
+
+
+@pytest.fixture
+def search_cache(monkeypatch):
+    response_cache = cache.ResponseCache(cache.MemoryBackend(), ttl=1, stale_ttl=3600)
+    monkeypatch.setattr(openlibrary, "search_cache", response_cache)
+    return response_cache
+
+
+def error_response():
+    response = requests.Response()
+    response.status_code = 503
+    response._content = b'{"error": "search temporarily unavailable"}'
+    return response
+
+
+def test_error_status_is_not_cached(search_cache, monkeypatch):
+    monkeypatch.setattr(http_client, "get", lambda url, **kwargs: error_response())
+    with pytest.raises(requests.HTTPError):
+        openlibrary.search({"q": "dune"})
+    assert openlibrary.peek({"q": "dune"}) is None
+
+
+def test_error_status_keeps_serving_the_stale_copy(search_cache, monkeypatch):
+    params = dict({"q": "dune"}, fields=openlibrary.SEARCH_FIELDS)
+    search_cache.backend.set(cache.make_key(openlibrary.SEARCH_URL, params), {"docs": [1]}, time.time() - 10)
+    monkeypatch.setattr(http_client, "get", lambda url, **kwargs: error_response())
+    assert openlibrary.search({"q": "dune"}) == {"docs": [1]}
+    cache._refresh_executor().submit(int).result()  # Let the failed refresh finish
+    assert openlibrary.search({"q": "dune"}) == {"docs": [1]}
+
+
+def test_async_error_status_is_not_cached(search_cache, monkeypatch):
+    async def get(url, **kwargs):
+        return httpx.Response(503, json=ERROR_BODY, request=httpx.Request("GET", url))
+
+    monkeypatch.setattr(http_client.async_client, "get", get)
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(openlibrary.search_async({"q": "dune"}))
+    assert openlibrary.peek({"q": "dune"}) is None
@@ -0,0 +1,81 @@
+import pytest
+
+import passwords
+from passwords import TokenBuckets
+
+
+def test_bucket_allows_burst_then_reports_wait():
+    buckets = TokenBuckets(burst=3, per_minute=60)
+    assert [buckets.take("k", now=100.0) for _ in range(3)] == [0, 0, 0]
+    assert buckets.take("k", now=100.0) == pytest.approx(1.0)
+    assert buckets.take("k", now=101.0) == 0  # One token refilled per second
+
+
+def test_bucket_keys_are_independent_and_bounded():
+    buckets = TokenBuckets(burst=1, per_minute=1, max_keys=2)
+    assert buckets.take("a", now=1.0) == 0
+    assert buckets.take("b", now=1.0) == 0
+    assert buckets.take("a", now=1.0) > 0
+    buckets.take("c", now=1.0)
+    assert len(buckets) == 2
+
+
+def test_reset_refills():
+    buckets = TokenBuckets(burst=1, per_minute=1)
+    buckets.take("a", now=1.0)
+    buckets.reset("a")
+    assert buckets.take("a", now=1.0) == 0
+
+
+def test_hash_verify_and_rehash(monkeypatch):
+    monkeypatch.setattr(passwords, "METHOD", "pbkdf2:sha256:1000")
+    pwhash = passwords.hash_password("secret")
+    assert pwhash.startswith("pbkdf2:sha256:1000$")
+    assert passwords.verify(pwhash, "secret")
+    assert not passwords.verify(pwhash, "wrong")
+    assert not passwords.verify("hash", "secret")  # Seed placeholder
+    assert not passwords.needs_rehash(pwhash)
+    monkeypatch.setattr(passwords, "METHOD", "pbkdf2:sha256:2000")
+    assert passwords.needs_rehash(pwhash)
+
+
+@pytest.fixture
+def fresh_buckets(monkeypatch):
+    monkeypatch.setattr(passwords, "accounts", TokenBuckets(100, 1))
+    monkeypatch.setattr(passwords, "ips", TokenBuckets(2, 1))
+
+
+def signup(client, n, **headers):
+    return client.post("/api/signup", json={"email": f"u{n}@x.io", "password": "pw"}, headers=headers).status_code
+
+
+def test_forwarded_for_ignored_without_trusted_proxy(client, fresh_buckets, monkeypatch):
+    import app
+    monkeypatch.setattr(passwords, "METHOD", "pbkdf2:sha256:1000")
+    monkeypatch.setattr(app, "TRUSTED_PROXIES", 0)
+    codes = [signup(client, i, **{"X-Forwarded-For": f"10.0.0.{i}"}) for i in range(3)]
+    assert codes == [200, 200, 429]
+
+
+def test_spoofed_forwarded_for_entries_do_not_get_fresh_buckets(client, fresh_buckets, monkeypatch):
+    import app
+    monkeypatch.setattr(passwords, "METHOD", "pbkdf2:sha256:1000")
+    monkeypatch.setattr(app, "TRUSTED_PROXIES", 1)
+    # The proxy appends the real address; everything left of it is client-supplied
+    codes = [signup(client, i, **{"X-Forwarded-For": f"10.0.0.{i}, 203.0.113.7"}) for i in range(3)]
+    assert codes == [200, 200, 429]
+    assert signup(client, 9, **{"X-Forwarded-For": "203.0.113.8"}) == 200
+
+
+def test_forked_process_starts_its_own_pool(monkeypatch):
+    inherited = passwords.start()
+    monkeypatch.setattr(passwords, "_pool", inherited)  # Restored for the other tests
+    monkeypatch.setattr(passwords, "_pool_pid", -1)  # As if started by a preloading parent process
+    pool = passwords.start()
+    try:
+        assert pool is not inherited
+        assert pool._mp_context.get_start_method() in ("forkserver", "spawn")
+        monkeypatch.setattr(passwords, "METHOD", "pbkdf2:sha256:1000")
+        assert passwords.verify(passwords.hash_password("secret"), "secret")
+    finally:
+        pool.shutdown()
@@ -0,0 +1,113 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+import database
+import progress_buffer
+from progress_buffer import ProgressBuffer
+
+
+@pytest.fixture
+def reader(db):
+    db.execute("INSERT INTO users (id, name, email, password_hash) VALUES (1, 'r', 'r@x.io', 'x')")
+    db.execute("INSERT INTO books (id, title, author) VALUES (1, 'b', 'a')")
+    db.execute("INSERT INTO purchases (user_id, book_id, progress) VALUES (1, 1, 0)")
+    db.commit()
+    return db
+
+
+@pytest.fixture
+def make_buffer(tmp_path):
+    buffers = []
+
+    def make():
+        buffer = ProgressBuffer(directory=str(tmp_path / "logs"), interval_ms=60000)
+        buffers.append(buffer)
+        return buffer
+    yield make
+    for buffer in buffers:
+        buffer.stop()
+
+
+def progress(db):
+    return db.execute("SELECT progress FROM purchases WHERE user_id = 1 AND book_id = 1").fetchone()[0]
+
+
+def write_orphan(directory, name, progress_value):
+    with open(os.path.join(directory, name), "w") as f:
+        f.write(json.dumps([1, 1, progress_value, None]) + "\n")
+
+
+def test_flush_writes_latest_value_and_drops_the_log(reader, make_buffer):
+    buffer = make_buffer()
+    buffer.record(1, 1, progress=10)
+    buffer.record(1, 1, progress=20)
+    assert buffer.flush() == 1
+    assert progress(reader) == 20
+    assert not [n for n in os.listdir(buffer.directory) if n.endswith(".log") and f"-{buffer._seq}." not in n]
+
+
+def test_orphan_from_a_reused_pid_is_replayed_not_clobbered(reader, make_buffer):
+    buffer = make_buffer()
+    # A dead process that had our PID (container restart), with a different token
+    write_orphan(buffer.directory, f"progress-{os.getpid()}-deadbeefdeadbeef-1.log", 42)
+    assert buffer.replay_orphaned_logs() == 1
+    assert progress(reader) == 42
+    assert not any(n.startswith(("progress-", "replay-")) and "deadbeef" in n for n in os.listdir(buffer.directory))
+
+
+def test_pre_token_logs_are_replayed(reader, make_buffer):
+    buffer = make_buffer()
+    write_orphan(buffer.directory, "progress-999999-1.log", 7)
+    assert buffer.replay_orphaned_logs() == 1
+    assert progress(reader) == 7
+
+
+def test_logs_of_a_live_owner_are_left_alone(reader, make_buffer):
+    buffer = make_buffer()
+    token = "0123456789abcdef"
+    holder = subprocess.Popen([sys.executable, "-c", (
+        "import sys, time; sys.path.insert(0, sys.argv[1]); import progress_buffer; "
+        "progress_buffer._hold_owner_lock(sys.argv[2], sys.argv[3]); print('locked', flush=True); time.sleep(30)"),
+        os.path.dirname(progress_buffer.__file__), buffer.directory, token], stdout=subprocess.PIPE, text=True)
+    try:
+        assert holder.stdout.readline().strip() == "locked"
+        write_orphan(buffer.directory, f"progress-{holder.pid}-{token}-1.log", 5)
+        assert buffer.replay_orphaned_logs() == 0
+        assert progress(reader) == 0
+    finally:
+        holder.kill()
+        holder.wait()
+    # Once the owner is gone, the next start claims it
+    assert buffer.replay_orphaned_logs() == 1
+    assert progress(reader) == 5
+
+
+def test_two_buffers_in_one_process_keep_their_own_logs(reader, make_buffer):
+    first, second = make_buffer(), make_buffer()
+    first.record(1, 1, progress=3)
+    assert second.replay_orphaned_logs() == 0
+    assert first.flush() == 1
+    assert progress(reader) == 3
+
+
+def test_failed_flush_leaves_the_request_transaction_alone(reader, make_buffer, monkeypatch):
+    from app import app
+
+    def fail(conn, pending):
+        raise sqlite3.OperationalError("database is locked")
+
+    buffer = make_buffer()
+    buffer.record(1, 1, progress=42)
+    monkeypatch.setattr(progress_buffer, "write_batch", fail)
+    with app.test_request_context():
+        request_conn = database.get_db_connection()
+        request_conn.execute("UPDATE books SET title = 'edited' WHERE id = 1")
+        assert buffer.flush() == 0
+        assert request_conn.in_transaction  # The flush's rollback was on its own connection
+        request_conn.rollback()
+        request_conn.close()
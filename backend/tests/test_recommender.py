@@ -0,0 +1,98 @@
+import pytest
+
+import jobs
+import recommender
+
+
+class FakeModel:
+    def get_recommendations_for_id(self, book_id, k):
+        return [{"id": book_id + i + 1} for i in range(k)]
+
+
+@pytest.fixture
+def not_loaded(monkeypatch, tmp_path):
+    monkeypatch.setattr(recommender, "ARTIFACT_ROOT", str(tmp_path / "recommender"))
+    monkeypatch.setattr(recommender, "_live", None)
+    monkeypatch.setattr(recommender, "_live_version", None)
+    monkeypatch.setattr(recommender, "_last_load_attempt", 0.0)
+    monkeypatch.setattr(recommender, "_last_sync_check", 0.0)
+
+
+def add_book(db, title, description, category='Horror'):
+    cur = db.execute("INSERT INTO books (title, author, category, description) VALUES (?, 'a', ?, ?)",
+                     (title, category, description))
+    db.commit()
+    return cur.lastrowid
+
+
+def add_shelf(db):
+    """Enough books that one import stays under the refit threshold."""
+    return [add_book(db, f'Ghosts {i}', f'ghosts haunt the old house number {i}') for i in range(6)]
+
+
+def wait_for_load():
+    recommender._load_thread.join(timeout=10)
+
+
+def test_similar_limit_falls_back_on_bad_values(client, monkeypatch):
+    monkeypatch.setattr(recommender, "_live", FakeModel())
+    assert len(client.get('/api/similar/1?limit=abc').json) == 5
+    assert len(client.get('/api/similar/1?limit=3').json) == 3
+    assert len(client.get('/api/similar/1?limit=999').json) == 50
+
+
+def test_similar_queues_a_fit_instead_of_fitting_inline(client, db, not_loaded, monkeypatch):
+    db.execute("INSERT INTO books (title, author, category, description) VALUES ('b', 'a', 'Horror', 'ghosts')")
+    db.commit()
+    monkeypatch.setattr(recommender.Recommender, "_train_model", lambda self: pytest.fail("fitted"))
+    response = client.get('/api/similar/1')
+    assert response.status_code == 503
+    assert response.headers['Retry-After']
+    recommender._load_thread.join(timeout=5)
+    assert [job['kind'] for job in jobs.recent()] == ['rebuild_recommender']
+    assert not recommender.live_model_loaded()
+
+
+def test_similar_on_an_empty_catalog_is_empty(client, not_loaded):
+    assert client.get('/api/similar/1').json == []
+
+
+def test_import_elsewhere_warm_loads_the_stale_artifact(client, db, not_loaded, monkeypatch):
+    first = add_shelf(db)[0]
+    recommender.Recommender.from_db(artifact_root=recommender.ARTIFACT_ROOT)
+    imported = add_book(db, 'Haunting', 'a haunted house full of ghosts')  # Imported by another worker
+
+    monkeypatch.setattr(recommender.Recommender, "_train_model", lambda self: pytest.fail("fitted"))
+    assert client.get(f'/api/similar/{first}').status_code == 503
+    wait_for_load()
+    assert jobs.recent() == []
+    assert imported in [book['id'] for book in client.get(f'/api/similar/{first}?limit=10').json]
+
+
+def test_display_only_edits_keep_the_artifact(db, not_loaded, monkeypatch):
+    book_id = add_book(db, 'Ghosts', 'ghosts haunt the old house')
+    add_book(db, 'Spirits', 'spirits haunt the house at night')
+    fitted = recommender.Recommender.from_db(artifact_root=recommender.ARTIFACT_ROOT)
+    db.execute("UPDATE books SET price = 0, cover_url = 'x.jpg' WHERE id = ?", (book_id,))
+    db.commit()
+
+    model = recommender.Recommender.from_db(artifact_root=recommender.ARTIFACT_ROOT, fit=False)
+    assert model.artifact_dir == fitted.artifact_dir
+    assert model.df.set_index('id').loc[book_id, 'cover_url'] == 'x.jpg'
+
+
+def test_loaded_worker_catches_up_with_other_workers(db, not_loaded):
+    first, gone = add_shelf(db)[:2]
+    recommender.Recommender.from_db(artifact_root=recommender.ARTIFACT_ROOT)
+    assert recommender.load_in_background() is None
+    wait_for_load()
+    model = recommender.load_in_background()
+
+    imported = add_book(db, 'Haunting', 'a haunted house full of ghosts')
+    db.execute("DELETE FROM books WHERE id = ?", (gone,))
+    db.commit()
+    recommender._last_sync_check = float('-inf')
+    recommender.load_in_background()
+    wait_for_load()
+    ids = [book['id'] for book in model.get_recommendations_for_id(first, 10)]
+    assert imported in ids and gone not in ids
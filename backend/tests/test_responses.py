@@ -0,0 +1,71 @@
+"""Accept-Encoding negotiation and the tuple-cursor JSON path."""
+import pytest
+
+import responses
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip", "gzip"),
+    ("gzip, deflate", "gzip"),
+    ("GZIP", "gzip"),
+    ("gzip;q=0", None),
+    ("gzip;q=0, *", None),
+    ("*;q=0.5", "gzip"),
+    ("identity", None),
+    ("x-gzip-ish", None),
+    ("", None),
+])
+def test_choose_encoding_without_brotli(header, expected, monkeypatch):
+    monkeypatch.setattr(responses, "brotli", None)
+    assert responses.choose_encoding(header) == expected
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip, br", "br"),
+    ("br;q=0, gzip", "gzip"),
+    ("br;q=0.5, gzip;q=0.8", "gzip"),
+    ("*", "br"),
+])
+def test_choose_encoding_with_brotli(header, expected, monkeypatch):
+    monkeypatch.setattr(responses, "brotli", object())
+    assert responses.choose_encoding(header) == expected
+
+
+def test_refused_gzip_is_not_sent(client, db, monkeypatch):
+    monkeypatch.setattr(responses, "brotli", None)
+    db.executemany("INSERT INTO books (title, author) VALUES (?, 'a')", [(f"book {i}",) for i in range(50)])
+    db.commit()
+    assert client.get('/api/books', headers={"Accept-Encoding": "gzip"}).headers["Content-Encoding"] == "gzip"
+    assert "Content-Encoding" not in client.get('/api/books', headers={"Accept-Encoding": "gzip;q=0"}).headers
+
+
+def test_rows_response_keys_rows_by_column(client, db):
+    db.execute("INSERT INTO books (title, author) VALUES ('t', 'a')")
+    db.commit()
+    with client.application.app_context():
+        cur = responses.tuple_cursor(db)
+        cur.execute("SELECT title, author FROM books")
+        assert responses.rows_response(cur).json == [{"author": "a", "title": "t"}]
+
+
+@pytest.mark.parametrize("encoder", ["orjson", "stdlib"])
+def test_rows_response_matches_the_dict_baseline(client, db, encoder, monkeypatch):
+    if encoder == "stdlib":
+        monkeypatch.setattr(responses, "orjson", None)
+    elif responses.orjson is None:
+        pytest.skip("orjson not installed")
+    db.executemany("INSERT INTO books (title, author, price, rating) VALUES (?, ?, ?, ?)", [
+        ('Caf\u00e9 "Noir", 50%', 'Ana\u00efs\n\u00c9', 0, 4.25),
+        ('\U0001f4da\\', '', 1999, None),
+    ])
+    db.commit()
+    query = 'SELECT title, id, author, price AS "50%", rating, title AS "id", price AS "\u00e9" FROM books ORDER BY id'
+    with client.application.app_context():
+        cur = responses.tuple_cursor(db)
+        cur.execute(query)
+        names = [col[0] for col in cur.description]
+        baseline = client.application.json.response([dict(zip(names, row)) for row in cur]).get_data()
+        cur.execute(query)
+        assert responses.rows_response(cur).get_data() == baseline
+        cur.execute(query + " LIMIT 0")
+        assert responses.rows_response(cur).get_data() == b"[]"
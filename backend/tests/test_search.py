@@ -0,0 +1,31 @@
+import pytest
+
+
+@pytest.fixture
+def catalog(db, monkeypatch):
+    import openlibrary
+    monkeypatch.setattr(openlibrary, "peek", lambda params: {"docs": []})  # External top-up already cached, empty
+    db.executemany("INSERT INTO books (title, author, category, description) VALUES (?, ?, ?, ?)", [
+        ('Dune', 'Frank Herbert', 'Science Fiction', 'desert planet spice'),
+        ('Dune Messiah', 'Frank Herbert', 'Science Fiction', 'the emperor'),
+        ('Emma', 'Jane Austen', 'Romance', 'matchmaking'),
+    ])
+    db.commit()
+    return db
+
+
+def titles(response):
+    return [book['title'] for book in response.json['results']]
+
+
+def test_search_ranks_local_matches(client, catalog):
+    response = client.get('/api/search?q=dune&per_page=2')
+    assert response.status_code == 200
+    assert set(titles(response)) == {'Dune', 'Dune Messiah'}
+
+
+@pytest.mark.parametrize("args", ["page=abc", "per_page=lots", "page=&per_page=1.5", "page=-3"])
+def test_bad_paging_values_fall_back_to_defaults(client, catalog, args):
+    response = client.get(f'/api/search?q=herbert&{args}')
+    assert response.status_code == 200
+    assert set(titles(response)) == {'Dune', 'Dune Messiah'}
@@ -0,0 +1,141 @@
+"""
+Materialized per-user recommended rows for /api/global_feed.
+
+The recommended row is the part of the home feed that depends on the user
+(CF picks or an OpenLibrary interest search); the genre rows come from the
+local mirror (feed_mirror.py). It is stored in user_feeds and served with one
+primary-key read. Triggers on purchases, interactions and user_profiles bump
+the user's epoch, so a row is rebuilt only when that user's signals changed
+(or it is older than MAX_AGE, since CF picks also move with other readers).
+
+Stale rows are still served while a rebuild_user_feed job replaces them; only
+a user's very first feed is computed inline.
+"""
+import json
+import os
+import threading
+import time
+
+import jobs
+from database import get_db_connection
+
+MAX_AGE = int(os.environ.get("PAPERO_USER_FEED_MAX_AGE", 3600))  # Seconds
+
+builder = None  # compute(user_id) -> (label, books); app.py registers fetch_recommended_row
+
+_lock = threading.Lock()
+metrics = {
+    "hits": 0, "stale_hits": 0, "misses": 0, "builds": 0, "build_errors": 0,
+    "build_ms_total": 0.0, "stale_age_s_total": 0.0, "max_stale_age_s": 0.0,
+}
+
+
+def _count(**increments):
+    with _lock:
+        for key, value in increments.items():
+            metrics[key] += value
+
+
+def load(user_id):
+    """(label, books, stale) for the user's materialized row, or None if it was never built."""
+    conn = get_db_connection()
+    try:
+        row = conn.execute("SELECT epoch, built_epoch, label, books, built_at FROM user_feeds WHERE user_id = ?",
+                           (user_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None or row[1] is None:
+        _count(misses=1)
+        return None
+    epoch, built_epoch, label, books, built_at = row
+    age = time.time() - built_at
+    if epoch != built_epoch or age > MAX_AGE:
+        _count(stale_hits=1, stale_age_s_total=age)
+        with _lock:
+            metrics["max_stale_age_s"] = max(metrics["max_stale_age_s"], round(age, 1))
+        return label, json.loads(books), True
+    _count(hits=1)
+    return label, json.loads(books), False
+
+
+def begin_build(user_id):
+    """Returns the epoch a build starting now is based on. Pair with store()."""
+    conn = get_db_connection()
+    try:
+        # The row must exist before we read its epoch, or a purchase made during the build would not bump it
+        conn.execute("INSERT OR IGNORE INTO user_feeds (user_id) VALUES (?)", (user_id,))
+        conn.commit()
+        return conn.execute("SELECT epoch FROM user_feeds WHERE user_id = ?", (user_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def store(user_id, epoch, label, books, build_ms):
+    """Saves a built row. A row built from an older epoch than the stored one is dropped."""
+    if not books:
+        _count(build_errors=1)  # Upstream failed; don't pin an empty row until the next invalidation
+        return False
+    conn = get_db_connection()
+    try:
+        cur = conn.execute('''
+            UPDATE user_feeds SET built_epoch = ?, label = ?, books = ?, built_at = ?, build_ms = ?
+            WHERE user_id = ? AND (built_epoch IS NULL OR built_epoch <= ?)
+        ''', (epoch, label, json.dumps(books), time.time(), build_ms, user_id, epoch))
+        conn.commit()
+    finally:
+        conn.close()
+    _count(builds=1, build_ms_total=build_ms)
+    return cur.rowcount > 0
+
+
+def build(user_id, compute):
+    """Runs compute(user_id) -> (label, books) and stores the result. Returns (label, books)."""
+    epoch = begin_build(user_id)
+    start = time.perf_counter()
+    label, books = compute(user_id)
+    store(user_id, epoch, label, books, (time.perf_counter() - start) * 1000)
+    return label, books
+
+
+def request_rebuild(user_id):
+    """Queues an asynchronous rebuild (deduplicated per user)."""
+    return jobs.submit('rebuild_user_feed', {'user_id': user_id}, dedupe_key=f'user_feed:{user_id}')
+
+
+def rebuild_materialized(user_ids):
+    """request_rebuild() for those of `user_ids` that have a built row; the rest build on their first visit."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return []
+    conn = get_db_connection()
+    try:
+        built = [row[0] for row in conn.execute(
+            f"SELECT user_id FROM user_feeds WHERE user_id IN ({','.join('?' * len(user_ids))}) AND built_epoch IS NOT NULL",
+            user_ids)]
+    finally:
+        conn.close()
+    return [request_rebuild(user_id) for user_id in built]
+
+
+def stats():
+    conn = get_db_connection()
+    try:
+        rows, stale = conn.execute('''
+            SELECT COUNT(*), COALESCE(SUM(built_epoch IS NULL OR epoch != built_epoch OR built_at < ?), 0)
+            FROM user_feeds
+        ''', (time.time() - MAX_AGE,)).fetchone()
+    finally:
+        conn.close()
+    with _lock:
+        m = dict(metrics)
+    served = m["hits"] + m["stale_hits"] + m["misses"]
+    return {
+        "hits": m["hits"], "stale_hits": m["stale_hits"], "misses": m["misses"],
+        "hit_ratio": round((m["hits"] + m["stale_hits"]) / served, 3) if served else 0.0,
+        "fresh_ratio": round(m["hits"] / served, 3) if served else 0.0,
+        "avg_stale_age_s": round(m["stale_age_s_total"] / m["stale_hits"], 1) if m["stale_hits"] else 0.0,
+        "max_stale_age_s": m["max_stale_age_s"],
+        "builds": m["builds"], "build_errors": m["build_errors"],
+        "avg_build_ms": round(m["build_ms_total"] / m["builds"], 1) if m["builds"] else 0.0,
+        "rows": rows, "stale_rows": stale,
+    }